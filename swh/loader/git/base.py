@@ -5,8 +5,10 @@
 
 import collections
 import logging
+import queue
+import threading
 import time
-from typing import Dict, Iterable
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
 
 from swh.loader.core.loader import BaseLoader
 from swh.model.model import (
@@ -24,17 +26,213 @@ logger = logging.getLogger(__name__)
 # Print a log message every LOGGING_INTERVAL
 LOGGING_INTERVAL = 180
 
+DEFAULT_STORAGE_BATCH_SIZE: Dict[str, int] = {
+    "content": 1000,
+    "content_bytes": 100 * 1024 * 1024,
+    "skipped_content": 1000,
+    "directory": 1000,
+    "revision": 1000,
+    "release": 1000,
+}
+"""Maximum number of objects (and of content bytes, for ``content_bytes``) sent to
+the storage in a single ``*_add`` call"""
+
+
+class StorageWriterPool:
+    """Threads sending batches of objects to the storage in the background.
+
+    Batches are queued in a bounded queue, so that producers block when the
+    storage is slower than them. The first exception raised by a storage call is
+    re-raised in the producer thread by the next call to :meth:`submit` or
+    :meth:`join`.
+
+    Args:
+        threads: number of writer threads
+        queue_size: maximum number of batches waiting to be written
+    """
+
+    def __init__(self, threads: int, queue_size: int):
+        self.queue: queue.Queue[
+            Optional[Tuple[Callable[[List[Any]], Dict[str, int]], List[Any]]]
+        ] = queue.Queue(maxsize=queue_size)
+        self.summary: Dict[str, int] = collections.Counter()
+        self.lock = threading.Lock()
+        self.error: Optional[BaseException] = None
+        self.threads = [
+            threading.Thread(target=self._run, name=f"storage-writer-{i}", daemon=True)
+            for i in range(threads)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                add, objects = item
+                if self.error is None:
+                    summary = add(objects)
+                    with self.lock:
+                        self.summary.update(summary)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def submit(
+        self, add: Callable[[List[Any]], Dict[str, int]], objects: List[Any]
+    ) -> None:
+        """Queue a call of `add` on `objects`"""
+        self._check_error()
+        self.queue.put((add, objects))
+
+    def pop_summary(self) -> Dict[str, int]:
+        """Return the summary of the storage calls which completed since the
+        last call to this method"""
+        with self.lock:
+            summary, self.summary = self.summary, collections.Counter()
+        return summary
+
+    def join(self) -> Dict[str, int]:
+        """Wait for all the queued batches to be written, and return the summary of
+        the storage calls"""
+        self.queue.join()
+        self._check_error()
+        return self.pop_summary()
+
+    def close(self) -> None:
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+class StorageBatch:
+    """Accumulate objects of a given type in order to send them to the storage
+    with a single call to its ``*_add`` endpoint.
+
+    If ``target_latency`` is set, the number of objects sent in each batch adapts
+    to the observed duration of the ``*_add`` calls: it is halved when a call takes
+    longer than ``target_latency`` seconds, and doubled (up to ``max_count``) when
+    a full batch takes less than half that.
+
+    Args:
+        add: storage endpoint to call with each batch
+        max_count: maximum number of objects in a batch
+        max_bytes: maximum cumulated length of the contents in a batch
+        target_latency: expected duration of a call to `add`, in seconds
+        writers: if set, batches are sent to the storage by these writer threads
+          instead of the calling thread
+    """
+
+    def __init__(
+        self,
+        add: Callable[[List[Any]], Dict[str, int]],
+        max_count: int,
+        max_bytes: Optional[int] = None,
+        target_latency: Optional[float] = None,
+        writers: Optional[StorageWriterPool] = None,
+    ):
+        self.add_objects = add
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.target_latency = target_latency
+        self.writers = writers
+        self.batch_count = max_count
+        # batches may be written, hence adapt the batch count, from several
+        # writer threads at once
+        self.batch_count_lock = threading.Lock()
+        self.objects: List[Any] = []
+        self.bytes = 0
+
+    def add(self, obj: Any) -> Dict[str, int]:
+        """Add `obj` to the current batch, sending the batch to the storage if it
+        is full. Returns the summary of the storage call, if any."""
+        self.objects.append(obj)
+        if self.max_bytes is not None:
+            self.bytes += getattr(obj, "length", 0)
+            if self.bytes >= self.max_bytes:
+                return self.flush()
+        if len(self.objects) >= self.batch_count:
+            return self.flush()
+        return {}
+
+    def flush(self) -> Dict[str, int]:
+        """Send the current batch to the storage.
+
+        When using writer threads, this returns the summary of the storage calls
+        completed so far instead of the one of the current batch."""
+        if self.objects:
+            objects, self.objects, self.bytes = self.objects, [], 0
+            if self.writers is None:
+                return self._add(objects)
+            self.writers.submit(self._add, objects)
+
+        if self.writers is not None:
+            return self.writers.pop_summary()
+        return {}
+
+    def _add(self, objects: List[Any]) -> Dict[str, int]:
+        start_time = time.monotonic()
+        summary = self.add_objects(objects)
+        self._adapt(time.monotonic() - start_time, len(objects))
+        return summary
+
+    def _adapt(self, duration: float, count: int) -> None:
+        if self.target_latency is None:
+            return
+        with self.batch_count_lock:
+            if duration > self.target_latency:
+                self.batch_count = max(1, count // 2)
+            elif duration < self.target_latency / 2 and count >= self.batch_count:
+                self.batch_count = min(self.max_count, self.batch_count * 2)
+
 
 class BaseGitLoader(BaseLoader):
     """This base class is a pattern for both git loaders
 
     Those loaders are able to load all the data in one go.
+
+    Args:
+        storage_batch_size: overrides of :data:`DEFAULT_STORAGE_BATCH_SIZE`
+        storage_batch_target_latency: if set, expected duration of a storage call,
+          in seconds, used to adapt the size of the batches; by default, batches
+          always have the size given by ``storage_batch_size``
+        storage_writer_threads: if positive, number of threads sending batches
+          to the storage while the loader keeps converting objects; the storage
+          must then be safe to use from several threads
+        storage_writer_queue_size: maximum number of batches waiting for a
+          writer thread
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(
+        self,
+        *args,
+        storage_batch_size: Optional[Mapping[str, int]] = None,
+        storage_batch_target_latency: Optional[float] = None,
+        storage_writer_threads: int = 0,
+        storage_writer_queue_size: int = 4,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
 
+        self.storage_batch_size = {
+            **DEFAULT_STORAGE_BATCH_SIZE,
+            **(storage_batch_size or {}),
+        }
+        self.storage_batch_target_latency = storage_batch_target_latency
+        self.storage_writer_threads = storage_writer_threads
+        self.storage_writer_queue_size = storage_writer_queue_size
         self.next_log_after = time.monotonic() + LOGGING_INTERVAL
+        self.known_objects: Dict[str, int] = collections.Counter()
+        """Number of objects of each type that :meth:`get_contents` and similar
+        methods did not return because they are already in the archive"""
 
     def cleanup(self) -> None:
         """Clean up an eventual state installed for computations."""
@@ -72,6 +270,16 @@ class BaseGitLoader(BaseLoader):
         """Get the releases that need to be loaded"""
         raise NotImplementedError
 
+    def expected_object_count(self) -> Optional[int]:
+        """Number of objects :meth:`store_data` is expected to process, if known
+        in advance, to log its progress"""
+        return None
+
+    def has_snapshot(self) -> bool:
+        """Checks whether we need to load the snapshot, ie. whether all the
+        objects it references were loaded"""
+        return True
+
     def get_snapshot(self) -> Snapshot:
         """Get the snapshot that needs to be loaded"""
         raise NotImplementedError
@@ -106,70 +314,131 @@ class BaseGitLoader(BaseLoader):
 
         counts: Dict[str, int] = collections.defaultdict(int)
         storage_summary: Dict[str, int] = collections.Counter()
+        self.known_objects.clear()
 
         def sum_counts():
-            return sum(counts.values())
+            return sum(counts.values()) + sum(self.known_objects.values())
 
         def sum_storage():
             return sum(storage_summary[f"{object_type}:add"] for object_type in counts)
 
+        expected_count = self.expected_object_count()
+
         def maybe_log_summary(msg, force=False):
-            self.maybe_log(
-                msg + ": processed %s objects, %s are new",
-                sum_counts,
-                sum_storage,
-                force=force,
+            if expected_count:
+                self.maybe_log(
+                    msg + ": processed %s objects out of %s (%.1f%%), %s are new",
+                    sum_counts,
+                    expected_count,
+                    lambda: 100 * sum_counts() / expected_count,
+                    sum_storage,
+                    force=force,
+                )
+            else:
+                self.maybe_log(
+                    msg + ": processed %s objects, %s are new",
+                    sum_counts,
+                    sum_storage,
+                    force=force,
+                )
+
+        writers = (
+            StorageWriterPool(
+                self.storage_writer_threads, self.storage_writer_queue_size
+            )
+            if self.storage_writer_threads > 0
+            else None
+        )
+
+        def batch(object_type: str, add: Callable[[List[Any]], Dict[str, int]]):
+            return StorageBatch(
+                add,
+                max_count=self.storage_batch_size[object_type],
+                max_bytes=self.storage_batch_size.get(f"{object_type}_bytes"),
+                target_latency=self.storage_batch_target_latency,
+                writers=writers,
             )
 
-        if self.has_contents():
-            for obj in self.get_contents():
-                if isinstance(obj, Content):
-                    counts["content"] += 1
-                    storage_summary.update(self.storage.content_add([obj]))
-                elif isinstance(obj, SkippedContent):
-                    counts["skipped_content"] += 1
-                    storage_summary.update(self.storage.skipped_content_add([obj]))
-                else:
-                    raise TypeError(f"Unexpected content type: {obj}")
-
-                maybe_log_summary("In contents")
-
-            storage_summary.update(self.flush())
-            maybe_log_summary("After contents", force=True)
-
-        if self.has_directories():
-            for directory in self.get_directories():
-                counts["directory"] += 1
-                storage_summary.update(self.storage.directory_add([directory]))
-                maybe_log_summary("In directories")
-
-            storage_summary.update(self.flush())
-            maybe_log_summary("After directories", force=True)
-
-        if self.has_revisions():
-            for revision in self.get_revisions():
-                counts["revision"] += 1
-                storage_summary.update(self.storage.revision_add([revision]))
-                maybe_log_summary("In revisions")
-
+        def count_known_objects(object_type: str) -> None:
+            # Objects filtered out before reaching the storage count as filtered
+            known = self.known_objects.pop(object_type, 0)
+            if known:
+                counts[object_type] += known
+
+        def flush_batches(*batches: StorageBatch) -> None:
+            # All the objects of a given type must be in the storage before we
+            # start sending objects that may reference them
+            for batch_ in batches:
+                storage_summary.update(batch_.flush())
+            if writers is not None:
+                storage_summary.update(writers.join())
             storage_summary.update(self.flush())
-            maybe_log_summary("After revisions", force=True)
 
-        if self.has_releases():
-            for release in self.get_releases():
-                counts["release"] += 1
-                storage_summary.update(self.storage.release_add([release]))
-                maybe_log_summary("In releases")
+        try:
+            if self.has_contents():
+                contents = batch("content", self.storage.content_add)
+                skipped_contents = batch(
+                    "skipped_content", self.storage.skipped_content_add
+                )
+                for obj in self.get_contents():
+                    if isinstance(obj, Content):
+                        counts["content"] += 1
+                        storage_summary.update(contents.add(obj))
+                    elif isinstance(obj, SkippedContent):
+                        counts["skipped_content"] += 1
+                        storage_summary.update(skipped_contents.add(obj))
+                    else:
+                        raise TypeError(f"Unexpected content type: {obj}")
+
+                    maybe_log_summary("In contents")
+
+                count_known_objects("content")
+                flush_batches(contents, skipped_contents)
+                maybe_log_summary("After contents", force=True)
+
+            if self.has_directories():
+                directories = batch("directory", self.storage.directory_add)
+                for directory in self.get_directories():
+                    counts["directory"] += 1
+                    storage_summary.update(directories.add(directory))
+                    maybe_log_summary("In directories")
+
+                count_known_objects("directory")
+                flush_batches(directories)
+                maybe_log_summary("After directories", force=True)
+
+            if self.has_revisions():
+                revisions = batch("revision", self.storage.revision_add)
+                for revision in self.get_revisions():
+                    counts["revision"] += 1
+                    storage_summary.update(revisions.add(revision))
+                    maybe_log_summary("In revisions")
+
+                count_known_objects("revision")
+                flush_batches(revisions)
+                maybe_log_summary("After revisions", force=True)
+
+            if self.has_releases():
+                releases = batch("release", self.storage.release_add)
+                for release in self.get_releases():
+                    counts["release"] += 1
+                    storage_summary.update(releases.add(release))
+                    maybe_log_summary("In releases")
+
+                count_known_objects("release")
+                flush_batches(releases)
+                maybe_log_summary("After releases", force=True)
+        finally:
+            if writers is not None:
+                writers.close()
+
+        if self.has_snapshot():
+            snapshot = self.get_snapshot()
+            counts["snapshot"] += 1
+            storage_summary.update(self.storage.snapshot_add([snapshot]))
 
             storage_summary.update(self.flush())
-            maybe_log_summary("After releases", force=True)
-
-        snapshot = self.get_snapshot()
-        counts["snapshot"] += 1
-        storage_summary.update(self.storage.snapshot_add([snapshot]))
-
-        storage_summary.update(self.flush())
-        self.loaded_snapshot_id = snapshot.id
+            self.loaded_snapshot_id = snapshot.id
 
         for object_type, total in counts.items():
             filtered = total - storage_summary[f"{object_type}:add"]
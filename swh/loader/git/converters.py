@@ -5,18 +5,18 @@
 
 """Convert dulwich objects to dictionaries suitable for swh.storage"""
 
+import binascii
 import logging
-import re
-from typing import Any, Dict, Optional, cast
+import stat
+from typing import Any, Dict, Iterator, List, Optional, Tuple, cast
 
 import attr
-from dulwich.objects import Blob, Commit, ShaFile, Tag, Tree, _parse_message
+from dulwich.objects import Blob, Commit, ShaFile, Tag, Tree
 
 from swh.model.hashutil import (
     DEFAULT_ALGORITHMS,
     MultiHash,
     git_object_header,
-    hash_to_bytes,
     hash_to_hex,
 )
 from swh.model.model import (
@@ -44,8 +44,6 @@ TREE_MODE_MASK = 0o040000
 """Mode/perms of tree entries that point to a tree.
 They are normally equal to this mask, but may have more bits set to 1."""
 
-AUTHORSHIP_LINE_RE = re.compile(rb"^.*> (?P<timestamp>\S+) (?P<timezone>\S+)$")
-
 logger = logging.getLogger(__name__)
 
 
@@ -62,16 +60,22 @@ def check_id(obj: HashableObject) -> None:
         )
 
 
-def dulwich_blob_to_content_id(obj: ShaFile) -> Dict[str, Any]:
-    """Convert a dulwich blob to a Software Heritage content id"""
-    if obj.type_name != Blob.type_name:
-        raise ValueError("Argument is not a blob.")
-    blob = cast(Blob, obj)
-
-    size = blob.raw_length()
-    data = blob.as_raw_string()
-    hashes = MultiHash.from_data(data, DEFAULT_ALGORITHMS).digest()
-    if hashes["sha1_git"] != blob.sha().digest():
+def _blob_hashes(
+    blob: Blob, chunks: List[bytes], sha1_git_verified: bool
+) -> Dict[str, Any]:
+    """Compute the content hashes of `blob`, whose data is made of `chunks`, in
+    a single pass over them"""
+    size = sum(map(len, chunks))
+    algorithms = (
+        DEFAULT_ALGORITHMS - {"sha1_git"} if sha1_git_verified else DEFAULT_ALGORITHMS
+    )
+    hasher = MultiHash(algorithms, length=size)
+    for chunk in chunks:
+        hasher.update(chunk)
+    hashes = hasher.digest()
+    if sha1_git_verified:
+        hashes["sha1_git"] = blob.sha().digest()
+    elif hashes["sha1_git"] != blob.sha().digest():
         raise HashMismatch(
             f"Expected Content hash to be {blob.sha().digest().hex()}, "
             f"got {hashes['sha1_git'].hex()}"
@@ -80,13 +84,33 @@ def dulwich_blob_to_content_id(obj: ShaFile) -> Dict[str, Any]:
     return hashes
 
 
-def dulwich_blob_to_content(obj: ShaFile, max_content_size=None) -> BaseContent:
-    """Convert a dulwich blob to a Software Heritage content"""
+def dulwich_blob_to_content_id(
+    obj: ShaFile, sha1_git_verified: bool = False
+) -> Dict[str, Any]:
+    """Convert a dulwich blob to a Software Heritage content id.
+
+    With `sha1_git_verified`, the id of the blob is trusted to be the hash of
+    its data, as is the case for objects hashed while inflating a packfile, and
+    is used as ``sha1_git`` instead of being computed again."""
     if obj.type_name != Blob.type_name:
         raise ValueError("Argument is not a blob.")
     blob = cast(Blob, obj)
 
-    hashes = dulwich_blob_to_content_id(blob)
+    return _blob_hashes(blob, blob.as_raw_chunks(), sha1_git_verified)
+
+
+def dulwich_blob_to_content(
+    obj: ShaFile, max_content_size=None, sha1_git_verified: bool = False
+) -> BaseContent:
+    """Convert a dulwich blob to a Software Heritage content.
+
+    See :func:`dulwich_blob_to_content_id` for `sha1_git_verified`."""
+    if obj.type_name != Blob.type_name:
+        raise ValueError("Argument is not a blob.")
+    blob = cast(Blob, obj)
+
+    data = blob.as_raw_string()
+    hashes = _blob_hashes(blob, [data], sha1_git_verified)
     if max_content_size is not None and hashes["length"] >= max_content_size:
         return SkippedContent(
             status="absent",
@@ -95,24 +119,58 @@ def dulwich_blob_to_content(obj: ShaFile, max_content_size=None) -> BaseContent:
         )
     else:
         return Content(
-            data=blob.as_raw_string(),
+            data=data,
             status="visible",
             **hashes,
         )
 
 
+def parse_tree_entries(raw: bytes) -> Iterator[Tuple[bytes, int, bytes]]:
+    """Parse the raw data of a git tree into its ``(name, mode, binary sha)``
+    entries, in the order of the manifest.
+
+    Raises:
+        ValueError: if the data is not a valid tree
+    """
+    pos = 0
+    end = len(raw)
+    while pos < end:
+        space = raw.index(b" ", pos)
+        nul = raw.index(b"\x00", space)
+        sha = raw[nul + 1 : nul + 21]
+        if len(sha) != 20:
+            raise ValueError("Truncated tree entry")
+        yield raw[space + 1 : nul], int(raw[pos:space], 8), sha
+        pos = nul + 21
+
+
+def _tree_entry_key(item: Tuple[bytes, Tuple[int, bytes]]) -> bytes:
+    # Order of dulwich's Tree.iteritems(), where tree names end with a slash
+    name, (mode, _) = item
+    return name + b"/" if stat.S_ISDIR(mode) else name
+
+
 def dulwich_tree_to_directory(obj: ShaFile) -> Directory:
-    """Format a tree as a directory"""
+    """Format a tree as a directory.
+
+    Entries are read from the raw data of the tree, without going through the
+    hexadecimal ids of dulwich's :class:`TreeEntry` objects."""
     if obj.type_name != Tree.type_name:
         raise ValueError("Argument is not a tree.")
-    tree = cast(Tree, obj)
+    return raw_tree_to_directory(obj.as_raw_string(), obj.sha().digest())
 
-    entries = []
 
-    for entry in tree.iteritems():
-        if entry.mode & COMMIT_MODE_MASK == COMMIT_MODE_MASK:
+def raw_tree_to_directory(raw_string: bytes, sha1_git: bytes) -> Directory:
+    """Format a tree, given as its raw data and binary id, as a directory."""
+    # Like dulwich, keep the last of entries with the same name
+    tree_entries = {
+        name: (mode, sha) for name, mode, sha in parse_tree_entries(raw_string)
+    }
+    entries = []
+    for name, (mode, sha) in sorted(tree_entries.items(), key=_tree_entry_key):
+        if mode & COMMIT_MODE_MASK == COMMIT_MODE_MASK:
             type_ = "rev"
-        elif entry.mode & TREE_MODE_MASK == TREE_MODE_MASK:
+        elif mode & TREE_MODE_MASK == TREE_MODE_MASK:
             type_ = "dir"
         else:
             type_ = "file"
@@ -120,16 +178,14 @@ def dulwich_tree_to_directory(obj: ShaFile) -> Directory:
         entries.append(
             DirectoryEntry(
                 type=type_,
-                perms=entry.mode,
-                name=entry.path.replace(
-                    b"/", b"_"
-                ),  # '/' is very rare, and invalid in SWH.
-                target=hash_to_bytes(entry.sha.decode("ascii")),
+                perms=mode,
+                name=name.replace(b"/", b"_"),  # '/' is very rare, and invalid in SWH.
+                target=sha,
             )
         )
 
     dir_ = Directory(
-        id=tree.sha().digest(),
+        id=sha1_git,
         entries=tuple(entries),
     )
 
@@ -141,7 +197,6 @@ def dulwich_tree_to_directory(obj: ShaFile) -> Directory:
             hash_to_hex(expected_id),
             hash_to_hex(actual_id),
         )
-        raw_string = tree.as_raw_string()
         dir_ = attr.evolve(
             dir_, raw_manifest=git_object_header("tree", len(raw_string)) + raw_string
         )
@@ -150,94 +205,152 @@ def dulwich_tree_to_directory(obj: ShaFile) -> Directory:
     return dir_
 
 
+def parse_headers(raw: bytes) -> Tuple[List[Tuple[bytes, bytes]], Optional[bytes]]:
+    """Parse the raw data of a git commit or tag, in a single pass, into its
+    headers and its message.
+
+    Values of headers spanning several lines (such as ``gpgsig`` and
+    ``mergetag``) are unindented. As with dulwich, the message is :const:`None`
+    when the headers are not followed by an empty line.
+
+    Returns:
+        the ``(field, value)`` headers, in the order of the object, and the message
+
+    Raises:
+        ValueError: if a header line has no value
+    """
+    headers: List[Tuple[bytes, bytes]] = []
+    pos = 0
+    end = len(raw)
+    while pos < end:
+        if raw[pos] == 0x0A:  # empty line ending the headers
+            return headers, raw[pos + 1 :]
+        line_end = raw.find(b"\n", pos)
+        if line_end == -1:
+            line_end = end
+        # Continuation lines are indented with a space
+        stop = line_end
+        while stop + 1 < end and raw[stop + 1] == 0x20:
+            stop = raw.find(b"\n", stop + 1)
+            if stop == -1:
+                stop = end
+        if raw[pos] != 0x20:  # ignore continuation lines without a header
+            space = raw.find(b" ", pos, line_end)
+            if space == -1:
+                raise ValueError(f"Missing value of header {raw[pos:line_end]!r}")
+            headers.append(
+                (raw[pos:space], raw[space + 1 : stop].replace(b"\n ", b"\n"))
+            )
+        pos = stop + 1
+    return headers, None
+
+
 def parse_author(name_email: bytes) -> Person:
     """Parse an author line"""
     return Person.from_fullname(name_email)
 
 
-def dulwich_tsinfo_to_timestamp(
-    timestamp,
-    timezone: int,
-    timezone_neg_utc: bool,
-    timezone_bytes: Optional[bytes],
-) -> TimestampWithTimezone:
-    """Convert the dulwich timestamp information to a structure compatible with
-    Software Heritage.
-
-    Returns epoch if the timestamp overflows :class:`Timestamp`."""
+def parse_authorship(
+    value: Optional[bytes],
+) -> Tuple[Optional[Person], Optional[TimestampWithTimezone]]:
+    """Parse the value of an author, committer or tagger header into a person
+    and a date, whose timezone is kept as written.
+
+    As with dulwich, there is no date when the identity is not followed by one,
+    which is told by its closing ``>``. The date is the epoch if the timestamp
+    overflows :class:`Timestamp`.
+
+    Raises:
+        ValueError: if the date is not made of a timestamp and a timezone
+    """
+    if not value:
+        return None, None
+    sep = value.rfind(b"> ")
+    if sep == -1:
+        return parse_author(value), None
+    timestamp, space, timezone = value[sep + 2 :].rpartition(b" ")
+    if not space:
+        raise ValueError(f"Missing timezone in {value!r}")
     try:
         ts = Timestamp(seconds=int(timestamp), microseconds=0)
     except TimestampOverflowException:
         ts = Timestamp(seconds=0, microseconds=0)
-    if timezone_bytes is None:
-        # Failed to parse from the raw manifest, fallback to what Dulwich managed to
-        # parse.
-        return TimestampWithTimezone.from_numeric_offset(
-            timestamp=ts,
-            offset=timezone // 60,
-            negative_utc=timezone_neg_utc,
-        )
-    else:
-        return TimestampWithTimezone(timestamp=ts, offset_bytes=timezone_bytes)
+    return (
+        parse_author(value[: sep + 1]),
+        TimestampWithTimezone(timestamp=ts, offset_bytes=timezone),
+    )
 
 
 def dulwich_commit_to_revision(obj: ShaFile) -> Revision:
+    """Format a commit as a revision.
+
+    All its fields are read from its raw data, see
+    :func:`raw_commit_to_revision`."""
     if obj.type_name != Commit.type_name:
         raise ValueError("Argument is not a commit.")
-    commit = cast(Commit, obj)
-
-    author_timezone = None
-    committer_timezone = None
-    for field, value in _parse_message(commit.as_raw_chunks()):
-        if field == b"author":
-            assert value is not None
-            m = AUTHORSHIP_LINE_RE.match(value)
-            if m:
-                author_timezone = m.group("timezone")
+    return raw_commit_to_revision(obj.as_raw_string(), obj.sha().digest())
+
+
+def raw_commit_to_revision(raw_string: bytes, sha1_git: bytes) -> Revision:
+    """Format a commit, given as its raw data and binary id, as a revision.
+
+    Its headers are parsed in a single pass, including the dates, whose
+    timezones are kept as written in the commit."""
+    headers, message = parse_headers(raw_string)
+
+    tree: Optional[bytes] = None
+    author: Optional[bytes] = None
+    committer: Optional[bytes] = None
+    encoding: Optional[bytes] = None
+    gpgsig: Optional[bytes] = None
+    parents: List[bytes] = []
+    mergetags: List[bytes] = []
+    extra: List[Tuple[bytes, bytes]] = []
+    # Like dulwich, keep the last value of headers expected once
+    for field, value in headers:
+        if field == b"tree":
+            tree = value
+        elif field == b"parent":
+            parents.append(value)
+        elif field == b"author":
+            author = value
         elif field == b"committer":
-            assert value is not None
-            m = AUTHORSHIP_LINE_RE.match(value)
-            if m:
-                committer_timezone = m.group("timezone")
+            committer = value
+        elif field == b"encoding":
+            encoding = value
+        elif field == b"mergetag":
+            mergetags.append(value)
+        elif field == b"gpgsig":
+            gpgsig = value
+        else:
+            extra.append((field, value))
 
     extra_headers = []
-    if commit.encoding is not None:
-        extra_headers.append((b"encoding", commit.encoding))
-    if commit.mergetag:
-        for mergetag in commit.mergetag:
-            raw_string = mergetag.as_raw_string()
-            assert raw_string.endswith(b"\n")
-            extra_headers.append((b"mergetag", raw_string[:-1]))
-
-    if commit._extra:
-        extra_headers.extend((k, v) for k, v in commit._extra)
-
-    if commit.gpgsig:
-        extra_headers.append((b"gpgsig", commit.gpgsig))
-
+    if encoding is not None:
+        extra_headers.append((b"encoding", encoding))
+    extra_headers.extend((b"mergetag", mergetag) for mergetag in mergetags)
+    extra_headers.extend(extra)
+    if gpgsig:
+        extra_headers.append((b"gpgsig", gpgsig))
+
+    if tree is None:
+        raise ValueError("Commit has no tree")
+
+    author_person, author_date = parse_authorship(author)
+    committer_person, committer_date = parse_authorship(committer)
     rev = Revision(
-        id=commit.sha().digest(),
-        author=parse_author(commit.author),
-        date=dulwich_tsinfo_to_timestamp(
-            commit.author_time,
-            commit.author_timezone,
-            bool(commit._author_timezone_neg_utc),
-            author_timezone,
-        ),
-        committer=parse_author(commit.committer),
-        committer_date=dulwich_tsinfo_to_timestamp(
-            commit.commit_time,
-            commit.commit_timezone,
-            bool(commit._commit_timezone_neg_utc),
-            committer_timezone,
-        ),
+        id=sha1_git,
+        author=author_person,
+        date=author_date,
+        committer=committer_person,
+        committer_date=committer_date,
         type=RevisionType.GIT,
-        directory=bytes.fromhex(commit.tree.decode()),
-        message=commit.message,
+        directory=binascii.unhexlify(tree),
+        message=message,
         metadata=None,
         extra_headers=tuple(extra_headers),
         synthetic=False,
-        parents=tuple(bytes.fromhex(p.decode()) for p in commit.parents),
+        parents=tuple(binascii.unhexlify(parent) for parent in parents),
     )
 
     if rev.compute_hash() != rev.id:
@@ -248,7 +361,6 @@ def dulwich_commit_to_revision(obj: ShaFile) -> Revision:
             hash_to_hex(expected_id),
             hash_to_hex(actual_id),
         )
-        raw_string = commit.as_raw_string()
         rev = attr.evolve(
             rev, raw_manifest=git_object_header("commit", len(raw_string)) + raw_string
         )
@@ -274,45 +386,30 @@ DULWICH_OBJECT_TYPES = {
 
 
 def dulwich_tag_to_release(obj: ShaFile) -> Release:
+    """Format a tag as a release.
+
+    All its fields are read from its raw data, see :func:`raw_tag_to_release`."""
     if obj.type_name != Tag.type_name:
         raise ValueError("Argument is not a tag.")
-    tag = cast(Tag, obj)
-
-    tagger_timezone = None
-    # FIXME: _parse_message is a private function from Dulwich.
-    for field, value in _parse_message(tag.as_raw_chunks()):
-        if field == b"tagger":
-            assert value is not None
-            m = AUTHORSHIP_LINE_RE.match(value)
-            if m:
-                tagger_timezone = m.group("timezone")
-
-    target_type, target = tag.object
-    if tag.tagger:
-        author: Optional[Person] = parse_author(tag.tagger)
-        if tag.tag_time is None:
-            date = None
-        else:
-            date = dulwich_tsinfo_to_timestamp(
-                tag.tag_time,
-                tag.tag_timezone,
-                bool(tag._tag_timezone_neg_utc),
-                tagger_timezone,
-            )
-    else:
-        author = date = None
+    return raw_tag_to_release(obj.as_raw_string(), obj.sha().digest())
+
+
+def raw_tag_to_release(raw_string: bytes, sha1_git: bytes) -> Release:
+    """Format a tag, given as its raw data and binary id, as a release.
 
-    message = tag.message
-    if tag.signature:
-        message += tag.signature
+    Its headers are parsed as for :func:`raw_commit_to_revision`; its message
+    includes its signature."""
+    headers, message = parse_headers(raw_string)
+    fields = dict(headers)
+    author, date = parse_authorship(fields.get(b"tagger"))
 
     rel = Release(
-        id=tag.sha().digest(),
+        id=sha1_git,
         author=author,
         date=date,
-        name=tag.name,
-        target=bytes.fromhex(target.decode()),
-        target_type=DULWICH_OBJECT_TYPES[target_type.type_name],
+        name=fields[b"tag"],
+        target=binascii.unhexlify(fields[b"object"]),
+        target_type=DULWICH_OBJECT_TYPES[fields[b"type"]],
         message=message,
         metadata=None,
         synthetic=False,
@@ -326,10 +423,23 @@ def dulwich_tag_to_release(obj: ShaFile) -> Release:
             hash_to_hex(expected_id),
             hash_to_hex(actual_id),
         )
-        raw_string = tag.as_raw_string()
         rel = attr.evolve(
             rel, raw_manifest=git_object_header("tag", len(raw_string)) + raw_string
         )
 
     check_id(rel)
     return rel
+
+
+def raw_object_to_model(raw_obj: Tuple[int, bytes, bytes]) -> HashableObject:
+    """Convert a git tree, commit or tag, given as its type number, raw data and
+    hexadecimal id, to a Software Heritage model object. This is the form in
+    which objects are sent to conversion worker processes."""
+    type_num, raw, sha = raw_obj
+    if type_num == Tree.type_num:
+        return raw_tree_to_directory(raw, binascii.unhexlify(sha))
+    elif type_num == Commit.type_num:
+        return raw_commit_to_revision(raw, binascii.unhexlify(sha))
+    elif type_num == Tag.type_num:
+        return raw_tag_to_release(raw, binascii.unhexlify(sha))
+    raise ValueError(f"Unexpected object type: {type_num}")
@@ -4,15 +4,21 @@
 # See top-level LICENSE file for more information
 
 from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
 from dataclasses import dataclass
 import datetime
+from functools import partial
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import pickle
-from tempfile import SpooledTemporaryFile
+from tempfile import NamedTemporaryFile, SpooledTemporaryFile
 import time
 from typing import (
+    IO,
     Any,
     Callable,
     Dict,
@@ -24,17 +30,29 @@ from typing import (
     Set,
     Tuple,
     Type,
+    TypeVar,
+    cast,
 )
 
 import dulwich.client
 from dulwich.object_format import SHA1
 from dulwich.object_store import ObjectStoreGraphWalker
-from dulwich.objects import Blob, Commit, ObjectID, ShaFile, Tag, Tree, sha_to_hex
-from dulwich.pack import PackData, PackInflater
+from dulwich.objects import (
+    Blob,
+    Commit,
+    ObjectID,
+    RawObjectID,
+    ShaFile,
+    Tag,
+    Tree,
+    sha_to_hex,
+)
+from dulwich.pack import PackData
 from dulwich.refs import Ref
 import urllib3.util
 
 from swh.core.statsd import Statsd
+from swh.core.utils import grouper
 from swh.loader.exception import NotFound
 from swh.loader.git.utils import raise_not_found_repository
 from swh.model import hashutil
@@ -48,9 +66,11 @@ from swh.model.model import (
     BaseContent,
     Content,
     Directory,
+    ObjectType,
     RawExtrinsicMetadata,
     Release,
     Revision,
+    SkippedContent,
     Snapshot,
     SnapshotBranch,
     SnapshotTargetType,
@@ -63,29 +83,57 @@ from swh.storage.interface import StorageInterface
 
 from . import converters, utils
 from .base import BaseGitLoader
-from .utils import LOGGING_INTERVAL, PackWriter
+from .pack import (
+    PackIndexer,
+    PackObject,
+    PackObjectDispatcher,
+    PackStream,
+    PackSummary,
+    ParallelPackInflater,
+    SkippedBlob,
+    StreamingPackInflater,
+    SwhPackInflater,
+    complete_entries,
+    file_contents,
+    path_contents,
+    write_pack,
+)
+from .utils import LOGGING_INTERVAL, PackSizeLimitExceeded, PackWriter
 
 logger = logging.getLogger(__name__)
 heads_logger = logger.getChild("refs")
 remote_logger = logger.getChild("remote")
 fetch_pack_logger = logger.getChild("fetch_pack")
 
+# Number of external references of a packfile looked up in each storage call
+EXT_REF_FETCH_BATCH_SIZE = 1000
+
+# Size of the batches of blobs hashed by each task of the content_hash_threads
+CONTENT_HASH_BATCH_BYTES = 1024 * 1024
+
+# Size of the batches of raw objects sent to the convert_processes
+CONVERT_BATCH_BYTES = 1024 * 1024
+
+T = TypeVar("T")
+
+EXT_REF_TYPES = {
+    Blob.type_num: "content",
+    Tree.type_num: "directory",
+    Commit.type_num: "revision",
+    Tag.type_num: "release",
+}
+
+# Arguments of protocol v2 ls-refs commands listing HEAD, branches and tags only;
+# refs ignored by the loader within these are filtered client-side
+LS_REFS_PREFIXES = (b"HEAD", b"refs/heads/", b"refs/tags/")
+
 
 def split_lines_and_remainder(buf: bytes) -> Tuple[List[bytes], bytes]:
     """Get newline-terminated (``b"\\r"`` or ``b"\\n"``) lines from `buf`,
     and the beginning of the last line if it isn't terminated."""
-
-    lines = buf.splitlines(keepends=True)
-    if not lines:
-        return [], b""
-
-    if buf.endswith((b"\r", b"\n")):
-        # The buffer ended with a newline, everything can be sent as lines
-        return lines, b""
-    else:
-        # The buffer didn't end with a newline, we need to keep the
-        # last bit as the beginning of the next line
-        return lines[:-1], lines[-1]
+    buffer = bytearray(buf)
+    lines = utils.consume_lines(buffer)
+    return lines, bytes(buffer)
 
 
 class RepoRepresentation:
@@ -97,10 +145,12 @@ class RepoRepresentation:
         base_snapshots: Optional[List[Snapshot]] = None,
         incremental: bool = True,
         statsd: Optional[Statsd] = None,
+        parents_batch_size: int = 1000,
     ):
         self.storage = storage
         self.incremental = incremental
         self.statsd = statsd
+        self.parents_batch_size = parents_batch_size
 
         if base_snapshots and incremental:
             self.base_snapshots: List[Snapshot] = base_snapshots
@@ -109,16 +159,98 @@ class RepoRepresentation:
 
         # Cache existing heads
         self.local_heads: Set[ObjectID] = set()
+        # Types of the local heads which are not revisions
+        self.other_heads: Dict[ObjectID, SnapshotTargetType] = {}
         heads_logger.debug("Heads known in the archive:")
         for base_snapshot in self.base_snapshots:
             for branch_name, branch in base_snapshot.branches.items():
                 if not branch or branch.target_type == SnapshotTargetType.ALIAS:
                     continue
                 heads_logger.debug("    %r: %s", branch_name, branch.target.hex())
-                self.local_heads.add(sha_to_hex(branch.target))
+                head = sha_to_hex(branch.target)
+                self.local_heads.add(head)
+                if branch.target_type != SnapshotTargetType.REVISION:
+                    self.other_heads[head] = branch.target_type
+
+        # Parents of the objects walked during negotiation, as known by the archive
+        self.parents: Dict[ObjectID, List[ObjectID]] = {}
+        self.heads_resolved = False
 
     def graph_walker(self) -> ObjectStoreGraphWalker:
-        return ObjectStoreGraphWalker(self.local_heads, get_parents=lambda commit: [])
+        return ObjectStoreGraphWalker(self.local_heads, get_parents=self.get_parents)
+
+    def get_parents(self, obj_id: ObjectID) -> List[ObjectID]:
+        """Get the parents of the given (bytehex) object id from the archive, to let
+        the graph walker advertise the ancestors of the local heads to the remote.
+
+        The local heads are looked up once, in batches; the history of any other
+        object is then walked from it, one batch of revisions at a time. Releases
+        are considered to have their target revision as only parent; any other
+        object has no parents.
+        """
+        if not self.heads_resolved:
+            self._resolve_heads()
+        if obj_id not in self.parents:
+            self._fetch_parents(obj_id)
+        return self.parents[obj_id]
+
+    def _resolve_heads(self) -> None:
+        """Record the parents of the local heads: the target revision of releases
+        and the parents of revisions, looked up in batches, and none for other
+        objects. Revision heads missing from the results of ``revision_shortlog``
+        are looked up again by :meth:`_fetch_parents` when walked."""
+        self.heads_resolved = True
+        releases = []
+        for head, target_type in self.other_heads.items():
+            if target_type == SnapshotTargetType.RELEASE:
+                releases.append(head)
+            else:
+                self.parents[head] = []
+        for batch in grouper(releases, self.parents_batch_size):
+            heads = list(batch)
+            for head, release in zip(
+                heads,
+                self.storage.release_get(
+                    [hashutil.bytehex_to_hash(head) for head in heads]
+                ),
+            ):
+                if release is not None and release.target_type == ObjectType.REVISION:
+                    self.parents[head] = [sha_to_hex(release.target)]
+                else:
+                    self.parents[head] = []
+
+        revisions = sorted(self.local_heads - self.other_heads.keys())
+        for batch in grouper(revisions, self.parents_batch_size):
+            self._add_shortlog(list(batch))
+
+    def _add_shortlog(self, roots: List[ObjectID]) -> None:
+        """Record the parents of at most ``parents_batch_size`` revisions of the
+        history of `roots`. Which ones depends on the storage backend, so even
+        roots may be left out when there are more of them than the limit."""
+        for revision in self.storage.revision_shortlog(
+            [hashutil.bytehex_to_hash(root) for root in roots],
+            limit=self.parents_batch_size,
+        ):
+            if revision is None:
+                continue
+            rev_id, parents = revision
+            self.parents[sha_to_hex(rev_id)] = [
+                sha_to_hex(parent) for parent in parents
+            ]
+        logger.debug("parents_count=%s", len(self.parents))
+
+    def _fetch_parents(self, obj_id: ObjectID) -> None:
+        # As the only root, obj_id is part of the results if it is a revision
+        self._add_shortlog([obj_id])
+        if obj_id in self.parents:
+            return
+
+        # Not a revision known by the archive
+        [release] = self.storage.release_get([hashutil.bytehex_to_hash(obj_id)])
+        if release is not None and release.target_type == ObjectType.REVISION:
+            self.parents[obj_id] = [sha_to_hex(release.target)]
+        else:
+            self.parents[obj_id] = []
 
     def determine_wants(
         self, refs: Mapping[Ref, ObjectID], depth: Optional[int] = None
@@ -169,6 +301,7 @@ class FetchPackReturn:
     symbolic_refs: Dict[Ref, Ref]
     pack_buffer: SpooledTemporaryFile
     pack_size: int
+    pack_index: Optional[PackIndexer] = None
 
 
 class GitLoader(BaseGitLoader):
@@ -193,6 +326,9 @@ class GitLoader(BaseGitLoader):
     * ``no_parent_origin`` when the origin was no already loaded, and it was not
       detected as a forge-fork of any other origin
     * ``disabled`` when incremental loading is disabled by configuration
+
+    The progress of each fetch is also reported, as described in
+    :class:`utils.FetchProgress`.
     """
 
     visit_type = "git"
@@ -204,11 +340,25 @@ class GitLoader(BaseGitLoader):
         incremental: bool = True,
         repo_representation: Type[RepoRepresentation] = RepoRepresentation,
         pack_size_bytes: int = 4 * 1024 * 1024 * 1024,
+        pack_decompressed_size_bytes: Optional[int] = None,
         temp_file_cutoff: int = 100 * 1024 * 1024,
         connect_timeout: float = 120,
         read_timeout: float = 600,
         verify_certs: bool = True,
         urllib3_extra_kwargs: Dict[str, Any] = {},
+        ext_ref_fetch_threads: int = 4,
+        chunked_fetch: bool = False,
+        reuse_http_connections: bool = True,
+        filter_refs_on_server: bool = False,
+        filter_large_blobs: bool = False,
+        streaming_fetch: bool = False,
+        partial_pack_dir: Optional[str] = None,
+        partial_pack_max_age: float = 24 * 3600,
+        delta_base_cache_size: int = 64 * 1024 * 1024,
+        inflate_processes: int = 0,
+        content_hash_threads: int = 0,
+        content_hash_max_bytes: int = 64 * 1024 * 1024,
+        convert_processes: int = 0,
         **kwargs: Any,
     ):
         """Initialize the bulk updater.
@@ -221,19 +371,97 @@ class GitLoader(BaseGitLoader):
 
             incremental: If True, the default, this starts from the last known snapshot
                 (if any) references. Otherwise, this loads the full repository.
+            pack_decompressed_size_bytes: if set, the download of packfiles
+                whose entries would be inflated to more than this many bytes is
+                aborted as soon as they are indexed, as for packfiles over
+                ``pack_size_bytes``. This is not checked in streaming fetch mode
+            ext_ref_fetch_threads: number of threads fetching the data of the
+                external delta bases of the packfile from the archive
+            chunked_fetch: if True, repositories whose packfile would exceed
+                ``pack_size_bytes`` are fetched and loaded in several rounds, each
+                round fetching a subset of the wanted refs, instead of failing
+            reuse_http_connections: if True, the default, HTTP(S) connections
+                are kept alive in a process-wide cache of pool managers, to be
+                reused by the next loads of origins hosted on the same server
+            filter_refs_on_server: if True, only ``HEAD``, branches and tags are
+                loaded, and protocol v2 servers only list those, using
+                ``ref-prefix`` arguments. This pays off for origins with large
+                namespaces of other refs (e.g. pull requests or Gerrit changes).
+                Refs ignored by the loader (see :func:`utils.ignore_branch_name`),
+                and other refs listed by servers not supporting protocol v2, are
+                filtered client-side
+            filter_large_blobs: if True, servers supporting partial clones are
+                asked to omit blobs over ``max_content_size`` from packfiles; the
+                omitted blobs are recorded as skipped contents, only identified
+                by their ``sha1_git``
+            streaming_fetch: if True, objects are inflated and loaded while the
+                packfile is being downloaded, instead of once it is complete. This
+                is not used in chunked fetch mode, nor when saving packfiles
+            partial_pack_dir: if set, the objects completely received when a
+                packfile download fails are kept in this directory, keyed by
+                origin and wanted objects. The next attempt loads them along with
+                the packfile it fetches, and advertises those of their commits
+                whose history is complete to the server, so that it only sends
+                the remaining objects. Downloads interrupted in streaming fetch
+                mode are not kept
+            partial_pack_max_age: partial packfiles older than this many seconds
+                are removed instead of being resumed
+            delta_base_cache_size: maximum size, in bytes, of the delta bases kept
+                in memory while inflating the packfile, which are read back from
+                the packfile or the archive once evicted
+            inflate_processes: if positive, number of worker processes resolving
+                the delta chains of the packfile in parallel, from a copy of the
+                packfile in a temporary file. This is not used in streaming
+                fetch mode
+            content_hash_threads: if positive, number of threads computing the
+                hashes of contents, by batches of blobs; ``hashlib`` releases the
+                GIL while hashing large buffers
+            content_hash_max_bytes: maximum size, in bytes, of the blobs queued
+                for or being hashed by the ``content_hash_threads``
+            convert_processes: if positive, number of worker processes
+                converting trees, commits and tags to model objects, by batches
+                of raw objects
 
         """
         super().__init__(storage=storage, origin_url=url, **kwargs)
         self.incremental = incremental
         self.repo_representation = repo_representation
         self.pack_size_bytes = pack_size_bytes
+        self.pack_decompressed_size_bytes = pack_decompressed_size_bytes
         self.temp_file_cutoff = temp_file_cutoff
+        self.chunked_fetch = chunked_fetch
+        self.reuse_http_connections = reuse_http_connections
+        self.filter_refs_on_server = filter_refs_on_server
+        self.filter_large_blobs = filter_large_blobs
+        self.streaming_fetch = streaming_fetch
+        self.partial_pack_dir = partial_pack_dir
+        self.partial_pack_max_age = partial_pack_max_age
+        self.delta_base_cache_size = delta_base_cache_size
+        self.inflate_processes = inflate_processes
+        self.content_hash_threads = content_hash_threads
+        self.content_hash_max_bytes = content_hash_max_bytes
+        self.convert_processes = convert_processes
+        self.convert_executor: Optional[ProcessPoolExecutor] = None
         # state initialized in fetch_data
+        self.fetch_round = 0
+        self.wants_per_fetch: Optional[int] = None
+        self.fetch_wants: List[ObjectID] = []
+        self.more_wants = False
+        self.refs_unchanged = False
         self.remote_refs: Dict[Ref, ObjectID] = {}
         self.symbolic_refs: Dict[Ref, Ref] = {}
         self.ref_object_types: Dict[bytes, Optional[SnapshotTargetType]] = {}
         self.ext_refs: Dict[bytes, Optional[Tuple[int, List[bytes]]]] = {}
+        self.ext_ref_fetch_threads = ext_ref_fetch_threads
         self.repo_pack_size_bytes = 0
+        self.pack_data: Optional[PackData] = None
+        self.pack_objects: Optional[PackObjectDispatcher] = None
+        self.pack_stream: Optional[PackStream] = None
+        self.fetch_future: Optional[Future] = None
+        self.pack_index: Optional[PackIndexer] = None
+        self.pack_summary: Optional[PackSummary] = None
+        self.resumed_pack: Optional[PackData] = None
+        self.fetch_progress: Optional[utils.FetchProgress] = None
         self.urllib3_extra_kwargs = urllib3_extra_kwargs
         self.urllib3_extra_kwargs["timeout"] = urllib3.util.Timeout(
             connect=connect_timeout, read=read_timeout
@@ -246,10 +474,17 @@ class GitLoader(BaseGitLoader):
         origin_url: str,
         base_repo: RepoRepresentation,
         do_activity: Callable[[bytes], None],
+        pack_stream: Optional[PackStream] = None,
     ) -> FetchPackReturn:
-        """Fetch a pack from the origin"""
-
-        pack_buffer = SpooledTemporaryFile(max_size=self.temp_file_cutoff)
+        """Fetch a pack from the origin, into `pack_stream` if set"""
+        # Left by a previous attempt for other wanted objects
+        self.close_resumed_pack()
+
+        pack_buffer = (
+            SpooledTemporaryFile(max_size=self.temp_file_cutoff)
+            if pack_stream is None
+            else pack_stream.file
+        )
         transport_url = origin_url
 
         logger.debug("Transport url to communicate with server: %s", transport_url)
@@ -258,10 +493,17 @@ class GitLoader(BaseGitLoader):
 
         if transport_url.startswith(("http://", "https://")):
             # Inject urllib3 kwargs into the pool manager
-            transport_kwargs["pool_manager"] = dulwich.client.default_urllib3_manager(
-                config=None,
-                **self.urllib3_extra_kwargs,
-            )
+            if self.reuse_http_connections:
+                transport_kwargs["pool_manager"] = utils.POOL_MANAGERS.get(
+                    transport_url, **self.urllib3_extra_kwargs
+                )
+            else:
+                transport_kwargs["pool_manager"] = (
+                    dulwich.client.default_urllib3_manager(
+                        config=None,
+                        **self.urllib3_extra_kwargs,
+                    )
+                )
 
         client, path = dulwich.client.get_transport_and_path(
             location=transport_url,
@@ -272,27 +514,64 @@ class GitLoader(BaseGitLoader):
 
         logger.debug("Client %s to fetch pack at %s", client, path)
 
+        # The streaming inflater parses the pack as it is downloaded already
+        pack_index = PackIndexer() if pack_stream is None else None
         pack_writer = PackWriter(
-            pack_buffer=pack_buffer,
+            pack_buffer=pack_buffer if pack_stream is None else pack_stream,
             size_limit=self.pack_size_bytes,
             origin_url=origin_url,
             fetch_pack_logger=fetch_pack_logger,
+            progress=self.fetch_progress,
+            indexer=pack_index,
+            decompressed_size_limit=self.pack_decompressed_size_bytes,
         )
 
-        pack_result = client.fetch_pack(
-            path.encode(),
-            base_repo.determine_wants,
-            base_repo.graph_walker(),
-            pack_writer.write,
-            progress=do_activity,
-        )
+        ref_prefix = LS_REFS_PREFIXES if self.filter_refs_on_server else None
+
+        def determine_wants(
+            refs: Mapping[Ref, ObjectID], depth: Optional[int] = None
+        ) -> List[ObjectID]:
+            # Also when the server did not support protocol v2
+            refs = utils.filter_ref_prefixes(refs, ref_prefix)
+            self.remote_refs = utils.filter_refs(refs)
+            wants = self.select_wants(base_repo.determine_wants(refs, depth=depth))
+            if wants and self.partial_pack_dir is not None:
+                self.resume_partial_pack(origin_url, wants, base_repo, graph_walker)
+            return wants
+
+        filter_spec = self.blob_filter_spec()
+        graph_walker = base_repo.graph_walker()
+        try:
+            pack_result = client.fetch_pack(
+                path.encode(),
+                determine_wants,
+                graph_walker,
+                pack_writer.write,
+                progress=do_activity,
+                # Ref prefixes and object filters are only sent with protocol v2;
+                # servers not supporting it fall back to v0, in which case refs
+                # are filtered client-side and all objects are sent
+                protocol_version=2 if ref_prefix or filter_spec else None,
+                ref_prefix=ref_prefix,
+                filter_spec=filter_spec,
+            )
+        except PackSizeLimitExceeded:
+            raise
+        except Exception:
+            if self.partial_pack_dir is not None and pack_stream is None:
+                self.save_partial_pack(origin_url, pack_buffer)
+            raise
 
         remote_refs = pack_result.refs or {}
         symbolic_refs = pack_result.symrefs or {}
 
-        pack_buffer.flush()
-        pack_size = pack_buffer.tell()
-        pack_buffer.seek(0)
+        if pack_stream is None:
+            pack_buffer.flush()
+            pack_size = pack_buffer.tell()
+            pack_buffer.seek(0)
+        else:
+            # The pack may still be read by the loader, leave it alone
+            pack_size = pack_stream.size
 
         logger.debug("fetched_pack_size=%s", pack_size)
         logger.debug(
@@ -301,12 +580,297 @@ class GitLoader(BaseGitLoader):
         )
 
         return FetchPackReturn(
-            remote_refs=utils.filter_refs(remote_refs),
-            symbolic_refs=utils.filter_symbolic_refs(symbolic_refs),
+            remote_refs=utils.filter_refs(
+                utils.filter_ref_prefixes(remote_refs, ref_prefix)
+            ),
+            symbolic_refs=utils.filter_symbolic_refs(
+                utils.filter_ref_prefixes(symbolic_refs, ref_prefix)
+            ),
             pack_buffer=pack_buffer,
             pack_size=pack_size,
+            pack_index=pack_index,
         )
 
+    def start_streaming_fetch(
+        self,
+        base_repo: RepoRepresentation,
+        do_activity: Callable[[bytes], None],
+        on_fetched: Callable[[], None],
+    ) -> Optional[FetchPackReturn]:
+        """Fetch a pack from the origin in a background thread, into
+        :attr:`pack_stream`.
+
+        Returns:
+            the result of the fetch if it is over without any pack to download,
+            or None once the pack download started
+        """
+        assert self.origin is not None
+        origin_url = self.origin.url
+        stream = PackStream(max_size=self.temp_file_cutoff)
+
+        def fetch() -> FetchPackReturn:
+            try:
+                fetch_info = self.fetch_pack_from_origin(
+                    origin_url, base_repo, do_activity, pack_stream=stream
+                )
+            except BaseException as e:
+                stream.finish(error=e)
+                raise
+            stream.finish()
+            on_fetched()
+            return fetch_info
+
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fetch-pack")
+        future = executor.submit(fetch)
+        executor.shutdown(wait=False)
+
+        stream.wait_started()
+        if stream.size == 0 or stream.error is not None:
+            fetch_info = future.result()
+            fetch_info.pack_buffer.seek(0)
+            return fetch_info
+
+        self.pack_stream = stream
+        self.fetch_future = future
+        return None
+
+    def finish_streaming_fetch(self) -> None:
+        """Wait for the end of the background fetch, if any, and set the pack and
+        refs it fetched."""
+        if self.fetch_future is None:
+            return
+        future, self.fetch_future, self.pack_stream = self.fetch_future, None, None
+        with raise_not_found_repository():
+            fetch_info = future.result()
+        fetch_info.pack_buffer.seek(0)
+        self.set_fetch_info(fetch_info)
+
+    def set_fetch_info(self, fetch_info: FetchPackReturn) -> None:
+        self.pack_buffer = fetch_info.pack_buffer
+        self.pack_size = fetch_info.pack_size
+        self.pack_index = fetch_info.pack_index
+        self.remote_refs = fetch_info.remote_refs
+        self.symbolic_refs = fetch_info.symbolic_refs
+
+    def blob_filter_spec(self) -> Optional[bytes]:
+        """Object filter sent to the server, omitting the blobs that would be
+        skipped anyway. It is ignored by servers not supporting it."""
+        if self.filter_large_blobs and self.max_content_size is not None:
+            return b"blob:limit=%d" % self.max_content_size
+        return None
+
+    def partial_pack_path(self, origin_url: str, wants: List[ObjectID]) -> str:
+        """Path of the partial packfile kept for `wants` from `origin_url`"""
+        assert self.partial_pack_dir is not None
+        key = hashlib.sha1(origin_url.encode())
+        for want in sorted(wants):
+            key.update(b"\n" + want)
+        return os.path.join(self.partial_pack_dir, f"{key.hexdigest()}.pack")
+
+    def expire_partial_packs(self) -> None:
+        """Remove the partial packfiles older than ``partial_pack_max_age``"""
+        assert self.partial_pack_dir is not None
+        deadline = time.time() - self.partial_pack_max_age
+        try:
+            entries = list(os.scandir(self.partial_pack_dir))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            try:
+                if entry.name.endswith(".pack") and entry.stat().st_mtime < deadline:
+                    os.unlink(entry.path)
+            except FileNotFoundError:
+                # Removed by a concurrent loader
+                pass
+
+    def save_partial_pack(self, origin_url: str, pack_buffer: IO[bytes]) -> None:
+        """Keep the entries completely received in `pack_buffer` when its
+        download failed, along with the ones of the partial packfile resumed by
+        this download if any, for the next attempt to resume from them."""
+        with ExitStack() as stack:
+            contents = stack.enter_context(file_contents(pack_buffer))
+            count, end = complete_entries(contents)
+            if count == 0:
+                return
+            parts: List[Tuple[Any, int]] = [(contents, end)]
+            if self.resumed_pack is not None:
+                resumed_path = self.resumed_pack.path
+                count += len(self.resumed_pack)
+                parts.insert(
+                    0,
+                    (
+                        stack.enter_context(path_contents(resumed_path)),
+                        os.path.getsize(resumed_path) - SHA1.oid_length,
+                    ),
+                )
+
+            path = self.partial_pack_path(origin_url, self.fetch_wants)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f"{path}.tmp", "wb") as f:
+                write_pack(f, count, parts)
+            os.replace(f"{path}.tmp", path)
+        logger.info(
+            "Kept %s objects of the interrupted download of %s in %s",
+            count,
+            origin_url,
+            path,
+        )
+
+    def resume_partial_pack(
+        self,
+        origin_url: str,
+        wants: List[ObjectID],
+        base_repo: RepoRepresentation,
+        graph_walker: ObjectStoreGraphWalker,
+    ) -> None:
+        """Resume the download of a partial packfile kept for `wants`, if any:
+        its objects will be loaded along with the fetched packfile, and its
+        complete commits are advertised to the server by `graph_walker`."""
+        path = self.partial_pack_path(origin_url, wants)
+        if not os.path.exists(path):
+            return
+        self.resumed_pack = PackData.from_path(path, object_format=SHA1)
+        with path_contents(path) as contents:
+            haves = self.partial_pack_haves(contents, base_repo.parents)
+        graph_walker.heads.update(haves)
+        logger.info(
+            "Resuming download of %s from %s objects of %s, including %s commits",
+            origin_url,
+            len(self.resumed_pack),
+            path,
+            len(haves),
+        )
+        self.statsd.increment(
+            "swh_loader_git_resumed_pack_objects_total", len(self.resumed_pack), tags={}
+        )
+
+    def partial_pack_haves(
+        self, contents: Any, parents: Dict[ObjectID, List[ObjectID]]
+    ) -> List[ObjectID]:
+        """Find the commits of a partial packfile, whose bytes are given by
+        `contents`, which can be advertised to the server: those whose trees and
+        ancestors are all either in the packfile or in the archive. The parents of
+        its commits are added to `parents`."""
+        present: Set[ObjectID] = set()
+        # Objects referenced by the trees and commits of the packfile
+        references: Dict[ObjectID, List[Tuple[int, ObjectID]]] = {}
+        commits: List[ObjectID] = []
+        for obj in SwhPackInflater(
+            contents,
+            max_blob_size=self.max_content_size,
+            base_cache_size=self.delta_base_cache_size,
+        ):
+            present.add(obj.id)
+            if isinstance(obj, Tree):
+                references[obj.id] = [
+                    (
+                        (
+                            Tree.type_num
+                            if entry.mode & converters.TREE_MODE_MASK
+                            == converters.TREE_MODE_MASK
+                            else Blob.type_num
+                        ),
+                        entry.sha,
+                    )
+                    for entry in obj.iteritems()
+                    if entry.mode & converters.COMMIT_MODE_MASK
+                    != converters.COMMIT_MODE_MASK
+                ]
+            elif isinstance(obj, Commit):
+                references[obj.id] = [(Tree.type_num, obj.tree)] + [
+                    (Commit.type_num, parent) for parent in obj.parents
+                ]
+                parents[obj.id] = list(obj.parents)
+                commits.append(obj.id)
+
+        external: Dict[int, Set[ObjectID]] = defaultdict(set)
+        for refs in references.values():
+            for type_num, sha in refs:
+                if sha not in present:
+                    external[type_num].add(sha)
+        find_missing = {
+            Blob.type_num: self.storage.content_missing_per_sha1_git,
+            Tree.type_num: self.storage.directory_missing,
+            Commit.type_num: self.storage.revision_missing,
+        }
+        missing: Set[ObjectID] = set()
+        for type_num, shas in external.items():
+            for batch in grouper(shas, EXT_REF_FETCH_BATCH_SIZE):
+                missing.update(
+                    sha_to_hex(RawObjectID(sha1))
+                    for sha1 in find_missing[type_num](
+                        [hashutil.bytehex_to_hash(sha) for sha in batch]
+                    )
+                )
+
+        # Objects referencing missing objects are incomplete, and so are the
+        # objects referencing them
+        referrers: Dict[ObjectID, List[ObjectID]] = defaultdict(list)
+        incomplete: List[ObjectID] = []
+        for obj_id, refs in references.items():
+            for _, sha in refs:
+                if sha in missing:
+                    incomplete.append(obj_id)
+                elif sha in references:
+                    referrers[sha].append(obj_id)
+        seen: Set[ObjectID] = set()
+        while incomplete:
+            obj_id = incomplete.pop()
+            if obj_id not in seen:
+                seen.add(obj_id)
+                incomplete.extend(referrers.pop(obj_id, []))
+
+        return [commit for commit in commits if commit not in seen]
+
+    def close_resumed_pack(self, remove: bool = False) -> None:
+        """Close the resumed partial packfile, and remove it once loaded"""
+        if self.resumed_pack is None:
+            return
+        path = self.resumed_pack.path
+        self.resumed_pack.close()
+        self.resumed_pack = None
+        if remove:
+            os.unlink(path)
+
+    def select_wants(self, wants: List[ObjectID]) -> List[ObjectID]:
+        """Select the objects to fetch in the current round among `wants`.
+
+        Unless a previous attempt of fetching them at once exceeded the pack size
+        limit in chunked fetch mode, all of them are fetched in a single round.
+        """
+        if self.chunked_fetch and self.wants_per_fetch is not None:
+            # Sort the wanted objects for rounds to be reproducible
+            self.fetch_wants = sorted(wants)[: self.wants_per_fetch]
+        else:
+            self.fetch_wants = wants
+        self.more_wants = len(self.fetch_wants) < len(wants)
+        return self.fetch_wants
+
+    def close_fetched_pack(self) -> None:
+        """Stop the fetch of the current round, and close its packfile"""
+        if self.fetch_future is not None:
+            # Interrupt the download and wait for the fetching thread
+            assert self.pack_stream is not None
+            self.pack_stream.abort()
+            try:
+                self.fetch_future.result()
+            except BaseException:
+                pass
+            self.fetch_future = None
+            self.pack_stream = None
+        if self.pack_objects is not None:
+            self.pack_objects.close()
+            self.pack_objects = None
+        self.close_resumed_pack()
+        self.ext_refs = {}
+
+    def cleanup(self) -> None:
+        self.close_fetched_pack()
+        # The worker processes are kept across fetch rounds
+        if self.convert_executor is not None:
+            self.convert_executor.shutdown(cancel_futures=True)
+            self.convert_executor = None
+
     def get_full_snapshot(self, origin_url) -> Optional[Snapshot]:
         return snapshot_get_latest(
             self.storage,
@@ -346,6 +910,14 @@ class GitLoader(BaseGitLoader):
         # May be set to True later
         self.statsd.constant_tags["has_parent_snapshot"] = False
 
+        self.fetch_round = 0
+        self.wants_per_fetch = None
+        self.more_wants = False
+        self.ref_object_types = {}
+
+        if self.partial_pack_dir is not None:
+            self.expire_partial_packs()
+
         if self.incremental:
             prev_snapshot = self.get_full_snapshot(self.origin.url)
             self.statsd.constant_tags["has_previous_snapshot"] = bool(prev_snapshot)
@@ -369,17 +941,30 @@ class GitLoader(BaseGitLoader):
     def fetch_data(self) -> bool:
         assert self.origin is not None
 
-        if not self.base_snapshots and self.repo_pack_size_bytes > self.pack_size_bytes:
-            raise IOError(
+        if (
+            not self.chunked_fetch
+            and self.blob_filter_spec() is None
+            and not self.base_snapshots
+            and self.repo_pack_size_bytes > self.pack_size_bytes
+        ):
+            raise PackSizeLimitExceeded(
                 f"Pack file too big for repository {self.origin.url}, "
                 f"limit is {self.pack_size_bytes} bytes, "
                 f"current size is {self.repo_pack_size_bytes}"
             )
 
+        self.fetch_round += 1
+        if self.fetch_round > 1:
+            # Fetch the next refs from the heads loaded by the previous rounds
+            partial_snapshot = self.build_partial_snapshot()
+            if partial_snapshot is not None:
+                self.base_snapshots.append(partial_snapshot)
+            self.close_fetched_pack()
+
         base_repo = self.repo_representation(
             storage=self.storage,
             base_snapshots=self.base_snapshots,
-            incremental=self.incremental,
+            incremental=self.incremental or self.fetch_round > 1,
             statsd=self.statsd,
         )
 
@@ -432,47 +1017,60 @@ class GitLoader(BaseGitLoader):
                         "remote: %s", stripped.decode("utf-8", "backslashreplace")
                     )
 
-        # This buffer keeps the end of what do_remote has received, across
-        # calls, if it happens to be unterminated
-        next_line_buf = b""
-
         def do_remote(msg: bytes) -> None:
-            nonlocal next_line_buf
-
-            lines, next_line_buf = split_lines_and_remainder(next_line_buf + msg)
-
-            for line in lines:
+            assert self.fetch_progress is not None
+            for line in self.fetch_progress.feed(msg):
                 log_remote_message(line)
 
-        try:
-            with raise_not_found_repository():
-                fetch_info = self.fetch_pack_from_origin(
-                    self.origin.url, base_repo, do_remote
-                )
-        except NotFound:
-            # NotFound inherits from ValueError and should not be caught
-            # by the next exception handler
-            raise
-        else:
-            # Always log what remains in the next_line_buf, if it's not empty
+        def flush_remote_log() -> None:
+            assert self.fetch_progress is not None
+            # Always log what remains of the last line, if it's not empty
             maybe_log_elision(force=True)
-            log_remote_message(next_line_buf)
+            log_remote_message(self.fetch_progress.flush())
+            self.fetch_progress.report(self.statsd)
 
-        self.pack_buffer = fetch_info.pack_buffer
-        self.pack_size = fetch_info.pack_size
-        self.remote_refs = fetch_info.remote_refs
-        self.symbolic_refs = fetch_info.symbolic_refs
-        self.pack_data = (
-            PackData.from_file(
-                file=self.pack_buffer,
-                size=self.pack_size,
-                object_format=SHA1,
-            )
-            if self.pack_size > 0
-            else None
+        streaming = (
+            self.streaming_fetch and not self.chunked_fetch and not self.save_data_path
         )
 
-        self.ref_object_types = {sha1: None for sha1 in self.remote_refs.values()}
+        while True:
+            fetch_info: Optional[FetchPackReturn]
+            self.fetch_progress = utils.FetchProgress()
+            try:
+                with raise_not_found_repository():
+                    if streaming:
+                        fetch_info = self.start_streaming_fetch(
+                            base_repo, do_remote, flush_remote_log
+                        )
+                    else:
+                        fetch_info = self.fetch_pack_from_origin(
+                            self.origin.url, base_repo, do_remote
+                        )
+            except NotFound:
+                # NotFound inherits from ValueError and should not be caught
+                # by the next exception handler
+                raise
+            except PackSizeLimitExceeded:
+                if not self.chunked_fetch or len(self.fetch_wants) <= 1:
+                    raise
+                # Try again with half of the wanted objects, the others will be
+                # fetched in the next rounds
+                self.wants_per_fetch = len(self.fetch_wants) // 2
+                logger.info(
+                    "Pack file too big for %s wanted objects, fetching %s of them",
+                    len(self.fetch_wants),
+                    self.wants_per_fetch,
+                )
+            else:
+                if not streaming:
+                    flush_remote_log()
+                break
+
+        if fetch_info is not None:
+            self.set_fetch_info(fetch_info)
+        else:
+            # Symbolic refs are only known at the end of the fetch
+            self.symbolic_refs = {}
 
         logger.info(
             "Listed %d refs for repo %s",
@@ -485,8 +1083,104 @@ class GitLoader(BaseGitLoader):
             },
         )
 
-        # No more data to fetch
-        return False
+        self.refs_unchanged = (
+            fetch_info is not None
+            and self.fetch_round == 1
+            and self.refs_match_snapshot(self.prev_snapshot)
+        )
+        if self.refs_unchanged:
+            # Nothing to load, the previous snapshot is reused as is
+            logger.info("Refs of repo %s are unchanged", self.origin.url)
+            self.statsd.increment("swh_loader_git_unchanged_refs_total", tags={})
+            self.pack_data = None
+            self.pack_objects = None
+            self.pack_summary = None
+            return False
+
+        self.pack_data = (
+            PackData.from_file(
+                file=self.pack_buffer,
+                size=self.pack_size,
+                object_format=SHA1,
+            )
+            if fetch_info is not None and self.pack_size > 0
+            else None
+        )
+        self.pack_summary = (
+            PackSummary.from_index(self.pack_index)
+            if self.pack_data is not None
+            and self.pack_index is not None
+            and self.pack_index.complete
+            else None
+        )
+        if self.pack_summary is not None:
+            logger.debug(
+                "Packfile objects by type: %s, of unknown type: %s, "
+                "by delta chain length: %s",
+                dict(self.pack_summary.object_counts),
+                self.pack_summary.unknown_type_count,
+                dict(sorted(self.pack_summary.delta_depths.items())),
+                extra={"swh_type": "git_pack_summary"},
+            )
+        inflate: Optional[Callable[[], Iterator[PackObject]]] = None
+        if self.pack_data is not None:
+            inflate = self._inflate_pack
+        elif self.pack_stream is not None:
+            inflate = self._inflate_pack_stream
+        if self.resumed_pack is not None:
+            inflate = partial(self._inflate_resumed_pack, inflate)
+        self.pack_objects = (
+            PackObjectDispatcher(inflate, spool_max_size=self.temp_file_cutoff)
+            if inflate is not None
+            else None
+        )
+
+        # Keep the types of the objects loaded by previous fetch rounds
+        self.ref_object_types = {
+            sha1: self.ref_object_types.get(sha1) for sha1 in self.remote_refs.values()
+        }
+
+        if self.more_wants:
+            logger.info(
+                "Fetch round %s loads %s wanted objects, more will be fetched",
+                self.fetch_round,
+                len(self.fetch_wants),
+            )
+        return self.more_wants
+
+    def refs_match_snapshot(self, snapshot: Snapshot) -> bool:
+        """Check whether the snapshot of the remote refs would be `snapshot`,
+        without looking up the types of their targets in the archive."""
+        if not snapshot.branches:
+            # Either no previous snapshot, or an empty repository
+            return False
+
+        branches: Dict[bytes, Optional[SnapshotBranch]] = {}
+        for ref_name, ref_object in self.remote_refs.items():
+            if ref_name in self.symbolic_refs:
+                continue
+            branch = snapshot.branches.get(ref_name)
+            if (
+                branch is None
+                or branch.target_type == SnapshotTargetType.ALIAS
+                or branch.target != hashutil.hash_to_bytes(ref_object.decode())
+            ):
+                return False
+            branches[ref_name] = branch
+
+        # Same handling of symbolic references as in get_snapshot
+        for sym_ref_name, sym_ref_target in self.symbolic_refs.items():
+            branches[sym_ref_name] = SnapshotBranch(
+                target_type=SnapshotTargetType.ALIAS,
+                target=sym_ref_target,
+            )
+            if (
+                sym_ref_target not in branches
+                and sym_ref_target not in self.remote_refs
+            ):
+                branches[sym_ref_target] = None
+
+        return Snapshot(branches=branches).id == snapshot.id
 
     def save_data(self) -> None:
         """Store a pack for archival"""
@@ -495,8 +1189,11 @@ class GitLoader(BaseGitLoader):
         write_size = 8192
         pack_dir = self.get_save_data_path()
 
-        pack_name = "%s.pack" % self.visit_date.isoformat()
-        refs_name = "%s.refs" % self.visit_date.isoformat()
+        name = self.visit_date.isoformat()
+        if self.fetch_round > 1:
+            name += ".%s" % self.fetch_round
+        pack_name = "%s.pack" % name
+        refs_name = "%s.refs" % name
 
         with open(os.path.join(pack_dir, pack_name), "xb") as f:
             self.pack_buffer.seek(0)
@@ -511,16 +1208,22 @@ class GitLoader(BaseGitLoader):
         with open(os.path.join(pack_dir, refs_name), "xb") as f:
             pickle.dump(self.remote_refs, f)
 
-    def _resolve_ext_ref(self, sha1: bytes) -> Tuple[int, List[bytes]]:
-        """Resolve external references to git objects a pack file might contain
-        by getting associated git manifests from the archive.
+    def _prefetch_ext_refs(self, sha1s: List[bytes]) -> None:
+        """Get the git manifests of the given external references to git objects
+        a pack file might contain from the archive, in batches.
+
+        Objects are looked up as contents, then directories, revisions and
+        releases; the data of contents and the entries of directories are fetched
+        concurrently. Each reference is counted in the
+        ``swh_loader_git_external_reference_fetch_total`` metric once.
         """
         storage = self.storage
         ext_refs = self.ext_refs
         statsd_metric = "swh_loader_git_external_reference_fetch_total"
 
-        def set_ext_ref(type_num, manifest, swh_type):
+        def set_ext_ref(sha1, type_num, manifest):
             ext_refs[sha1] = (type_num, [manifest.split(b"\x00", maxsplit=1)[1]])
+            swh_type = EXT_REF_TYPES[type_num]
             self.statsd.increment(
                 statsd_metric,
                 tags={"type": swh_type, "result": "found"},
@@ -531,43 +1234,78 @@ class GitLoader(BaseGitLoader):
                 swh_type,
             )
 
-        if sha1 not in ext_refs:
-            cnts = storage.content_find({"sha1_git": sha1})
-            if cnts and cnts[0] is not None:
-                cnt = cnts[0]
-                d = cnt.to_dict()
-                d["data"] = storage.content_get_data(objid_from_dict(d))
-                cnt = Content.from_dict(d)
-                cnt.check()
-                set_ext_ref(Blob.type_num, content_git_object(cnt), "content")
-        if sha1 not in ext_refs:
-            dir = directory_get(storage, sha1)
-            if dir is not None:
-                dir.check()
-                set_ext_ref(Tree.type_num, directory_git_object(dir), "directory")
-        if sha1 not in ext_refs:
-            rev = storage.revision_get([sha1], ignore_displayname=True)[0]
-            if rev is not None:
-                rev.check()
-                set_ext_ref(Commit.type_num, revision_git_object(rev), "revision")
-        if sha1 not in ext_refs:
-            rel = storage.release_get([sha1], ignore_displayname=True)[0]
-            if rel is not None:
-                rel.check()
-                set_ext_ref(Tag.type_num, release_git_object(rel), "release")
-
-        if sha1 not in ext_refs:
-            self.statsd.increment(
-                statsd_metric,
-                tags={"type": "unknown", "result": "not_found"},
-            )
-            self.log.debug(
-                "External reference %s in the pack file could not be resolved from the archive",
-                hashutil.hash_to_hex(sha1),
-            )
-            ext_refs[sha1] = None
+        def content_with_data(cnt: Content) -> Content:
+            d = cnt.to_dict()
+            d["data"] = storage.content_get_data(objid_from_dict(d))
+            return Content.from_dict(d)
+
+        with ThreadPoolExecutor(max_workers=self.ext_ref_fetch_threads) as executor:
+            for batch in grouper(dict.fromkeys(sha1s), EXT_REF_FETCH_BATCH_SIZE):
+                remaining = [sha1 for sha1 in batch if sha1 not in ext_refs]
+
+                missing = set(storage.content_missing_per_sha1_git(remaining))
+                found = [sha1 for sha1 in remaining if sha1 not in missing]
+                if found:
+                    contents = [
+                        cnt
+                        for cnt in storage.content_get(found, algo="sha1_git")
+                        if cnt is not None
+                    ]
+                    for cnt in executor.map(content_with_data, contents):
+                        cnt.check()
+                        set_ext_ref(
+                            cnt.sha1_git, Blob.type_num, content_git_object(cnt)
+                        )
+                    remaining = [sha1 for sha1 in remaining if sha1 not in ext_refs]
+
+                missing = set(storage.directory_missing(remaining))
+                found = [sha1 for sha1 in remaining if sha1 not in missing]
+                for dir in executor.map(partial(directory_get, storage), found):
+                    if dir is not None:
+                        dir.check()
+                        set_ext_ref(dir.id, Tree.type_num, directory_git_object(dir))
+                remaining = [sha1 for sha1 in remaining if sha1 not in ext_refs]
+
+                if remaining:
+                    revs = storage.revision_get(remaining, ignore_displayname=True)
+                    for sha1, rev in zip(remaining, revs):
+                        if rev is not None:
+                            rev.check()
+                            set_ext_ref(sha1, Commit.type_num, revision_git_object(rev))
+                    remaining = [sha1 for sha1 in remaining if sha1 not in ext_refs]
+
+                if remaining:
+                    rels = storage.release_get(remaining, ignore_displayname=True)
+                    for sha1, rel in zip(remaining, rels):
+                        if rel is not None:
+                            rel.check()
+                            set_ext_ref(sha1, Tag.type_num, release_git_object(rel))
+                    remaining = [sha1 for sha1 in remaining if sha1 not in ext_refs]
+
+                for sha1 in remaining:
+                    ext_refs[sha1] = None
+                    self.statsd.increment(
+                        statsd_metric,
+                        tags={"type": "unknown", "result": "not_found"},
+                    )
+                    self.log.debug(
+                        "External reference %s in the pack file could not be "
+                        "resolved from the archive",
+                        hashutil.hash_to_hex(sha1),
+                    )
 
-        ext_ref = ext_refs[sha1]
+    def _resolve_ext_ref(self, sha1: bytes) -> Tuple[int, List[bytes]]:
+        """Resolve external references to git objects a pack file might contain
+        by getting associated git manifests from the archive.
+
+        Manifests are kept until the pack file is loaded, so that bases evicted
+        from the delta base cache of the inflater are resolved again without
+        querying the archive.
+        """
+        if sha1 not in self.ext_refs:
+            self._prefetch_ext_refs([sha1])
+
+        ext_ref = self.ext_refs[sha1]
         if ext_ref is None:
             # dulwich catches this exception but checks for pending objects in the pack once
             # all ref chains have been walked
@@ -576,20 +1314,119 @@ class GitLoader(BaseGitLoader):
             )
         return ext_ref
 
-    def iter_objects(self, object_type: bytes) -> Iterator[ShaFile]:
-        """Read all the objects of type `object_type` from the packfile"""
-        if self.pack_data:
+    def _inflate_pack(self) -> Iterator[PackObject]:
+        """Inflate all the objects of the packfile, resolving each delta chain once.
+        Blobs over ``max_content_size`` are only hashed. Entries indexed during the
+        download are not read again."""
+        assert self.pack_data is not None
+        if (
+            self.inflate_processes > 0
+            and self.pack_index is not None
+            and self.pack_index.complete
+        ):
+            yield from self._inflate_pack_parallel()
+            return
+        index = (
+            self.pack_index
+            if self.pack_index is not None and self.pack_index.complete
+            else None
+        )
+        with file_contents(self.pack_buffer) as contents:
+            inflater = SwhPackInflater(
+                contents,
+                entries=index.entries if index is not None else None,
+                offsets=index.offsets if index is not None else None,
+                resolve_ext_ref=self._resolve_ext_ref,
+                prefetch_ext_refs=self._prefetch_ext_refs,
+                max_blob_size=self.max_content_size,
+                base_cache_size=self.delta_base_cache_size,
+            )
+            yield from inflater
+        self._report_delta_base_cache(inflater)
+        if index is not None:
+            self._index_delta_objects(inflater.offsets)
+
+    def _inflate_pack_parallel(self) -> Iterator[PackObject]:
+        """Inflate the objects of the packfile in ``inflate_processes`` worker
+        processes, which read it from a temporary file"""
+        assert self.pack_data is not None and self.pack_index is not None
+        with NamedTemporaryFile(suffix=".pack") as pack_file:
+            # Copied from the mapping of the spool once it rolled over to disk
+            with file_contents(self.pack_buffer) as contents:
+                write_size = 1024 * 1024
+                for pos in range(0, self.pack_size, write_size):
+                    pack_file.write(contents[pos : pos + write_size])
+            pack_file.flush()
+            inflater = ParallelPackInflater(
+                pack_file.name,
+                self.pack_index.entries,
+                self.pack_index.offsets,
+                processes=self.inflate_processes,
+                resolve_ext_ref=self._resolve_ext_ref,
+                prefetch_ext_refs=self._prefetch_ext_refs,
+                max_blob_size=self.max_content_size,
+                base_cache_size=self.delta_base_cache_size,
+            )
+            yield from inflater
+        self._index_delta_objects(inflater.delta_offsets)
+
+    def _inflate_pack_stream(self) -> Iterator[PackObject]:
+        """Inflate the objects of the packfile as it is being downloaded"""
+        assert self.pack_stream is not None
+        inflater = StreamingPackInflater(
+            self.pack_stream,
+            resolve_ext_ref=self._resolve_ext_ref,
+            prefetch_ext_refs=self._prefetch_ext_refs,
+            max_blob_size=self.max_content_size,
+            base_cache_size=self.delta_base_cache_size,
+        )
+        yield from inflater
+        self._report_delta_base_cache(inflater)
+        self.finish_streaming_fetch()
+
+    def _index_delta_objects(self, offsets: Mapping[bytes, int]) -> None:
+        """Resolve the types of all the delta objects of the indexed packfile once
+        it is inflated, from the `offsets` of the objects by binary sha1"""
+        assert self.pack_index is not None
+        self.pack_index.add_object_offsets(offsets)
+        self.pack_summary = PackSummary.from_index(self.pack_index)
+
+    def _report_delta_base_cache(self, inflater: SwhPackInflater) -> None:
+        for result, count in (
+            ("hit", inflater.cache.hits),
+            ("miss", inflater.cache.misses),
+        ):
+            self.statsd.increment(
+                "swh_loader_git_delta_base_cache_total", count, tags={"result": result}
+            )
 
-            self.pack_buffer.seek(0)
+    def _inflate_resumed_pack(
+        self, inflate: Optional[Callable[[], Iterator[PackObject]]]
+    ) -> Iterator[PackObject]:
+        """Inflate the objects of the resumed partial packfile, then the ones
+        returned by `inflate`"""
+        assert self.resumed_pack is not None
+        with path_contents(self.resumed_pack.path) as contents:
+            yield from SwhPackInflater(
+                contents,
+                resolve_ext_ref=self._resolve_ext_ref,
+                prefetch_ext_refs=self._prefetch_ext_refs,
+                max_blob_size=self.max_content_size,
+                base_cache_size=self.delta_base_cache_size,
+            )
+        if inflate is not None:
+            yield from inflate()
+
+    def iter_objects(self, object_type: bytes) -> Iterator[PackObject]:
+        """Read all the objects of type `object_type` from the packfile.
+
+        The packfile is inflated only once: objects of other types met while
+        reading those of type `object_type` are spooled until requested."""
+        if self.pack_objects:
             count = 0
 
             start_time = time.monotonic()
-            obj_iter = iter(
-                PackInflater.for_pack_data(
-                    self.pack_data,
-                    resolve_ext_ref=self._resolve_ext_ref,
-                )
-            )
+            obj_iter = self.pack_objects.iter_objects(object_type)
             total_time_inflate_packfile = time.monotonic() - start_time
 
             while True:
@@ -598,10 +1435,9 @@ class GitLoader(BaseGitLoader):
                 # batch pack inflation to avoid too many time.monotonic() calls
                 start_time = time.monotonic()
                 for obj in obj_iter:
-                    if obj.type_name == object_type:
-                        objs.append(obj)
-                        if len(objs) > 1000:
-                            break
+                    objs.append(obj)
+                    if len(objs) > 1000:
+                        break
                 total_time_inflate_packfile += time.monotonic() - start_time
 
                 if not objs:
@@ -616,39 +1452,262 @@ class GitLoader(BaseGitLoader):
             )
             logger.debug("packfile_read_count_%s=%s", object_type.decode(), count)
 
+    def iter_missing_objects(
+        self, object_type: bytes, seen: Optional[Set[bytes]] = None
+    ) -> Iterator[PackObject]:
+        """Read the objects of type `object_type` from the packfile, skipping those
+        already in the archive.
+
+        Objects are looked up in the archive by batches as large as the storage
+        batches, so that known objects are never converted nor sent to the
+        storage. They are counted in :attr:`known_objects`. The ids of all the
+        objects read, archived or not, are added to `seen` if given."""
+        swh_type = converters.DULWICH_OBJECT_TYPES[object_type].value
+        target_type = converters.DULWICH_TARGET_TYPES[object_type]
+        missing = {
+            "content": self.storage.content_missing_per_sha1_git,
+            "directory": self.storage.directory_missing,
+            "revision": self.storage.revision_missing,
+            "release": self.storage.release_missing,
+        }[swh_type]
+        max_count = self.storage_batch_size[swh_type]
+        max_bytes = self.storage_batch_size.get(f"{swh_type}_bytes")
+
+        def filter_batch(batch: List[PackObject]) -> Iterator[PackObject]:
+            missing_ids = set(
+                missing([hashutil.bytehex_to_hash(obj.id) for obj in batch])
+            )
+            for obj in batch:
+                if hashutil.bytehex_to_hash(obj.id) in missing_ids:
+                    yield obj
+                else:
+                    self.known_objects[swh_type] += 1
+
+        batch: List[PackObject] = []
+        batch_bytes = 0
+        for raw_obj in self.iter_objects(object_type):
+            if raw_obj.id in self.ref_object_types:
+                self.ref_object_types[raw_obj.id] = target_type
+            if seen is not None:
+                seen.add(raw_obj.id)
+
+            batch.append(raw_obj)
+            if max_bytes is not None and isinstance(raw_obj, ShaFile):
+                batch_bytes += raw_obj.raw_length()
+            if len(batch) >= max_count or (
+                max_bytes is not None and batch_bytes >= max_bytes
+            ):
+                yield from filter_batch(batch)
+                batch = []
+                batch_bytes = 0
+
+        if batch:
+            yield from filter_batch(batch)
+
+    def may_load_objects(self, type_num: int) -> bool:
+        """Whether objects of type `type_num` may have to be loaded, which is
+        only ruled out by the summary of the fetched packfile"""
+        return (
+            self.pack_summary is None
+            or self.resumed_pack is not None
+            or self.pack_summary.may_contain(type_num)
+        )
+
+    def expected_object_count(self) -> Optional[int]:
+        if self.pack_summary is None or self.resumed_pack is not None:
+            return None
+        return self.pack_summary.object_count
+
+    def has_contents(self) -> bool:
+        # Blobs omitted by the blob filter are loaded as skipped contents
+        return self.blob_filter_spec() is not None or self.may_load_objects(
+            Blob.type_num
+        )
+
     def get_contents(self) -> Iterable[BaseContent]:
         """Format the blobs from the git repository as swh contents"""
-        for raw_obj in self.iter_objects(Blob.type_name):
-            if raw_obj.id in self.ref_object_types:
-                self.ref_object_types[raw_obj.id] = SnapshotTargetType.CONTENT
+        # Blobs sent by the server, to find out those omitted by the blob filter
+        fetched: Optional[Set[bytes]] = (
+            set() if self.blob_filter_spec() is not None else None
+        )
+
+        def to_content(raw_obj: PackObject) -> BaseContent:
+            if isinstance(raw_obj, SkippedBlob):
+                # Blob too large to be inflated from the packfile
+                return SkippedContent(
+                    status="absent", reason="Content too large", **raw_obj.hashes
+                )
+            # Objects are hashed while the packfile is inflated
+            return converters.dulwich_blob_to_content(
+                raw_obj,
+                max_content_size=self.max_content_size,
+                sha1_git_verified=True,
+            )
+
+        if self.content_hash_threads > 0:
+            with ThreadPoolExecutor(
+                max_workers=self.content_hash_threads,
+                thread_name_prefix="content-hash",
+            ) as executor:
+                yield from utils.map_in_batches(
+                    executor,
+                    to_content,
+                    self.iter_missing_objects(Blob.type_name, seen=fetched),
+                    size=lambda obj: (
+                        obj.raw_length() if isinstance(obj, ShaFile) else 0
+                    ),
+                    batch_bytes=CONTENT_HASH_BATCH_BYTES,
+                    max_pending_bytes=self.content_hash_max_bytes,
+                )
+        else:
+            yield from map(
+                to_content, self.iter_missing_objects(Blob.type_name, seen=fetched)
+            )
 
-            yield converters.dulwich_blob_to_content(
-                raw_obj, max_content_size=self.max_content_size
+        if fetched is not None:
+            yield from self.get_omitted_contents(fetched)
+
+    def get_omitted_contents(self, fetched: Set[bytes]) -> Iterator[SkippedContent]:
+        """Record the blobs referenced by the trees of the packfile which were
+        omitted by the blob filter, and are not in the archive yet, as skipped
+        contents. Only their ``sha1_git`` is known."""
+        if not self.pack_objects:
+            return
+
+        referenced: Set[bytes] = set()
+        for raw_obj in self.pack_objects.peek_objects(Tree.type_name):
+            for entry in cast(Tree, raw_obj).iteritems():
+                if (
+                    entry.mode & converters.COMMIT_MODE_MASK
+                    == converters.COMMIT_MODE_MASK
+                    or entry.mode & converters.TREE_MODE_MASK
+                    == converters.TREE_MODE_MASK
+                ):
+                    # Not a blob
+                    continue
+                if entry.sha not in fetched:
+                    referenced.add(hashutil.bytehex_to_hash(entry.sha))
+
+        omitted: List[SkippedContent] = []
+        for batch in grouper(sorted(referenced), self.storage_batch_size["content"]):
+            omitted.extend(
+                SkippedContent(
+                    sha1=None,
+                    sha1_git=sha1_git,
+                    sha256=None,
+                    blake2s256=None,
+                    length=-1,
+                    status="absent",
+                    reason="Content too large",
+                )
+                for sha1_git in self.storage.content_missing_per_sha1_git(list(batch))
+            )
+        if not omitted:
+            return
+
+        # Skipped contents are looked up with all the hashes they are recorded with
+        missing = {
+            hashes["sha1_git"]
+            for hashes in self.storage.skipped_content_missing(
+                [content.to_dict() for content in omitted]
+            )
+        }
+        yield from (content for content in omitted if content.sha1_git in missing)
+
+    def has_directories(self) -> bool:
+        return self.may_load_objects(Tree.type_num)
+
+    def convert_missing_objects(
+        self, object_type: bytes, convert: Callable[[ShaFile], T]
+    ) -> Iterator[T]:
+        """Convert the objects of type `object_type` which are not in the archive
+        with `convert`, or in the ``convert_processes`` worker processes"""
+        raw_objs = (
+            cast(ShaFile, raw_obj) for raw_obj in self.iter_missing_objects(object_type)
+        )
+        if self.convert_processes <= 0:
+            yield from map(convert, raw_objs)
+            return
+
+        if self.convert_executor is None:
+            self.convert_executor = ProcessPoolExecutor(
+                max_workers=self.convert_processes,
+                mp_context=multiprocessing.get_context("spawn"),
             )
+        yield from cast(
+            Iterator[T],
+            utils.map_in_batches(
+                self.convert_executor,
+                converters.raw_object_to_model,
+                (
+                    (raw_obj.type_num, raw_obj.as_raw_string(), raw_obj.id)
+                    for raw_obj in raw_objs
+                ),
+                size=lambda raw_obj: len(raw_obj[1]),
+                batch_bytes=CONVERT_BATCH_BYTES,
+                max_pending_bytes=CONVERT_BATCH_BYTES * 4 * self.convert_processes,
+            ),
+        )
 
     def get_directories(self) -> Iterable[Directory]:
         """Format the trees as swh directories"""
-        for raw_obj in self.iter_objects(Tree.type_name):
-            if raw_obj.id in self.ref_object_types:
-                self.ref_object_types[raw_obj.id] = SnapshotTargetType.DIRECTORY
+        return self.convert_missing_objects(
+            Tree.type_name, converters.dulwich_tree_to_directory
+        )
 
-            yield converters.dulwich_tree_to_directory(raw_obj)
+    def has_revisions(self) -> bool:
+        return self.may_load_objects(Commit.type_num)
 
     def get_revisions(self) -> Iterable[Revision]:
         """Format commits as swh revisions"""
-        for raw_obj in self.iter_objects(Commit.type_name):
-            if raw_obj.id in self.ref_object_types:
-                self.ref_object_types[raw_obj.id] = SnapshotTargetType.REVISION
+        return self.convert_missing_objects(
+            Commit.type_name, converters.dulwich_commit_to_revision
+        )
 
-            yield converters.dulwich_commit_to_revision(raw_obj)
+    def has_releases(self) -> bool:
+        return self.may_load_objects(Tag.type_num)
 
     def get_releases(self) -> Iterable[Release]:
         """Retrieve all the release objects from the git repository"""
-        for raw_obj in self.iter_objects(Tag.type_name):
-            if raw_obj.id in self.ref_object_types:
-                self.ref_object_types[raw_obj.id] = SnapshotTargetType.RELEASE
+        return self.convert_missing_objects(
+            Tag.type_name, converters.dulwich_tag_to_release
+        )
 
-            yield converters.dulwich_tag_to_release(raw_obj)
+    def store_data(self) -> None:
+        if self.refs_unchanged:
+            # No need to store anything, nor to compute the snapshot again
+            self.snapshot = self.prev_snapshot
+            self.loaded_snapshot_id = self.prev_snapshot.id
+            return
+        super().store_data()
+        # Its objects are now in the archive
+        self.close_resumed_pack(remove=True)
+
+    def has_snapshot(self) -> bool:
+        return not self.more_wants
+
+    def build_partial_snapshot(self) -> Optional[Snapshot]:
+        """Build a snapshot of the branches whose targets were loaded by the fetch
+        rounds done so far, when fetching the repository in several rounds."""
+        branches: Dict[bytes, Optional[SnapshotBranch]] = {}
+        for ref_name, ref_object in self.remote_refs.items():
+            target_type = self.ref_object_types.get(ref_object)
+            if ref_name not in self.symbolic_refs and target_type:
+                branches[ref_name] = SnapshotBranch(
+                    target=hashutil.hash_to_bytes(ref_object.decode()),
+                    target_type=target_type,
+                )
+        return Snapshot(branches=branches) if branches else None
+
+    def pack_object_type(self, sha1: bytes) -> Optional[SnapshotTargetType]:
+        """Type of the object of binary `sha1` in the fetched packfile, as resolved
+        by its index"""
+        if self.pack_index is None:
+            return None
+        type_num = self.pack_index.object_type(sha1)
+        if type_num is None:
+            return None
+        return SnapshotTargetType(EXT_REF_TYPES[type_num])
 
     def get_snapshot(self) -> Snapshot:
         """Get the snapshot for the current visit.
@@ -666,6 +1725,8 @@ class GitLoader(BaseGitLoader):
         the type of these objects from the previous snapshot.
 
         """
+        self.finish_streaming_fetch()
+
         branches: Dict[bytes, Optional[SnapshotBranch]] = {}
 
         unfetched_refs: Dict[bytes, bytes] = {}
@@ -676,6 +1737,9 @@ class GitLoader(BaseGitLoader):
                 continue
             ref_target = hashutil.hash_to_bytes(ref_object.decode())
             target_type = self.ref_object_types.get(ref_object)
+            if target_type is None:
+                # Objects of the packfile which were not read are typed by its index
+                target_type = self.pack_object_type(ref_target)
             if target_type:
                 branches[ref_name] = SnapshotBranch(
                     target=ref_target, target_type=target_type
@@ -0,0 +1,1371 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Helpers to read the objects contained in a git packfile"""
+
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+import hashlib
+import io
+import itertools
+import mmap
+import multiprocessing
+import os
+import pickle
+import struct
+from tempfile import SpooledTemporaryFile
+import threading
+from typing import (
+    IO,
+    Any,
+    Callable,
+    ClassVar,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+import zlib
+
+from dulwich.lru_cache import LRUSizeCache
+from dulwich.objects import (
+    Blob,
+    ObjectID,
+    RawObjectID,
+    ShaFile,
+    object_header,
+    sha_to_hex,
+)
+from dulwich.pack import (
+    OFS_DELTA,
+    REF_DELTA,
+    UnpackedObject,
+    UnresolvedDeltas,
+    apply_delta,
+)
+
+from swh.model.hashutil import DEFAULT_ALGORITHMS, MultiHash
+
+# Type number, raw length and binary sha1 of each spooled object
+_SPOOL_HEADER = struct.Struct("!BQ20s")
+
+# Type number of spooled SkippedBlob objects, unused by git
+_SKIPPED_BLOB_TYPE_NUM = 0
+
+# Maximum size of the decompressed chunks read from pack entries at once
+_STREAM_CHUNK_SIZE = 1024 * 1024
+
+# Signature, version and number of objects of a packfile
+_PACK_HEADER = struct.Struct("!4sLL")
+
+# Get the type number and data chunks of an object missing from the packfile
+ResolveExtRefFn = Callable[[bytes], Tuple[int, List[bytes]]]
+
+
+@dataclass
+class SkippedBlob:
+    """Blob of a packfile too large to be inflated in memory, only hashed while
+    streaming its decompressed data."""
+
+    type_name: ClassVar[bytes] = Blob.type_name
+    type_num: ClassVar[int] = Blob.type_num
+
+    hashes: Dict[str, Any]
+    """hashes of the blob data, as computed by :class:`MultiHash`, and its length"""
+
+    @property
+    def id(self) -> ObjectID:
+        return sha_to_hex(self.hashes["sha1_git"])
+
+
+PackObject = Union[ShaFile, SkippedBlob]
+
+
+def read_exact(contents: Any, pos: int, size: int) -> bytes:
+    """Read `size` bytes at offset `pos` of `contents`, which may return less
+    data than requested when it is a :class:`PackStream`."""
+    data = bytes(contents[pos : pos + size])
+    while len(data) < size:
+        chunk = contents[pos + len(data) : pos + size]
+        if not chunk:
+            raise zlib.error("EOF while reading pack entry")
+        data += chunk
+    return data
+
+
+def read_entry_header(contents: Any, offset: int) -> Tuple[UnpackedObject, int]:
+    """Read the header of the pack entry at `offset` in `contents`.
+
+    Returns:
+        the entry, with its ``offset``, ``pack_type_num``, ``delta_base`` and
+        ``decomp_len`` set, and the offset of the zlib stream of its data
+    """
+    pos = offset
+    byte = contents[pos]
+    pos += 1
+    type_num = (byte >> 4) & 0x07
+    size = byte & 0x0F
+    shift = 4
+    while byte & 0x80:
+        byte = contents[pos]
+        pos += 1
+        size += (byte & 0x7F) << shift
+        shift += 7
+
+    delta_base: Union[int, bytes, None] = None
+    if type_num == OFS_DELTA:
+        byte = contents[pos]
+        pos += 1
+        base_offset = byte & 0x7F
+        while byte & 0x80:
+            byte = contents[pos]
+            pos += 1
+            base_offset = ((base_offset + 1) << 7) + (byte & 0x7F)
+        delta_base = base_offset
+    elif type_num == REF_DELTA:
+        delta_base = read_exact(contents, pos, 20)
+        pos += 20
+
+    unpacked = UnpackedObject(
+        type_num, delta_base=delta_base, decomp_len=size, offset=offset
+    )
+    return unpacked, pos
+
+
+def inflate_entry_data(
+    contents: Any, pos: int, size: int, consume: Callable[[bytes], Any]
+) -> int:
+    """Decompress the zlib stream of a pack entry starting at `pos` in `contents`,
+    passing the decompressed data to `consume` in bounded chunks, so that the
+    entry is never held in memory as a whole.
+
+    Returns:
+        the offset of the end of the zlib stream
+    """
+    decompressor = zlib.decompressobj()
+    length = 0
+    while not decompressor.eof:
+        data = decompressor.unconsumed_tail
+        if not data:
+            data = contents[pos : pos + _STREAM_CHUNK_SIZE]
+            if not data:
+                raise zlib.error("EOF before end of zlib stream")
+            pos += len(data)
+        chunk = decompressor.decompress(data, _STREAM_CHUNK_SIZE)
+        length += len(chunk)
+        if length > size:
+            raise zlib.error("decompressed data exceeds expected size")
+        consume(chunk)
+    if length != size:
+        raise zlib.error("decompressed data does not match expected size")
+    return pos - len(decompressor.unused_data)
+
+
+def iter_pack_entries(contents: Any) -> Iterator[UnpackedObject]:
+    """Yield the headers of all the entries of the packfile in `contents`, as read
+    by :func:`read_entry_header`, without keeping their decompressed data."""
+    yield from _iter_entries(contents, _PACK_HEADER.size, read_pack_header(contents))
+
+
+def _iter_entries(contents: Any, offset: int, count: int) -> Iterator[UnpackedObject]:
+    for _ in range(count):
+        unpacked, pos = read_entry_header(contents, offset)
+        assert unpacked.decomp_len is not None
+        offset = inflate_entry_data(
+            contents, pos, unpacked.decomp_len, lambda chunk: None
+        )
+        yield unpacked
+
+
+def read_pack_header(contents: Any) -> int:
+    """Check the header of the packfile in `contents`, and return its number of
+    objects."""
+    signature, version, count = _PACK_HEADER.unpack(
+        read_exact(contents, 0, _PACK_HEADER.size)
+    )
+    if signature != b"PACK" or version not in (2, 3):
+        raise AssertionError(f"Invalid pack header {signature!r}, version {version}")
+    return count
+
+
+class FileContents:
+    """Random access to the bytes of a file object, by slicing"""
+
+    def __init__(self, file: IO[bytes]):
+        self.file = file
+
+    def __getitem__(self, key: Union[int, slice]) -> Any:
+        if isinstance(key, slice):
+            self.file.seek(key.start)
+            return self.file.read(key.stop - key.start)
+        self.file.seek(key)
+        data = self.file.read(1)
+        if not data:
+            raise IndexError(key)
+        return data[0]
+
+
+@contextmanager
+def file_contents(file: IO[bytes]) -> Iterator[Any]:
+    """Give random access to the bytes written to `file` so far.
+
+    Files on disk, including :class:`SpooledTemporaryFile` objects which rolled
+    over, are memory-mapped: slicing them then costs neither a seek nor a read
+    call, and repeated passes are served from the page cache. Other files are
+    wrapped in a :class:`FileContents`. The mapping is released on exit.
+    """
+    contents: Any = FileContents(file)
+    # In-memory files, including SpooledTemporaryFile objects which did not
+    # roll over, have no name; fileno() would roll the latter over to disk
+    if getattr(file, "name", None) is not None:
+        try:
+            fd = file.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            pass
+        else:
+            file.flush()
+            size = os.fstat(fd).st_size
+            if size > 0:
+                contents = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+    try:
+        yield contents
+    finally:
+        if isinstance(contents, mmap.mmap):
+            contents.close()
+
+
+@contextmanager
+def path_contents(path: Union[str, "os.PathLike[str]"]) -> Iterator[Any]:
+    """Give random access to the bytes of the file at `path`, as
+    :func:`file_contents` does."""
+    with open(path, "rb") as file, file_contents(file) as contents:
+        yield contents
+
+
+def complete_entries(contents: Any) -> Tuple[int, int]:
+    """Find the entries at the start of a packfile whose download was interrupted
+    which were completely received.
+
+    Returns:
+        the number of complete entries, and the offset of their end
+    """
+    try:
+        total = read_pack_header(contents)
+    except (AssertionError, struct.error, zlib.error):
+        return 0, 0
+    count, offset = 0, _PACK_HEADER.size
+    while count < total:
+        try:
+            unpacked, pos = read_entry_header(contents, offset)
+            assert unpacked.decomp_len is not None
+            offset = inflate_entry_data(
+                contents, pos, unpacked.decomp_len, lambda chunk: None
+            )
+        except (IndexError, zlib.error):
+            break
+        count += 1
+    return count, offset
+
+
+def write_pack(file: IO[bytes], count: int, parts: Iterable[Tuple[Any, int]]) -> None:
+    """Write a packfile of `count` entries to `file`, copying them from the
+    ``(contents, end)`` parts: the entries of another packfile, from the end of
+    its header to offset `end` in its `contents`.
+
+    Offsets of ``OFS_DELTA`` bases are relative, so entries can be copied as is
+    as long as each part contains the bases of its deltas."""
+    checksum = hashlib.sha1()
+
+    def write(data: bytes) -> None:
+        checksum.update(data)
+        file.write(data)
+
+    write(_PACK_HEADER.pack(b"PACK", 2, count))
+    for contents, end in parts:
+        for pos in range(_PACK_HEADER.size, end, _STREAM_CHUNK_SIZE):
+            write(bytes(contents[pos : min(end, pos + _STREAM_CHUNK_SIZE)]))
+    file.write(checksum.digest())
+
+
+class ObjectSpool:
+    """Disk-backed FIFO of inflated git objects.
+
+    Objects are appended in their raw, uncompressed form to a
+    :class:`SpooledTemporaryFile`, which only rolls over to disk once it grows
+    over ``max_size`` bytes.
+    """
+
+    def __init__(self, max_size: int):
+        self.buffer = SpooledTemporaryFile(max_size=max_size)
+        self.count = 0
+
+    def append(self, obj: PackObject) -> None:
+        if isinstance(obj, SkippedBlob):
+            type_num = _SKIPPED_BLOB_TYPE_NUM
+            chunks = [pickle.dumps(obj.hashes)]
+            sha = obj.hashes["sha1_git"]
+        else:
+            type_num = obj.type_num
+            chunks = obj.as_raw_chunks()
+            sha = obj.sha().digest()
+        self.buffer.write(_SPOOL_HEADER.pack(type_num, sum(map(len, chunks)), sha))
+        for chunk in chunks:
+            self.buffer.write(chunk)
+        self.count += 1
+
+    def __iter__(self) -> Iterator[PackObject]:
+        """Read back all the objects appended so far, in order"""
+        with file_contents(self.buffer) as contents:
+            offset = 0
+            for _ in range(self.count):
+                header_end = offset + _SPOOL_HEADER.size
+                type_num, length, sha = _SPOOL_HEADER.unpack(
+                    contents[offset:header_end]
+                )
+                offset = header_end + length
+                raw = contents[header_end:offset]
+                if type_num == _SKIPPED_BLOB_TYPE_NUM:
+                    yield SkippedBlob(pickle.loads(raw))
+                else:
+                    # The sha was computed by the pack inflater, no need to hash
+                    # the object a second time
+                    yield ShaFile.from_raw_string(type_num, raw, sha=sha_to_hex(sha))
+
+    def close(self) -> None:
+        self.buffer.close()
+
+
+class PackObjectDispatcher:
+    """Route the objects produced by a single inflation pass over a packfile
+    to per-type consumers.
+
+    Inflation only starts when :meth:`iter_objects` is first called. Objects of
+    the requested type are yielded as they get inflated, while objects of
+    other types are stored in one :class:`ObjectSpool` per type, to be read
+    back when their own type is requested. This allows consumers to process
+    objects type by type while resolving each delta chain of the pack once.
+
+    Args:
+        inflate: callable returning an iterator over all the objects of the pack
+        spool_max_size: how many bytes each spool keeps in memory before
+          rolling over to disk
+    """
+
+    def __init__(
+        self,
+        inflate: Callable[[], Iterator[PackObject]],
+        spool_max_size: int,
+    ):
+        self.inflate = inflate
+        self.spool_max_size = spool_max_size
+        self.spools: Dict[bytes, ObjectSpool] = {}
+        self._objects: Optional[Iterator[PackObject]] = None
+        self._exhausted = False
+
+    def _spool(self, obj: PackObject) -> None:
+        spool = self.spools.get(obj.type_name)
+        if spool is None:
+            spool = self.spools[obj.type_name] = ObjectSpool(self.spool_max_size)
+        spool.append(obj)
+
+    def iter_objects(self, object_type: bytes) -> Iterator[PackObject]:
+        """Yield all the objects of type `object_type` that have not been yielded
+        yet, inflating the pack as far as needed."""
+        spool = self.spools.pop(object_type, None)
+        if spool is not None:
+            try:
+                yield from spool
+            finally:
+                spool.close()
+
+        if self._exhausted:
+            return
+
+        if self._objects is None:
+            self._objects = self.inflate()
+
+        for obj in self._objects:
+            if obj.type_name == object_type:
+                yield obj
+            else:
+                self._spool(obj)
+
+        self._exhausted = True
+
+    def peek_objects(self, object_type: bytes) -> Iterator[PackObject]:
+        """Yield all the objects of type `object_type` that have not been yielded
+        yet, without consuming them: the rest of the pack is inflated and spooled,
+        and :meth:`iter_objects` yields these objects again."""
+        if not self._exhausted:
+            if self._objects is None:
+                self._objects = self.inflate()
+            for obj in self._objects:
+                self._spool(obj)
+            self._exhausted = True
+
+        spool = self.spools.get(object_type)
+        if spool is not None:
+            yield from spool
+
+    def close(self) -> None:
+        for spool in self.spools.values():
+            spool.close()
+        self.spools.clear()
+
+
+class PackIndexer:
+    """Index of the entries of a packfile, built while it is being downloaded.
+
+    Data written to the indexer is parsed as it arrives: the offset, type and
+    size of each entry are recorded, and the ids of whole (non-delta) objects
+    are computed while decompressing their data. Only the data of the entry
+    being parsed is buffered.
+
+    The type of each delta object, the type of the whole object at the root of
+    its delta chain, is resolved as soon as the chain can be followed. Chains
+    going through ``REF_DELTA`` objects based on delta objects can only be
+    followed once the ids of these are known, from the inflaters of the pack
+    (see :meth:`add_object_offsets`).
+
+    Parsing errors are not raised, as the download should not fail because of
+    the index: they are kept in :attr:`error`, and the index is left incomplete.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        # Offset of the start of the buffer in the packfile
+        self.position = 0
+        self.count: Optional[int] = None
+        self.entries: List[UnpackedObject] = []
+        self.offsets: Dict[RawObjectID, int] = {}
+        """Offsets of the whole objects of the packfile, by binary sha1"""
+        self.type_counts: Dict[int, int] = Counter()
+        """Number of entries of each pack type"""
+        self.decompressed_size = 0
+        """Sum of the decompressed sizes of the entries indexed so far"""
+        self.delta_offsets: Dict[RawObjectID, int] = {}
+        """Offsets of the delta objects of the packfile whose id is known, by
+        binary sha1"""
+        self.chains: Dict[int, Tuple[int, int]] = {}
+        """Type and delta chain length of the objects of the packfile whose type
+        is resolved, by offset"""
+        # offsets of the delta objects whose type is not resolved yet, by offset
+        # or binary sha1 of their base
+        self._pending: Dict[Union[int, bytes], List[int]] = defaultdict(list)
+        self.error: Optional[Exception] = None
+        self._entry: Optional[UnpackedObject] = None
+        self._decompressor: Any = None
+        self._checksum: Any = None
+        self._length = 0
+
+    @property
+    def complete(self) -> bool:
+        """Whether all the entries of the packfile were indexed"""
+        return self.count is not None and len(self.entries) == self.count
+
+    def write(self, data: bytes) -> None:
+        if self.error is not None or self.complete:
+            return
+        self.buffer += data
+        try:
+            while not self.complete and self._parse():
+                pass
+        except (AssertionError, zlib.error) as e:
+            self.error = e
+            self.buffer.clear()
+
+    def _parse(self) -> bool:
+        """Parse the buffer, returning whether more entries could be parsed"""
+        if self.count is None:
+            if len(self.buffer) < _PACK_HEADER.size:
+                return False
+            self.count = read_pack_header(self.buffer)
+            self._consume(_PACK_HEADER.size)
+            return True
+
+        if self._entry is None:
+            try:
+                self._entry, pos = read_entry_header(self.buffer, 0)
+            except (IndexError, zlib.error):
+                # Truncated header
+                return False
+            assert self._entry.decomp_len is not None
+            self._entry.offset = self.position
+            self._consume(pos)
+            self._decompressor = zlib.decompressobj()
+            self._length = 0
+            if self._entry.pack_type_num in (OFS_DELTA, REF_DELTA):
+                self._checksum = None
+            else:
+                self._checksum = hashlib.sha1(
+                    object_header(self._entry.pack_type_num, self._entry.decomp_len)
+                )
+
+        data = self.buffer
+        while data and not self._decompressor.eof:
+            chunk = self._decompressor.decompress(data, _STREAM_CHUNK_SIZE)
+            self._length += len(chunk)
+            if self._checksum is not None:
+                self._checksum.update(chunk)
+            data = self._decompressor.unconsumed_tail
+        self._consume(len(self.buffer) - len(self._decompressor.unused_data))
+        if not self._decompressor.eof:
+            return False
+
+        entry, self._entry = self._entry, None
+        if self._length != entry.decomp_len:
+            raise zlib.error("decompressed data does not match expected size")
+        assert entry.offset is not None
+        if self._checksum is not None:
+            sha = RawObjectID(self._checksum.digest())
+            self.offsets[sha] = entry.offset
+            self._resolve(entry.offset, (entry.pack_type_num, 0))
+            self._learn_offset(sha, entry.offset)
+        elif entry.pack_type_num == OFS_DELTA:
+            assert isinstance(entry.delta_base, int)
+            # Bases of OFS_DELTA objects precede them in the pack
+            self._add_delta(entry.offset, entry.offset - entry.delta_base)
+        else:
+            assert isinstance(entry.delta_base, bytes)
+            base = RawObjectID(entry.delta_base)
+            self._add_delta(entry.offset, self.offsets.get(base, base))
+        self.entries.append(entry)
+        self.type_counts[entry.pack_type_num] += 1
+        self.decompressed_size += entry.decomp_len
+        return True
+
+    def _consume(self, size: int) -> None:
+        del self.buffer[:size]
+        self.position += size
+
+    def _add_delta(self, offset: int, base: Union[int, bytes]) -> None:
+        chain = self.chains.get(base) if isinstance(base, int) else None
+        if chain is None:
+            self._pending[base].append(offset)
+        else:
+            self._resolve(offset, (chain[0], chain[1] + 1))
+
+    def _resolve(self, offset: int, chain: Tuple[int, int]) -> None:
+        """Record the type and delta chain length of the object at `offset`, then
+        of the delta objects based on it, directly or not"""
+        todo = [(offset, chain)]
+        while todo:
+            offset, (type_num, depth) = todo.pop()
+            self.chains[offset] = (type_num, depth)
+            todo.extend(
+                (child, (type_num, depth + 1))
+                for child in self._pending.pop(offset, [])
+            )
+
+    def _learn_offset(self, sha: bytes, offset: int) -> None:
+        """Follow the delta objects based on the object of sha1 `sha`, now known
+        to be at `offset`"""
+        children = self._pending.pop(sha, [])
+        chain = self.chains.get(offset)
+        if chain is None:
+            self._pending[offset].extend(children)
+        else:
+            for child in children:
+                self._resolve(child, (chain[0], chain[1] + 1))
+
+    def add_object_offsets(self, offsets: Mapping[bytes, int]) -> None:
+        """Record the `offsets` of objects of the packfile by binary sha1, as
+        computed by its inflaters, to resolve the types of the delta objects
+        based on delta objects by their sha1"""
+        for sha, offset in offsets.items():
+            if sha not in self.offsets and sha not in self.delta_offsets:
+                self.delta_offsets[RawObjectID(sha)] = offset
+                self._learn_offset(sha, offset)
+
+    def object_type(self, sha: bytes) -> Optional[int]:
+        """Type number of the object of binary sha1 `sha` in the packfile, if it
+        is known"""
+        offset = self.offsets.get(RawObjectID(sha))
+        if offset is None:
+            offset = self.delta_offsets.get(RawObjectID(sha))
+        chain = self.chains.get(offset) if offset is not None else None
+        return chain[0] if chain is not None else None
+
+
+@dataclass
+class PackSummary:
+    """Summary of the objects of a packfile, computed from the headers of its
+    entries without inflating them.
+
+    The type of a delta object is the type of the whole object at the root of
+    its delta chain, which is only known when the chain can be followed within
+    the packfile, as resolved by :class:`PackIndexer`.
+    """
+
+    object_counts: Dict[int, int] = field(default_factory=Counter)
+    """Number of objects of each type, including delta objects of known type"""
+    unknown_type_count: int = 0
+    """Number of delta objects whose chain leads out of the packfile, or was not
+    followed yet"""
+    decompressed_size: int = 0
+    """Sum of the decompressed sizes of the entries, which is the size of the
+    delta rather than of the object for delta objects"""
+    delta_depths: Dict[int, int] = field(default_factory=Counter)
+    """Number of objects by length of their delta chain, 0 for whole objects"""
+
+    @classmethod
+    def from_index(cls, index: PackIndexer) -> "PackSummary":
+        """Summarize the entries of a packfile indexed by `index`, with the types
+        of delta objects resolved so far"""
+        summary = cls(decompressed_size=index.decompressed_size)
+        for type_num, depth in index.chains.values():
+            summary.object_counts[type_num] += 1
+            summary.delta_depths[depth] += 1
+        summary.unknown_type_count = len(index.entries) - len(index.chains)
+        return summary
+
+    @property
+    def object_count(self) -> int:
+        return sum(self.object_counts.values()) + self.unknown_type_count
+
+    def may_contain(self, type_num: int) -> bool:
+        """Whether the packfile may contain objects of type `type_num`"""
+        return self.object_counts.get(type_num, 0) > 0 or self.unknown_type_count > 0
+
+
+class PackStream:
+    """Packfile being downloaded, which can be read while it is written.
+
+    The fetching thread writes to it as to a file, and calls :meth:`finish` when
+    the download is over. Readers access its contents by slicing, like the
+    buffer of a :class:`PackData`: they wait for the requested data to be
+    downloaded, and slices may be shorter than requested until it is over.
+    """
+
+    def __init__(self, max_size: int):
+        self.file = SpooledTemporaryFile(max_size=max_size)
+        self.size = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.condition = threading.Condition()
+
+    def write(self, data: bytes) -> None:
+        with self.condition:
+            if self.done:
+                raise IOError("Packfile download aborted")
+            self.file.seek(0, 2)
+            self.file.write(data)
+            self.size += len(data)
+            self.condition.notify_all()
+
+    def tell(self) -> int:
+        return self.size
+
+    def finish(self, error: Optional[BaseException] = None) -> None:
+        """Mark the end of the download, or its failure with `error`, which is
+        then raised to readers."""
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def abort(self) -> None:
+        """Make further writes fail, to interrupt the download"""
+        self.finish(error=IOError("Packfile download aborted"))
+
+    def wait_started(self) -> None:
+        """Wait for the first bytes of the packfile, or for the end of the
+        download if there are none."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.size > 0 or self.done)
+
+    def __getitem__(self, key: Union[int, slice]) -> Any:
+        if isinstance(key, slice):
+            start, stop = key.start, key.stop
+        else:
+            start, stop = key, key + 1
+
+        with self.condition:
+            self.condition.wait_for(lambda: self.size > start or self.done)
+            if self.error is not None:
+                raise self.error
+            self.file.seek(start)
+            data = self.file.read(min(stop, self.size) - start)
+
+        if isinstance(key, slice):
+            return data
+        if not data:
+            raise IndexError(key)
+        return data[0]
+
+
+class DeltaBaseCache:
+    """Cache of the type and data of delta bases, evicting the least recently
+    used ones once they hold more than `max_size` bytes.
+
+    It is used by all the inflaters of this module, :class:`SwhPackInflater`
+    included. It counts its :attr:`hits` and :attr:`misses`, to tell whether
+    it is large enough for the delta chains of the packfiles being loaded.
+    """
+
+    def __init__(self, max_size: int):
+        self.cache: LRUSizeCache[Union[int, bytes], Tuple[int, bytes]] = LRUSizeCache(
+            max_size, compute_size=lambda obj: len(obj[1])
+        )
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Union[int, bytes]) -> Optional[Tuple[int, bytes]]:
+        """Get the type and data of the object with `key` (an offset in the pack,
+        or the binary sha1 of an external object), if cached"""
+        obj = self.cache.get(key)
+        if obj is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return obj
+
+    def add(self, key: Union[int, bytes], obj: Tuple[int, bytes]) -> bool:
+        """Cache the type and data of the object with `key`, returning whether it
+        was kept: objects too large for the cache are not"""
+        self.cache.add(key, obj)
+        return key in self.cache
+
+
+def hash_entry_data(contents: Any, pos: int, size: int) -> Tuple[Dict[str, Any], int]:
+    """Hash the data of a blob pack entry while decompressing its zlib stream
+    from `pos` in `contents`, as :func:`inflate_entry_data` does.
+
+    Returns:
+        the hashes of the blob, as computed by :class:`MultiHash`, and its
+        length, and the offset of the end of the zlib stream
+    """
+    hasher = MultiHash(hash_names=DEFAULT_ALGORITHMS, length=size)
+    end = inflate_entry_data(contents, pos, size, hasher.update)
+    hashes = hasher.digest()
+    hashes["length"] = size
+    return hashes, end
+
+
+class SwhPackInflater:
+    """Inflate the objects of a packfile whose bytes are given by `contents`, for
+    instance as a :class:`FileContents`.
+
+    Its `entries` are read from `contents` unless already indexed, by a
+    :class:`PackIndexer` for instance. Like dulwich's ``PackInflater``, each whole
+    object of the pack is inflated in turn, followed by the delta objects based on
+    it, depth-first. Delta bases are kept in a :class:`DeltaBaseCache` of up to
+    ``base_cache_size`` bytes while objects based on them remain to be inflated;
+    evicted bases are read back from the pack, and bases too large for the cache
+    are kept aside instead.
+
+    Once all the delta chains based on objects of the pack are resolved, the
+    bases of the remaining ``REF_DELTA`` objects are external references. They
+    are all passed to ``prefetch_ext_refs`` in a single call, before resolving
+    any of them with ``resolve_ext_ref``.
+
+    Blobs larger than ``max_blob_size`` which are not delta bases are not
+    inflated in memory: their data is hashed while being decompressed, and they
+    are yielded as :class:`SkippedBlob` objects. Large blobs which are delta
+    bases are inflated once, and yielded as :class:`SkippedBlob` objects too.
+    Bases of ``REF_DELTA`` objects are told by their sha1, found in `offsets`
+    (the offsets of the whole objects of the pack, as indexed by a
+    :class:`PackIndexer`) along with `entries`, or computed while reading the
+    entries otherwise.
+    """
+
+    def __init__(
+        self,
+        contents: Any,
+        entries: Optional[Iterable[UnpackedObject]] = None,
+        offsets: Optional[Mapping[RawObjectID, int]] = None,
+        resolve_ext_ref: Optional[ResolveExtRefFn] = None,
+        prefetch_ext_refs: Optional[Callable[[List[bytes]], None]] = None,
+        max_blob_size: Optional[int] = None,
+        base_cache_size: int = 64 * 1024 * 1024,
+    ):
+        self.contents = contents
+        self.entries = entries
+        self.resolve_ext_ref = resolve_ext_ref
+        self.prefetch_ext_refs = prefetch_ext_refs
+        self.max_blob_size = max_blob_size
+        # type and data of the delta bases, by offset, and of external bases, by
+        # sha1
+        self.cache = DeltaBaseCache(base_cache_size)
+        # offsets of the delta objects waiting for their base, by base offset
+        # or sha1
+        self.pending_ofs: Dict[int, List[int]] = defaultdict(list)
+        self.pending_ref: Dict[bytes, List[int]] = defaultdict(list)
+        # offsets of the objects inflated so far, by sha1, and external bases of
+        # REF_DELTA objects
+        self.offsets: Dict[bytes, int] = {}
+        self.ext_bases: Set[bytes] = set()
+        # offsets of whole objects by sha1, known before inflating them, and
+        # hashes of the large blobs computed while reading their entry, by offset
+        self.known_offsets: Mapping[RawObjectID, int] = offsets or {}
+        self.skipped_blobs: Dict[int, Dict[str, Any]] = {}
+
+    def __iter__(self) -> Iterator[PackObject]:
+        whole: List[UnpackedObject] = []
+        entries = self.entries if self.entries is not None else self._read_entries()
+        for entry in entries:
+            assert entry.offset is not None
+            if entry.pack_type_num == OFS_DELTA:
+                assert isinstance(entry.delta_base, int)
+                self.pending_ofs[entry.offset - entry.delta_base].append(entry.offset)
+            elif entry.pack_type_num == REF_DELTA:
+                assert isinstance(entry.delta_base, bytes)
+                self.pending_ref[entry.delta_base].append(entry.offset)
+            else:
+                whole.append(entry)
+
+        # Whole objects known to be bases of REF_DELTA objects
+        ref_bases = {
+            self.known_offsets[RawObjectID(sha)]
+            for sha in self.pending_ref
+            if RawObjectID(sha) in self.known_offsets
+        }
+        for entry in whole:
+            yield from self._inflate_whole(entry, ref_bases)
+
+        yield from self._walk_ref_chains()
+
+    def _read_entries(self) -> Iterator[UnpackedObject]:
+        """Read the headers of the entries of the pack, without keeping their
+        decompressed data, but hashing the large blobs"""
+        known_offsets: Dict[RawObjectID, int] = {}
+        self.known_offsets = known_offsets
+        offset = _PACK_HEADER.size
+        for _ in range(read_pack_header(self.contents)):
+            unpacked, pos = read_entry_header(self.contents, offset)
+            assert unpacked.decomp_len is not None
+            if unpacked.pack_type_num == Blob.type_num and self._is_large(
+                unpacked.decomp_len
+            ):
+                hashes, end = hash_entry_data(self.contents, pos, unpacked.decomp_len)
+                self.skipped_blobs[offset] = hashes
+                known_offsets[RawObjectID(hashes["sha1_git"])] = offset
+            else:
+                end = inflate_entry_data(
+                    self.contents, pos, unpacked.decomp_len, lambda chunk: None
+                )
+            yield unpacked
+            offset = end
+
+    def _is_large(self, size: int) -> bool:
+        return self.max_blob_size is not None and size >= self.max_blob_size
+
+    def _inflate_whole(
+        self, entry: UnpackedObject, ref_bases: Set[int]
+    ) -> Iterator[PackObject]:
+        """Inflate the whole object of `entry`, then the delta objects based on it"""
+        assert entry.offset is not None and entry.decomp_len is not None
+        offset, type_num = entry.offset, entry.pack_type_num
+        large = type_num == Blob.type_num and self._is_large(entry.decomp_len)
+        data: Optional[bytes] = None
+        obj: PackObject
+        if large and offset not in self.pending_ofs and offset not in ref_bases:
+            hashes = self.skipped_blobs.pop(offset, None) or self._hash_large_blob(
+                offset
+            )
+            obj = SkippedBlob(hashes)
+        else:
+            _, pos = read_entry_header(self.contents, offset)
+            chunks: List[bytes] = []
+            inflate_entry_data(self.contents, pos, entry.decomp_len, chunks.append)
+            data = b"".join(chunks)
+            if large:
+                hashes = MultiHash.from_data(data).digest()
+                hashes["length"] = len(data)
+                obj = SkippedBlob(hashes)
+            else:
+                obj = ShaFile.from_raw_string(type_num, data)
+
+        sha = _object_sha(obj)
+        self.offsets[sha] = offset
+        yield obj
+
+        children = self.pending_ofs.pop(offset, []) + self.pending_ref.pop(sha, [])
+        if children:
+            # Unless its data was not kept, for a large blob whose sha1 was not
+            # known in advance, which is then read back from the pack
+            base = None if data is None else (type_num, data)
+            yield from self._inflate_deltas(offset, children, base)
+
+    def _hash_large_blob(self, offset: int) -> Dict[str, Any]:
+        unpacked, pos = read_entry_header(self.contents, offset)
+        assert unpacked.decomp_len is not None
+        return hash_entry_data(self.contents, pos, unpacked.decomp_len)[0]
+
+    def _inflate_deltas(
+        self,
+        base: Union[int, bytes],
+        children: List[int],
+        base_obj: Optional[Tuple[int, bytes]] = None,
+    ) -> Iterator[PackObject]:
+        """Inflate the delta objects at the `children` offsets, based on the object
+        at offset `base` in the pack, or on the external object of sha1 `base`,
+        then the delta objects based on them, depth-first.
+
+        The type and data of the base is `base_obj` if given, otherwise it is
+        looked up in the cache, read back from the pack or resolved again."""
+        todo: List[Tuple[int, Union[int, bytes], Optional[Tuple[int, bytes]]]] = []
+        if base_obj is not None and not self.cache.add(base, base_obj):
+            todo.extend((child, base, base_obj) for child in children)
+        else:
+            todo.extend((child, base, None) for child in children)
+
+        while todo:
+            offset, base, base_obj = todo.pop()
+            if base_obj is None:
+                if isinstance(base, int):
+                    base_obj = self._object_at(base)
+                else:
+                    base_obj = self._ext_base(base)
+
+            unpacked, pos = read_entry_header(self.contents, offset)
+            assert unpacked.decomp_len is not None
+            delta: List[bytes] = []
+            inflate_entry_data(self.contents, pos, unpacked.decomp_len, delta.append)
+            type_num = base_obj[0]
+            data = b"".join(apply_delta(base_obj[1], delta))
+            obj = ShaFile.from_raw_string(type_num, data)
+            sha = _object_sha(obj)
+            self.offsets[sha] = offset
+            yield obj
+
+            grandchildren = self.pending_ofs.pop(offset, [])
+            grandchildren += self.pending_ref.pop(sha, [])
+            if grandchildren:
+                # Bases too large for the cache are kept with their delta objects
+                kept = self.cache.add(offset, (type_num, data))
+                todo.extend(
+                    (child, offset, None if kept else (type_num, data))
+                    for child in grandchildren
+                )
+
+    def _object_at(self, offset: int) -> Tuple[int, bytes]:
+        """Get the type and data of the (already resolved) object at `offset`,
+        reading the chain of its delta bases back from the pack if needed."""
+        chain = []
+        while True:
+            cached = self.cache.get(offset)
+            if cached is not None:
+                base = cached
+                break
+            unpacked, pos = read_entry_header(self.contents, offset)
+            assert unpacked.decomp_len is not None
+            data: List[bytes] = []
+            inflate_entry_data(self.contents, pos, unpacked.decomp_len, data.append)
+            if unpacked.pack_type_num == OFS_DELTA:
+                chain.append((offset, data))
+                assert isinstance(unpacked.delta_base, int)
+                offset -= unpacked.delta_base
+            elif unpacked.pack_type_num == REF_DELTA:
+                chain.append((offset, data))
+                assert isinstance(unpacked.delta_base, bytes)
+                if unpacked.delta_base in self.ext_bases:
+                    base = self._ext_base(unpacked.delta_base)
+                    break
+                offset = self.offsets[unpacked.delta_base]
+            else:
+                base = (unpacked.pack_type_num, b"".join(data))
+                if not self._is_large(len(base[1])):
+                    self.cache.add(offset, base)
+                break
+
+        for delta_offset, delta in reversed(chain):
+            base = (base[0], b"".join(apply_delta(base[1], delta)))
+            self.cache.add(delta_offset, base)
+        return base
+
+    def _ext_base(self, sha: bytes) -> Tuple[int, bytes]:
+        """Get the type and data of an external base, resolving it again if it
+        is not cached anymore"""
+        cached = self.cache.get(sha)
+        if cached is not None:
+            return cached
+        assert self.resolve_ext_ref is not None
+        type_num, chunks = self.resolve_ext_ref(RawObjectID(sha))
+        base = (type_num, b"".join(chunks))
+        self.cache.add(sha, base)
+        return base
+
+    def _walk_ref_chains(self) -> Iterator[PackObject]:
+        """Resolve the delta objects still waiting for their base once all the
+        objects of the pack are inflated, which are based on external objects."""
+        if self.pending_ref and self.resolve_ext_ref:
+            if self.prefetch_ext_refs:
+                self.prefetch_ext_refs(sorted(self.pending_ref))
+            for base_sha in sorted(self.pending_ref):
+                if base_sha not in self.pending_ref:
+                    continue
+                try:
+                    self._ext_base(base_sha)
+                except KeyError:
+                    continue
+                self.ext_bases.add(base_sha)
+                yield from self._inflate_deltas(
+                    base_sha, self.pending_ref.pop(base_sha)
+                )
+
+        if self.pending_ref:
+            raise UnresolvedDeltas(
+                [sha_to_hex(RawObjectID(sha)) for sha in self.pending_ref]
+            )
+
+
+class StreamingPackInflater(SwhPackInflater):
+    """Inflate the objects of a :class:`PackStream` as it is being downloaded.
+
+    Whole objects are yielded as soon as their data is available, and delta
+    objects as soon as their base is. The bases of ``OFS_DELTA`` objects always
+    precede them in the pack, so they are read back from the pack when needed,
+    unless they are in a :class:`DeltaBaseCache` of the most recently inflated
+    objects holding up to ``base_cache_size`` bytes. The bases of ``REF_DELTA``
+    objects are found the same way when they were inflated before them, by the
+    offsets of all inflated objects; otherwise these objects wait for their base
+    to be inflated, or for the end of the download to be resolved as external
+    references, like :class:`SwhPackInflater` does. External bases are cached
+    along with the other objects, and resolved again once evicted.
+
+    Blobs larger than ``max_blob_size`` are only hashed while being decompressed,
+    and are yielded as :class:`SkippedBlob` objects.
+    """
+
+    def __init__(
+        self,
+        stream: PackStream,
+        resolve_ext_ref: Optional[ResolveExtRefFn] = None,
+        prefetch_ext_refs: Optional[Callable[[List[bytes]], None]] = None,
+        max_blob_size: Optional[int] = None,
+        base_cache_size: int = 64 * 1024 * 1024,
+    ):
+        super().__init__(
+            stream,
+            resolve_ext_ref=resolve_ext_ref,
+            prefetch_ext_refs=prefetch_ext_refs,
+            max_blob_size=max_blob_size,
+            base_cache_size=base_cache_size,
+        )
+        self.stream = stream
+        # offsets of the delta objects waiting for a base which is itself waiting
+        self.deferred: Set[int] = set()
+
+    def __iter__(self) -> Iterator[PackObject]:
+        contents = self.stream
+        count = read_pack_header(contents)
+        offset = _PACK_HEADER.size
+        for _ in range(count):
+            unpacked, pos = read_entry_header(contents, offset)
+            assert unpacked.decomp_len is not None
+            type_num = unpacked.pack_type_num
+            obj: Optional[PackObject] = None
+
+            if type_num == Blob.type_num and self._is_large(unpacked.decomp_len):
+                hashes, end = hash_entry_data(contents, pos, unpacked.decomp_len)
+                obj = SkippedBlob(hashes)
+            elif type_num not in (OFS_DELTA, REF_DELTA):
+                chunks: List[bytes] = []
+                end = inflate_entry_data(
+                    contents, pos, unpacked.decomp_len, chunks.append
+                )
+                obj = self._make_object(offset, type_num, b"".join(chunks))
+            else:
+                delta: List[bytes] = []
+                end = inflate_entry_data(
+                    contents, pos, unpacked.decomp_len, delta.append
+                )
+                base = self._base(offset, unpacked.delta_base)
+                if base is not None:
+                    base_type, base_data = base
+                    data = b"".join(apply_delta(base_data, delta))
+                    obj = self._make_object(offset, base_type, data)
+
+            if obj is not None:
+                sha = _object_sha(obj)
+                self.offsets[sha] = offset
+                yield obj
+                if self.pending_ofs or self.pending_ref:
+                    yield from self._follow(offset, sha)
+            offset = end
+
+        yield from self._walk_ref_chains()
+
+    def _make_object(self, offset: int, type_num: int, data: bytes) -> ShaFile:
+        self.cache.add(offset, (type_num, data))
+        return ShaFile.from_raw_string(type_num, data)
+
+    def _base(
+        self, offset: int, delta_base: Union[int, bytes, None]
+    ) -> Optional[Tuple[int, bytes]]:
+        """Get the base of the delta object at `offset`, or record it as pending
+        if its base was not inflated yet."""
+        if isinstance(delta_base, int):
+            base_offset = offset - delta_base
+            if base_offset in self.deferred:
+                self.pending_ofs[base_offset].append(offset)
+                self.deferred.add(offset)
+                return None
+            return self._object_at(base_offset)
+
+        assert isinstance(delta_base, bytes)
+        if delta_base in self.offsets:
+            return self._object_at(self.offsets[delta_base])
+        if delta_base in self.ext_bases:
+            return self._ext_base(delta_base)
+        self.pending_ref[delta_base].append(offset)
+        self.deferred.add(offset)
+        return None
+
+    def _follow(self, offset: int, sha: bytes) -> Iterator[PackObject]:
+        """Resolve the delta objects waiting for the object at `offset`, whose
+        sha1 is `sha`, and recursively those waiting for them."""
+        todo = [(offset, sha)]
+        while todo:
+            base_offset, base_sha = todo.pop()
+            children = self.pending_ofs.pop(base_offset, [])
+            children += self.pending_ref.pop(base_sha, [])
+            for child in children:
+                self.deferred.discard(child)
+                type_num, data = self._object_at(child)
+                obj = ShaFile.from_raw_string(type_num, data)
+                child_sha = _object_sha(obj)
+                self.offsets[child_sha] = child
+                yield obj
+                todo.append((child, child_sha))
+
+
+def _object_sha(obj: PackObject) -> bytes:
+    if isinstance(obj, SkippedBlob):
+        return obj.hashes["sha1_git"]
+    return obj.sha().digest()
+
+
+# Pack type number, delta base and decompressed length of a pack entry, by offset
+EntryInfo = Tuple[int, int, Union[int, bytes, None], int]
+
+
+def delta_families(
+    entries: Iterable[UnpackedObject], offsets: Mapping[RawObjectID, int]
+) -> Tuple[Dict[int, List[UnpackedObject]], List[UnpackedObject]]:
+    """Partition the `entries` of a packfile into families of delta chains, which
+    can be inflated independently from each other.
+
+    Each family is made of a whole object and of the delta objects based on it,
+    directly or not. Bases of ``REF_DELTA`` objects are found by their sha1 in
+    `offsets`, which only maps the ids of whole objects of the pack (as indexed
+    by :class:`PackIndexer`) to their offset. Delta objects whose chain could not
+    be followed to a whole object of the pack are returned separately.
+
+    Returns:
+        the families, by offset of their whole object, and the other entries
+    """
+    roots: Dict[int, int] = {}
+    families: Dict[int, List[UnpackedObject]] = defaultdict(list)
+    others: List[UnpackedObject] = []
+    for entry in entries:
+        assert entry.offset is not None
+        root: Optional[int]
+        if entry.pack_type_num == OFS_DELTA:
+            assert isinstance(entry.delta_base, int)
+            # Bases of OFS_DELTA objects precede them in the pack
+            root = roots.get(entry.offset - entry.delta_base)
+        elif entry.pack_type_num == REF_DELTA:
+            assert isinstance(entry.delta_base, bytes)
+            root = offsets.get(RawObjectID(entry.delta_base))
+        else:
+            root = entry.offset
+        if root is None:
+            others.append(entry)
+        else:
+            roots[entry.offset] = root
+            families[root].append(entry)
+    return families, others
+
+
+def _entry_info(entry: UnpackedObject) -> EntryInfo:
+    assert entry.offset is not None and entry.decomp_len is not None
+    return (entry.offset, entry.pack_type_num, entry.delta_base, entry.decomp_len)
+
+
+def inflate_entries(
+    path: str,
+    entries: List[EntryInfo],
+    offsets: Dict[RawObjectID, int],
+    max_blob_size: Optional[int],
+    base_cache_size: int,
+) -> Tuple[List[Union[Tuple[int, bytes], SkippedBlob]], Dict[bytes, int]]:
+    """Inflate some delta chain families of the packfile at `path`, in a worker
+    process of :class:`ParallelPackInflater`. `offsets` are those of the bases of
+    their ``REF_DELTA`` objects.
+
+    Returns:
+        the type and raw data of the inflated objects, and the large blobs, and
+        the offsets of the delta objects by binary sha1
+    """
+    with path_contents(path) as contents:
+        inflater = SwhPackInflater(
+            contents,
+            entries=[
+                UnpackedObject(
+                    type_num, delta_base=delta_base, decomp_len=size, offset=offset
+                )
+                for offset, type_num, delta_base, size in entries
+            ],
+            offsets=offsets,
+            max_blob_size=max_blob_size,
+            base_cache_size=base_cache_size,
+        )
+        objects = [
+            (
+                obj
+                if isinstance(obj, SkippedBlob)
+                else (obj.type_num, obj.as_raw_string())
+            )
+            for obj in inflater
+        ]
+    deltas = {
+        offset
+        for offset, type_num, _, _ in entries
+        if type_num in (OFS_DELTA, REF_DELTA)
+    }
+    return objects, {
+        sha: offset for sha, offset in inflater.offsets.items() if offset in deltas
+    }
+
+
+class ParallelPackInflater:
+    """Inflate the objects of a packfile stored at `path` in a pool of
+    `processes` worker processes.
+
+    The pack entries are split by :func:`delta_families`; families are inflated
+    by the workers, in batches of about ``batch_size`` decompressed bytes, and
+    their objects are yielded in the order in which batches were submitted. At
+    most two batches per worker are pending at any time, so that objects are
+    not inflated much faster than they are consumed.
+
+    Delta objects left out of the families are then inflated by a
+    :class:`SwhPackInflater` in the current process. Their bases inflated by the
+    workers are kept until then, and their external bases are resolved by
+    `resolve_ext_ref` as usual.
+
+    The offsets of the inflated delta objects are kept in :attr:`delta_offsets`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        entries: Iterable[UnpackedObject],
+        offsets: Mapping[RawObjectID, int],
+        processes: int,
+        resolve_ext_ref: Optional[ResolveExtRefFn] = None,
+        prefetch_ext_refs: Optional[Callable[[List[bytes]], None]] = None,
+        max_blob_size: Optional[int] = None,
+        batch_size: int = 16 * 1024 * 1024,
+        base_cache_size: int = 64 * 1024 * 1024,
+    ):
+        self.path = path
+        self.offsets = offsets
+        self.families, self.others = delta_families(entries, offsets)
+        self.processes = processes
+        self.resolve_ext_ref = resolve_ext_ref
+        self.prefetch_ext_refs = prefetch_ext_refs
+        self.max_blob_size = max_blob_size
+        self.batch_size = batch_size
+        self.base_cache_size = base_cache_size
+        self.delta_offsets: Dict[bytes, int] = {}
+        # Bases of the remaining REF_DELTA objects, as inflated by the workers
+        self.bases: Dict[bytes, Optional[Tuple[int, bytes]]] = {
+            entry.delta_base: None
+            for entry in self.others
+            if isinstance(entry.delta_base, bytes)
+        }
+
+    def _batches(self) -> Iterator[List[EntryInfo]]:
+        batch: List[EntryInfo] = []
+        size = 0
+        for root in sorted(self.families):
+            for entry in self.families[root]:
+                batch.append(_entry_info(entry))
+                size += entry.decomp_len or 0
+            if size >= self.batch_size:
+                yield batch
+                batch, size = [], 0
+        if batch:
+            yield batch
+
+    def _submit(self, executor: ProcessPoolExecutor, batch: List[EntryInfo]) -> Future:
+        offsets = {
+            RawObjectID(delta_base): self.offsets[RawObjectID(delta_base)]
+            for _, type_num, delta_base, _ in batch
+            if type_num == REF_DELTA and isinstance(delta_base, bytes)
+        }
+        return executor.submit(
+            inflate_entries,
+            self.path,
+            batch,
+            offsets,
+            self.max_blob_size,
+            self.base_cache_size,
+        )
+
+    def __iter__(self) -> Iterator[PackObject]:
+        executor = ProcessPoolExecutor(
+            max_workers=self.processes, mp_context=multiprocessing.get_context("spawn")
+        )
+        try:
+            batches = self._batches()
+            pending: Deque[Future] = deque(
+                self._submit(executor, batch)
+                for batch in itertools.islice(batches, 2 * self.processes)
+            )
+            while pending:
+                results, delta_offsets = pending.popleft().result()
+                self.delta_offsets.update(delta_offsets)
+                for batch in itertools.islice(batches, 1):
+                    pending.append(self._submit(executor, batch))
+                for result in results:
+                    if isinstance(result, SkippedBlob):
+                        yield result
+                        continue
+                    obj = ShaFile.from_raw_string(*result)
+                    if self.bases:
+                        sha = obj.sha().digest()
+                        if sha in self.bases:
+                            self.bases[sha] = result
+                    yield obj
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        if self.others:
+            with path_contents(self.path) as contents:
+                inflater = SwhPackInflater(
+                    contents,
+                    entries=self.others,
+                    resolve_ext_ref=self._resolve_base,
+                    prefetch_ext_refs=self._prefetch_bases,
+                    max_blob_size=self.max_blob_size,
+                    base_cache_size=self.base_cache_size,
+                )
+                yield from inflater
+            self.delta_offsets.update(inflater.offsets)
+
+    def _resolve_base(self, sha: bytes) -> Tuple[int, List[bytes]]:
+        base = self.bases.get(sha)
+        if base is not None:
+            return base[0], [base[1]]
+        if self.resolve_ext_ref is None:
+            raise KeyError(sha)
+        return self.resolve_ext_ref(RawObjectID(sha))
+
+    def _prefetch_bases(self, sha1s: List[bytes]) -> None:
+        if self.prefetch_ext_refs is not None:
+            self.prefetch_ext_refs(
+                [sha1 for sha1 in sha1s if self.bases.get(sha1) is None]
+            )
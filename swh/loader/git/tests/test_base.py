@@ -0,0 +1,129 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+from collections import Counter
+
+import pytest
+
+from swh.loader.git.base import StorageBatch, StorageWriterPool
+from swh.model.model import Content
+
+
+def test_storage_batch_max_count():
+    calls = []
+
+    def add(objects):
+        calls.append(list(objects))
+        return {"directory:add": len(objects)}
+
+    batch = StorageBatch(add, max_count=2)
+    assert batch.add(1) == {}
+    assert batch.add(2) == {"directory:add": 2}
+    assert batch.add(3) == {}
+    assert batch.flush() == {"directory:add": 1}
+    assert batch.flush() == {}
+
+    assert calls == [[1, 2], [3]]
+
+
+def test_storage_batch_max_bytes():
+    calls = []
+
+    def add(objects):
+        calls.append(list(objects))
+        return {"content:add": len(objects)}
+
+    contents = [Content.from_data(b"x" * size) for size in (10, 20, 5, 1)]
+
+    batch = StorageBatch(add, max_count=100, max_bytes=25)
+    summaries = [batch.add(content) for content in contents]
+    assert summaries == [{}, {"content:add": 2}, {}, {}]
+    batch.flush()
+
+    assert calls == [contents[:2], contents[2:]]
+
+
+def test_storage_batch_adapts_to_latency(mocker):
+    monotonic = mocker.patch("swh.loader.git.base.time.monotonic")
+
+    durations = []
+
+    def add(objects):
+        # each call to monotonic() returns the current "time"; make the storage
+        # call last for the next duration
+        monotonic.return_value += durations.pop(0)
+        return {}
+
+    monotonic.return_value = 0.0
+    batch = StorageBatch(add, max_count=8, target_latency=1.0)
+
+    # slow storage: batches get smaller
+    durations.extend([3.0, 3.0])
+    for i in range(8):
+        batch.add(i)
+    assert batch.batch_count == 4
+    for i in range(4):
+        batch.add(i)
+    assert batch.batch_count == 2
+
+    # fast storage: batches grow back up to max_count
+    durations.extend([0.1, 0.1, 0.1])
+    for i in range(2 + 4 + 8):
+        batch.add(i)
+    assert batch.batch_count == 8
+
+
+def test_storage_batch_adapts_from_writer_threads():
+    pool = StorageWriterPool(threads=4, queue_size=4)
+
+    def add(objects):
+        return {"content:add": len(objects)}
+
+    # every call is slower than the target latency: batches shrink, concurrently
+    batch = StorageBatch(add, max_count=64, target_latency=0.0, writers=pool)
+    summary: Counter = Counter()
+    for i in range(1000):
+        summary.update(batch.add(i))
+    summary.update(batch.flush())
+    summary.update(pool.join())
+    assert summary == {"content:add": 1000}
+    pool.close()
+
+    assert 1 <= batch.batch_count < 64
+
+
+def test_storage_writer_pool():
+    pool = StorageWriterPool(threads=2, queue_size=1)
+    written = []
+
+    def add(objects):
+        written.extend(objects)
+        return {"revision:add": len(objects)}
+
+    batch = StorageBatch(add, max_count=3, writers=pool)
+    summary: Counter = Counter()
+    for i in range(10):
+        summary.update(batch.add(i))
+    summary.update(batch.flush())
+    summary.update(pool.join())
+
+    # summaries of completed writes are handed back by flush or join
+    assert summary == {"revision:add": 10}
+    assert sorted(written) == list(range(10))
+    pool.close()
+
+
+def test_storage_writer_pool_error():
+    pool = StorageWriterPool(threads=1, queue_size=1)
+
+    def add(objects):
+        raise ValueError("storage is down")
+
+    pool.submit(add, [1])
+    with pytest.raises(ValueError, match="storage is down"):
+        pool.join()
+    with pytest.raises(ValueError, match="storage is down"):
+        pool.submit(add, [2])
+    pool.close()
@@ -10,7 +10,7 @@ import shutil
 import subprocess
 import tempfile
 
-from dulwich.objects import Commit, Tag, Tree
+from dulwich.objects import Blob, Commit, Tag, Tree
 import dulwich.repo
 import pytest
 
@@ -130,6 +130,48 @@ class TestConverters:
         )
         assert content == expected_content
 
+    def test_blob_to_content_sha1_git_verified(self):
+        """The id of verified blobs is used as sha1_git without hashing them again"""
+        content_id = b"28c6f4023d65f74e3b59a2dea3c4277ed9ee07b0"
+        blob = self.repo[content_id]
+        content = converters.dulwich_blob_to_content(blob)
+
+        # blob made of several chunks
+        verified_blob = Blob.from_raw_chunks(
+            Blob.type_num, [blob.data[:10], blob.data[10:]], sha=content_id
+        )
+        assert (
+            converters.dulwich_blob_to_content(verified_blob, sha1_git_verified=True)
+            == content
+        )
+        assert converters.dulwich_blob_to_content_id(
+            verified_blob, sha1_git_verified=True
+        ) == converters.dulwich_blob_to_content_id(blob)
+
+        # the id is trusted
+        wrong_blob = Blob.from_raw_string(Blob.type_num, blob.data, sha=b"12" * 20)
+        content_id_dict = converters.dulwich_blob_to_content_id(
+            wrong_blob, sha1_git_verified=True
+        )
+        assert content_id_dict["sha1_git"] == hash_to_bytes("12" * 20)
+        assert content_id_dict["sha1"] == content.sha1
+
+    def test_raw_object_to_model(self):
+        commit = self.repo[self.repo.head()]
+        for obj, convert in [
+            (commit, converters.dulwich_commit_to_revision),
+            (self.repo[commit.tree], converters.dulwich_tree_to_directory),
+        ]:
+            assert converters.raw_object_to_model(
+                (obj.type_num, obj.as_raw_string(), obj.id)
+            ) == convert(obj)
+
+        blob = self.repo[b"28c6f4023d65f74e3b59a2dea3c4277ed9ee07b0"]
+        with pytest.raises(ValueError):
+            converters.raw_object_to_model(
+                (blob.type_num, blob.as_raw_string(), blob.id)
+            )
+
     def test_corrupt_blob(self, mocker):
         # has a signature
         sha1 = hash_to_bytes("28c6f4023d65f74e3b59a2dea3c4277ed9ee07b0")
@@ -216,6 +258,35 @@ class TestConverters:
             raw_manifest=b"tree 62\x00" + raw_string,
         )
 
+    def test_parse_tree_entries(self):
+        commit = self.repo[self.repo.head()]
+        tree = self.repo[commit.tree]
+        assert sorted(converters.parse_tree_entries(tree.as_raw_string())) == sorted(
+            (entry.path, entry.mode, bytes.fromhex(entry.sha.decode()))
+            for entry in tree.iteritems()
+        )
+
+        raw_string = b"100644 file\x00" + b"\x01" * 20 + b"40000 dir\x00" + b"\x02"
+        assert list(converters.parse_tree_entries(raw_string[:32])) == [
+            (b"file", 0o100644, b"\x01" * 20)
+        ]
+        with pytest.raises(ValueError):
+            list(converters.parse_tree_entries(raw_string))
+
+    def test_tree_duplicated_entries(self):
+        """The last of entries with the same name is kept, as by dulwich"""
+        raw_string = (
+            b"100644 file\x00" + b"\x01" * 20 + b"100644 file\x00" + b"\x02" * 20
+        )
+        tree = Tree.from_raw_string(Tree.type_name, raw_string)
+        dir_ = converters.dulwich_tree_to_directory(tree)
+        assert dir_.entries == (
+            DirectoryEntry(
+                name=b"file", type="file", target=b"\x02" * 20, perms=0o100644
+            ),
+        )
+        assert dir_.raw_manifest == b"tree 64\x00" + raw_string
+
     def test_tree_perms(self):
         entries = [
             (b"blob_100644", 0o100644, "file"),
@@ -442,6 +513,36 @@ class TestConverters:
             with pytest.raises(converters.HashMismatch):
                 converters.dulwich_commit_to_revision(commit)
 
+    def test_parse_headers(self):
+        raw_string = (
+            b"tree 641fb6e08ddb2e4fd096dcf18e80b894bf7e25ce\n"
+            b"author Foo <foo@example.org> 1641980946 +0100\n"
+            b"gpgsig -----BEGIN PGP SIGNATURE-----\n"
+            b" \n"
+            b" abcd\n"
+            b" -----END PGP SIGNATURE-----\n"
+            b"\n"
+            b"message\n"
+            b"\n"
+            b"body\n"
+        )
+        headers, message = converters.parse_headers(raw_string)
+        assert headers == [
+            (b"tree", b"641fb6e08ddb2e4fd096dcf18e80b894bf7e25ce"),
+            (b"author", b"Foo <foo@example.org> 1641980946 +0100"),
+            (
+                b"gpgsig",
+                b"-----BEGIN PGP SIGNATURE-----\n\nabcd\n-----END PGP SIGNATURE-----",
+            ),
+        ]
+        assert message == b"message\n\nbody\n"
+
+        # no empty line after the headers
+        assert converters.parse_headers(raw_string[:46]) == (headers[:1], None)
+        assert converters.parse_headers(raw_string[:45]) == (headers[:1], None)
+        with pytest.raises(ValueError):
+            converters.parse_headers(b"tree\n\nmessage")
+
     def test_commit_to_revision_with_extra_headers_mergetag(self):
         sha1 = b"3ab3da4bf0f81407be16969df09cd1c8af9ac703"
 
@@ -670,6 +771,41 @@ class TestConverters:
             parsed_author = tests[author]
             assert parsed_author == converters.parse_author(author)
 
+    def test_parse_authorship(self):
+        def date(seconds, offset_bytes):
+            return TimestampWithTimezone(
+                timestamp=Timestamp(seconds=seconds, microseconds=0),
+                offset_bytes=offset_bytes,
+            )
+
+        foo = Person.from_fullname(b"Foo <foo@example.org>")
+        assert converters.parse_authorship(None) == (None, None)
+        assert converters.parse_authorship(b"Foo <foo@example.org>") == (foo, None)
+        assert converters.parse_authorship(
+            b"Foo <foo@example.org> 1641980946 +0100"
+        ) == (foo, date(1641980946, b"+0100"))
+        # Timezones are kept as written
+        assert converters.parse_authorship(
+            b"Foo <foo@example.org> 1641980946 -0000"
+        ) == (foo, date(1641980946, b"-0000"))
+        assert converters.parse_authorship(b"Foo <foo@example.org> 1641980946 +1") == (
+            foo,
+            date(1641980946, b"+1"),
+        )
+        assert converters.parse_authorship(
+            b"Foo <foo@example.org> 99999999999999999 +0100"
+        ) == (foo, date(0, b"+0100"))
+        # No date without the closing '>' of the email
+        assert converters.parse_authorship(b"abcde 1641980946 +0100") == (
+            Person.from_fullname(b"abcde 1641980946 +0100"),
+            None,
+        )
+
+        with pytest.raises(ValueError):
+            converters.parse_authorship(b"Foo <foo@example.org> 1641980946")
+        with pytest.raises(ValueError):
+            converters.parse_authorship(b"Foo <foo@example.org> yesterday +0100")
+
     def test_dulwich_tag_to_release_no_author_no_date(self):
         sha = hash_to_bytes("f6e367357b446bd1315276de5e88ba3d0d99e136")
         target = b"641fb6e08ddb2e4fd096dcf18e80b894bf7e25ce"
@@ -3,6 +3,7 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+from concurrent.futures import ProcessPoolExecutor
 import datetime
 from functools import partial
 from http.server import HTTPServer, SimpleHTTPRequestHandler
@@ -11,37 +12,58 @@ import logging
 import os
 import subprocess
 from tempfile import SpooledTemporaryFile
+import threading
 from threading import Thread
 import time
+from typing import Dict, List
 from unittest.mock import MagicMock, call
 
 import attr
+import dulwich.client
 from dulwich.errors import GitProtocolError, NotGitRepository, ObjectFormatException
-from dulwich.pack import REF_DELTA
+from dulwich.object_format import SHA1
+from dulwich.objects import Blob, Commit, Tree, sha_to_hex
+from dulwich.pack import REF_DELTA, PackData, PackInflater
 from dulwich.porcelain import get_user_timezones, push
 import dulwich.repo
-from dulwich.tests.utils import build_pack
+from dulwich.tests.utils import build_pack, make_commit
 import pytest
 import sentry_sdk
 
-from swh.loader.git import converters
-from swh.loader.git.loader import FetchPackReturn, GitLoader, split_lines_and_remainder
+from swh.loader.git import converters, pack, utils
+from swh.loader.git.base import BaseGitLoader
+from swh.loader.git.loader import (
+    LS_REFS_PREFIXES,
+    FetchPackReturn,
+    GitLoader,
+    RepoRepresentation,
+    split_lines_and_remainder,
+)
+from swh.loader.git.pack import PackStream, StreamingPackInflater, SwhPackInflater
 from swh.loader.git.tests.test_from_disk import SNAPSHOT1, FullGitLoaderTests
+from swh.loader.git.utils import PackWriter
 from swh.loader.tests import (
     assert_last_visit_matches,
     get_stats,
     prepare_repository_from_archive,
 )
+from swh.model import hashutil
 from swh.model.model import (
     MetadataAuthority,
     MetadataAuthorityType,
     MetadataFetcher,
+    ObjectType,
     Origin,
     OriginVisit,
     OriginVisitStatus,
     RawExtrinsicMetadata,
+    Release,
+    SkippedContent,
     Snapshot,
+    SnapshotBranch,
+    SnapshotTargetType,
 )
+from swh.storage.algos.snapshot import snapshot_get_latest
 
 
 class CommonGitLoaderNotFound:
@@ -446,6 +468,92 @@ class TestGitLoader(FullGitLoaderTests, CommonGitLoaderNotFound):
                 call(statsd_metric, "c", 1, {"type": "revision", "result": "found"}, 1),
             ]
 
+    def test_prefetch_ext_refs(self, mocker):
+        """External references are looked up in batches, one storage call per type"""
+        assert self.loader.load() == {"status": "eventful"}
+
+        storage = self.loader.storage
+        revision_get = mocker.spy(storage, "revision_get")
+        release_get = mocker.spy(storage, "release_get")
+
+        head = self.repo[self.repo.head()]
+        tree = self.repo[head.tree]
+        blob_id = next(entry.sha for entry in tree.items() if entry.mode & 0o100000)
+        unknown_id = b"\x00" * 20
+        sha1s = [
+            hashutil.hash_to_bytes(obj_id.decode())
+            for obj_id in (blob_id, tree.id, head.id)
+        ] + [unknown_id]
+
+        self.loader.ext_refs = {}
+        self.loader._prefetch_ext_refs(sha1s)
+
+        assert self.loader.ext_refs == {
+            sha1s[0]: (Blob.type_num, [self.repo[blob_id].as_raw_string()]),
+            sha1s[1]: (Tree.type_num, [tree.as_raw_string()]),
+            sha1s[2]: (Commit.type_num, [head.as_raw_string()]),
+            unknown_id: None,
+        }
+        assert revision_get.call_args_list == [
+            call([sha1s[2], unknown_id], ignore_displayname=True)
+        ]
+        assert release_get.call_args_list == [
+            call([unknown_id], ignore_displayname=True)
+        ]
+
+        with pytest.raises(KeyError):
+            self.loader._resolve_ext_ref(unknown_id)
+
+    def test_resolve_ext_ref_evicted_base(self, mocker):
+        """External bases evicted from the delta base cache are resolved again
+        without querying the archive, and counted once"""
+        assert self.loader.load() == {"status": "eventful"}
+
+        head = self.repo[self.repo.head()]
+        tree = self.repo[head.tree]
+        blob = self.repo[
+            next(entry.sha for entry in tree.items() if entry.mode & 0o100000)
+        ]
+        buffer = io.BytesIO()
+        build_pack(
+            buffer,
+            [
+                (REF_DELTA, (blob.id, blob.as_raw_string() + b"foo")),
+                (REF_DELTA, (blob.id, b"bar" + blob.as_raw_string())),
+                (REF_DELTA, (blob.id, blob.as_raw_string() + b"baz")),
+            ],
+            self.repo.object_store,
+        )
+        stream = PackStream(max_size=1024)
+        stream.write(buffer.getvalue())
+        stream.finish()
+
+        storage = self.loader.storage
+        content_missing = mocker.spy(storage, "content_missing_per_sha1_git")
+        content_get = mocker.spy(storage, "content_get")
+        content_get_data = mocker.spy(storage, "content_get_data")
+        statsd_report = mocker.patch.object(self.loader.statsd, "_report")
+
+        inflater = StreamingPackInflater(
+            stream,
+            resolve_ext_ref=self.loader._resolve_ext_ref,
+            prefetch_ext_refs=self.loader._prefetch_ext_refs,
+            base_cache_size=0,
+        )
+        assert len(list(inflater)) == 3
+
+        assert content_missing.call_count == 1
+        assert content_get.call_count == 1
+        assert content_get_data.call_count == 1
+        statsd_metric = "swh_loader_git_external_reference_fetch_total"
+        assert [c for c in statsd_report.mock_calls if c[1][0] == statsd_metric] == [
+            call(statsd_metric, "c", 1, {"type": "content", "result": "found"}, 1)
+        ]
+
+        # manifests are dropped with the pack
+        self.loader.close_fetched_pack()
+        assert self.loader.ext_refs == {}
+
     def test_load_pack_size_limit(self, sentry_events):
         # set max pack size to a really small value
         self.loader.pack_size_bytes = 10
@@ -457,6 +565,838 @@ class TestGitLoader(FullGitLoaderTests, CommonGitLoaderNotFound):
             "Pack file too big for repository"
         )
 
+    def test_load_pack_decompressed_size_limit(self, mocker, sentry_events):
+        """Downloads of packfiles inflating to too much data are aborted before
+        they end"""
+        self.loader.pack_decompressed_size_bytes = 100
+        write = mocker.spy(PackWriter, "write")
+        res = self.loader.load()
+        assert res["status"] == "failed"
+        assert sentry_events[0]["exception"]["values"][0]["value"].startswith(
+            "Pack file too big for repository"
+        )
+        assert "decompressed" in sentry_events[0]["exception"]["values"][0]["value"]
+        fetched = sum(len(c.args[1]) for c in write.mock_calls)
+
+        # Other packfiles are loaded as usual
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            pack_decompressed_size_bytes=1024 * 1024,
+        )
+        assert loader.load() == {"status": "eventful"}
+        assert 0 < fetched < loader.pack_size
+
+    def test_load_chunked_fetch(self, mocker):
+        """Repositories larger than the pack size limit are fetched in several
+        rounds, each round fetching a subset of the wanted refs"""
+        self.loader.chunked_fetch = True
+        # large enough for the pack of any single ref, not for the whole repository
+        self.loader.pack_size_bytes = 1700
+        fetch_pack_from_origin = mocker.spy(self.loader, "fetch_pack_from_origin")
+        snapshot_add = mocker.spy(self.loader.storage, "snapshot_add")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert self.loader.fetch_round > 1
+        assert fetch_pack_from_origin.call_count > self.loader.fetch_round
+        # only the final snapshot is stored
+        assert snapshot_add.call_count == 1
+        assert_last_visit_matches(
+            self.loader.storage,
+            self.repo_url,
+            status="full",
+            type="git",
+            snapshot=SNAPSHOT1.id,
+        )
+        assert get_stats(self.loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 1,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    @pytest.mark.parametrize("inflate_processes", [0, 2])
+    def test_load_pack_index_types(self, inflate_processes):
+        """Types of the objects of the packfile are resolved by its index, for the
+        targets of refs which were not read in particular"""
+        self.loader.inflate_processes = inflate_processes
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert self.loader.pack_summary is not None
+        assert self.loader.pack_summary.unknown_type_count == 0
+        assert self.loader.pack_summary.object_count == 18
+
+        snapshot = self.loader.snapshot
+        self.loader.ref_object_types = {}
+        assert self.loader.get_snapshot() == snapshot
+
+    def test_load_inflates_pack_once(self, mocker):
+        """Objects of all types are read from a single inflation of the pack"""
+        inflate = mocker.spy(SwhPackInflater, "__iter__")
+        statsd_report = mocker.patch.object(self.loader.statsd, "_report")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert inflate.call_count == 1
+        assert [
+            c[1][3]["result"]
+            for c in statsd_report.mock_calls
+            if c[1][0] == "swh_loader_git_delta_base_cache_total"
+        ] == ["hit", "miss"]
+        stats = get_stats(self.loader.storage)
+        assert (stats["content"], stats["directory"], stats["revision"]) == (4, 7, 7)
+
+    def test_load_large_blobs(self, mocker):
+        """Blobs over max_content_size are archived as skipped contents"""
+        self.loader.max_content_size = 1
+        skipped_content_add = mocker.spy(self.loader.storage, "skipped_content_add")
+        hash_large_blob = mocker.spy(SwhPackInflater, "_hash_large_blob")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        # blobs which are not delta bases were not inflated in memory
+        assert hash_large_blob.call_count > 0
+        stats = get_stats(self.loader.storage)
+        assert (stats["content"], stats["skipped_content"]) == (0, 4)
+
+        blobs = [
+            obj
+            for obj in map(self.repo.__getitem__, self.repo.object_store)
+            if obj.type_name == Blob.type_name
+        ]
+        assert {obj for c in skipped_content_add.mock_calls for obj in c.args[0]} == {
+            converters.dulwich_blob_to_content(blob, max_content_size=1)
+            for blob in blobs
+        }
+
+    def test_load_filter_large_blobs(self, mocker):
+        """Blobs omitted from the pack by the blob filter are skipped contents"""
+        self.loader.max_content_size = 1
+        self.loader.filter_large_blobs = True
+        fetch_pack = mocker.spy(dulwich.client.LocalGitClient, "fetch_pack")
+
+        # The local transport ignores object filters, drop all the blobs of the
+        # pack as a server supporting them would do
+        inflate_pack = self.loader._inflate_pack
+        mocker.patch.object(
+            self.loader,
+            "_inflate_pack",
+            side_effect=lambda: (
+                obj for obj in inflate_pack() if obj.type_name != Blob.type_name
+            ),
+        )
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+        assert fetch_pack.call_args.kwargs["filter_spec"] == b"blob:limit=1"
+
+        stats = get_stats(self.loader.storage)
+        assert (stats["content"], stats["skipped_content"]) == (0, 4)
+        assert stats["directory"] == 7
+
+        blob_ids = {
+            hashutil.hash_to_bytes(obj.id.decode())
+            for obj in map(self.repo.__getitem__, self.repo.object_store)
+            if obj.type_name == Blob.type_name
+        }
+        for sha1_git in blob_ids:
+            (skipped,) = self.loader.storage.skipped_content_find(
+                {"sha1_git": sha1_git}
+            )
+            assert (skipped.length, skipped.reason) == (-1, "Content too large")
+
+        # Skipped contents are not recorded twice
+        skipped_content_add = mocker.spy(self.loader.storage, "skipped_content_add")
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            incremental=False,
+            max_content_size=1,
+            filter_large_blobs=True,
+        )
+        mocker.patch.object(
+            loader,
+            "_inflate_pack",
+            side_effect=lambda: (
+                obj
+                for obj in GitLoader._inflate_pack(loader)
+                if obj.type_name != Blob.type_name
+            ),
+        )
+        loader.load()
+        assert not [obj for c in skipped_content_add.mock_calls for obj in c.args[0]]
+
+    def test_load_filter_large_blobs_fetch_arguments(self, mocker):
+        """The blob filter is sent to the server with the protocol v2"""
+        fetch_pack = mocker.spy(dulwich.client.LocalGitClient, "fetch_pack")
+
+        self.loader.filter_large_blobs = True
+        assert self.loader.load() == {"status": "eventful"}
+        assert fetch_pack.call_args.kwargs["filter_spec"] is None
+        assert fetch_pack.call_args.kwargs["protocol_version"] is None
+
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            incremental=False,
+            max_content_size=1024,
+            filter_large_blobs=True,
+        )
+        loader.load()
+        assert fetch_pack.call_args.kwargs["filter_spec"] == b"blob:limit=1024"
+        assert fetch_pack.call_args.kwargs["protocol_version"] == 2
+
+    def test_load_filter_large_blobs_batched_lookup(self, mocker):
+        """Blobs omitted by the blob filter are looked up as skipped contents in
+        one query, with all the hashes they are recorded with"""
+        self.loader.max_content_size = 1
+        self.loader.filter_large_blobs = True
+        mocker.patch.object(
+            self.loader,
+            "_inflate_pack",
+            side_effect=lambda: (
+                obj
+                for obj in GitLoader._inflate_pack(self.loader)
+                if obj.type_name != Blob.type_name
+            ),
+        )
+        skipped_content_missing = mocker.spy(
+            self.loader.storage, "skipped_content_missing"
+        )
+        skipped_content_find = mocker.spy(self.loader.storage, "skipped_content_find")
+        assert self.loader.load() == {"status": "eventful"}
+
+        (call,) = skipped_content_missing.mock_calls
+        assert len(call.args[0]) == 4
+        assert {
+            SkippedContent.from_dict(hashes).sha1_git for hashes in call.args[0]
+        } == {
+            hashutil.hash_to_bytes(obj.id.decode())
+            for obj in map(self.repo.__getitem__, self.repo.object_store)
+            if obj.type_name == Blob.type_name
+        }
+        skipped_content_find.assert_not_called()
+
+    def test_load_filter_large_blobs_archived(self, mocker):
+        """Blobs of the pack already in the archive are looked up only once"""
+        assert self.loader.load() == {"status": "eventful"}
+
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            incremental=False,
+            max_content_size=1,
+            filter_large_blobs=True,
+        )
+        content_missing = mocker.spy(loader.storage, "content_missing_per_sha1_git")
+        skipped_content_missing = mocker.spy(loader.storage, "skipped_content_missing")
+        loader.load()
+
+        looked_up = [
+            sha1_git for c in content_missing.mock_calls for sha1_git in c.args[0]
+        ]
+        assert len(looked_up) == len(set(looked_up)) == 4
+        skipped_content_missing.assert_not_called()
+
+    def test_load_streaming_fetch(self, mocker):
+        """Objects are loaded while the pack is being downloaded"""
+        self.loader.streaming_fetch = True
+        threads = []
+        fetch_pack_from_origin = self.loader.fetch_pack_from_origin
+
+        def fetch(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return fetch_pack_from_origin(*args, **kwargs)
+
+        mocker.patch.object(self.loader, "fetch_pack_from_origin", side_effect=fetch)
+        streaming_inflater = mocker.spy(StreamingPackInflater, "__iter__")
+        statsd_report = mocker.patch.object(self.loader.statsd, "_report")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert threads and threads[0] is not threading.current_thread()
+        assert streaming_inflater.call_count == 1
+        assert [
+            c[1][3]["result"]
+            for c in statsd_report.mock_calls
+            if c[1][0] == "swh_loader_git_delta_base_cache_total"
+        ] == ["hit", "miss"]
+        assert self.loader.pack_stream is None and self.loader.fetch_future is None
+        assert self.loader.loaded_snapshot_id == SNAPSHOT1.id
+        assert get_stats(self.loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 1,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    def test_load_resume_partial_pack(self, mocker, tmp_path):
+        """Objects received before a download failure are loaded by the next
+        attempt, which only fetches the objects it misses"""
+        partial_pack_dir = tmp_path / "partial_packs"
+        self.loader.partial_pack_dir = str(partial_pack_dir)
+        full_pack_size = (
+            GitLoader(self.loader.storage, self.repo_url)
+            .fetch_pack_from_origin(
+                self.repo_url, RepoRepresentation(self.loader.storage), lambda msg: None
+            )
+            .pack_size
+        )
+
+        def write(pack_writer, data):
+            # The connection is reset before the checksum at the end of the pack
+            remaining = full_pack_size - 20 - pack_writer.pack_buffer.tell()
+            if len(data) > remaining:
+                pack_writer.pack_buffer.write(data[:remaining])
+                raise ConnectionResetError("Connection reset by peer")
+            pack_writer.pack_buffer.write(data)
+
+        mocker.patch.object(PackWriter, "write", autospec=True, side_effect=write)
+        res = self.loader.load()
+        assert res == {"status": "failed", "error": "Connection reset by peer"}
+        [partial_pack] = partial_pack_dir.iterdir()
+        assert get_stats(self.loader.storage)["revision"] == 0
+
+        mocker.stopall()
+        loader = GitLoader(
+            self.loader.storage, self.repo_url, partial_pack_dir=str(partial_pack_dir)
+        )
+        res = loader.load()
+        assert res == {"status": "eventful"}
+
+        # all the commits were advertised, nothing was left to fetch
+        assert 0 < loader.pack_size < 100
+        assert not partial_pack.exists()
+        assert loader.loaded_snapshot_id == SNAPSHOT1.id
+        assert get_stats(loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 2,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    def test_save_partial_pack_after_resumed_pack(self, tmp_path):
+        """Entries of the resumed partial pack are kept along with the complete
+        entries of an interrupted download"""
+        self.loader.partial_pack_dir = str(tmp_path / "partial_packs")
+        resumed = [Blob.from_string(b"foo"), Blob.from_string(b"bar")]
+        resumed_path = tmp_path / "resumed.pack"
+        with open(resumed_path, "wb") as f:
+            build_pack(f, [(obj.type_num, obj.as_raw_string()) for obj in resumed])
+        fetched = [Blob.from_string(b"baz"), Blob.from_string(b"qux" * 100)]
+        buffer = io.BytesIO()
+        build_pack(buffer, [(obj.type_num, obj.as_raw_string()) for obj in fetched])
+        # the download was interrupted in the middle of the last entry
+        interrupted = io.BytesIO(buffer.getvalue()[:-30])
+
+        self.loader.resumed_pack = PackData.from_path(resumed_path, object_format=SHA1)
+        try:
+            self.loader.save_partial_pack(self.repo_url, interrupted)
+        finally:
+            self.loader.close_resumed_pack()
+
+        path = self.loader.partial_pack_path(self.repo_url, self.loader.fetch_wants)
+        pack_data = PackData.from_path(path, object_format=SHA1)
+        pack_data.check()
+        assert [obj.id for obj in PackInflater.for_pack_data(pack_data)] == [
+            resumed[0].id,
+            resumed[1].id,
+            fetched[0].id,
+        ]
+        pack_data.close()
+
+    def test_partial_pack_haves(self):
+        """Commits of a partial pack are advertised when their trees and ancestors
+        are all either in the pack or in the archive"""
+        blob = Blob.from_string(b"foo")
+        tree = Tree()
+        tree.add(b"foo", 0o100644, blob.id)
+        incomplete_tree = Tree()
+        incomplete_tree.add(b"foo", 0o100644, blob.id)
+        incomplete_tree.add(b"bar", 0o100644, Blob.from_string(b"bar").id)
+        known_commit = self.repo[b"b6f40292c4e94a8f7e7b4aff50e6c7429ab98e2a"]
+        self.loader.storage.revision_add(
+            [converters.dulwich_commit_to_revision(known_commit)]
+        )
+        self.loader.storage.flush()
+
+        commit1 = make_commit(tree=tree.id, parents=[])
+        commit2 = make_commit(tree=incomplete_tree.id, parents=[commit1.id])
+        commit3 = make_commit(tree=tree.id, parents=[commit2.id])
+        commit4 = make_commit(tree=tree.id, parents=[known_commit.id])
+        objects = [blob, tree, incomplete_tree, commit1, commit2, commit3, commit4]
+        buffer = io.BytesIO()
+        build_pack(buffer, [(obj.type_num, obj.as_raw_string()) for obj in objects])
+
+        parents: Dict[bytes, List[bytes]] = {}
+        haves = self.loader.partial_pack_haves(buffer.getvalue(), parents)
+        assert sorted(haves) == sorted([commit1.id, commit4.id])
+        assert parents[commit3.id] == [commit2.id]
+
+    def test_expire_partial_packs(self, tmp_path):
+        """Partial packs older than partial_pack_max_age are removed"""
+        partial_pack_dir = tmp_path / "partial_packs"
+        partial_pack_dir.mkdir()
+        self.loader.partial_pack_dir = str(partial_pack_dir)
+        self.loader.partial_pack_max_age = 3600
+        old_pack = partial_pack_dir / "old.pack"
+        new_pack = partial_pack_dir / "new.pack"
+        old_pack.write_bytes(b"PACK")
+        new_pack.write_bytes(b"PACK")
+        os.utime(old_pack, (time.time() - 7200, time.time() - 7200))
+
+        self.loader.expire_partial_packs()
+        assert list(partial_pack_dir.iterdir()) == [new_pack]
+
+    def test_load_uses_pack_index(self, mocker):
+        """Entries of the packfile are indexed while it is downloaded, instead of
+        being read again before inflating it"""
+        iter_pack_entries = mocker.spy(pack, "iter_pack_entries")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert iter_pack_entries.call_count == 0
+        assert self.loader.pack_index is not None
+        assert self.loader.pack_index.complete
+        assert len(self.loader.pack_index.entries) == 4 + 7 + 7
+
+    def test_load_pack_summary(self, mocker):
+        """Object types absent from the packfile are not looked for"""
+        get_releases = mocker.spy(self.loader, "get_releases")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        summary = self.loader.pack_summary
+        assert summary is not None
+        assert summary.object_counts == {
+            Blob.type_num: 4,
+            Tree.type_num: 7,
+            Commit.type_num: 7,
+        }
+        assert summary.unknown_type_count == 0
+        assert self.loader.expected_object_count() == 18
+        assert self.loader.has_contents()
+        assert not self.loader.has_releases()
+        assert get_releases.call_count == 0
+
+    def test_load_content_hash_threads(self, mocker):
+        """Contents can be hashed by a thread pool, and are stored in the order
+        of the packfile"""
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            content_hash_threads=2,
+            content_hash_max_bytes=1,
+        )
+        map_in_batches = mocker.spy(utils, "map_in_batches")
+        content_add = mocker.spy(loader.storage, "content_add")
+        res = loader.load()
+        assert res == {"status": "eventful"}
+
+        assert map_in_batches.call_count == 1
+        assert loader.loaded_snapshot_id == SNAPSHOT1.id
+        contents = [cnt for call in content_add.call_args_list for cnt in call[0][0]]
+        assert [cnt.sha1_git for cnt in contents] == [
+            hashutil.hash_to_bytes(obj.id.decode())
+            for obj in PackInflater.for_pack_data(loader.pack_data)
+            if obj.type_num == Blob.type_num
+        ]
+
+    def test_load_convert_processes(self, mocker):
+        """Trees, commits and tags can be converted by worker processes"""
+        loader = GitLoader(self.loader.storage, self.repo_url, convert_processes=2)
+        map_in_batches = mocker.spy(utils, "map_in_batches")
+        res = loader.load()
+        assert res == {"status": "eventful"}
+
+        # directories and revisions; the packfile contains no tags
+        assert map_in_batches.call_count == 2
+        assert loader.convert_executor is None
+        assert loader.loaded_snapshot_id == SNAPSHOT1.id
+        assert get_stats(loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 1,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    def test_load_convert_processes_batches(self, mocker):
+        """Several batches of objects are converted by the worker processes at
+        once, and their results are loaded in order"""
+        mocker.patch("swh.loader.git.loader.CONVERT_BATCH_BYTES", 100)
+        loader = GitLoader(self.loader.storage, self.repo_url, convert_processes=3)
+        process_pool = mocker.patch(
+            "swh.loader.git.loader.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+        )
+        events = []
+        submit = ProcessPoolExecutor.submit
+        map_in_batches = utils.map_in_batches
+
+        def submit_batch(executor, *args):
+            events.append("submit")
+            return submit(executor, *args)
+
+        def map_batches(*args, **kwargs):
+            for result in map_in_batches(*args, **kwargs):
+                events.append("result")
+                yield result
+
+        mocker.patch.object(ProcessPoolExecutor, "submit", submit_batch)
+        mocker.patch.object(utils, "map_in_batches", map_batches)
+        res = loader.load()
+        assert res == {"status": "eventful"}
+
+        assert process_pool.call_args.kwargs["max_workers"] == 3
+        # batches of trees, then of commits, all converted
+        assert events.count("result") == 14
+        assert events.index("result") > 2
+        assert loader.loaded_snapshot_id == SNAPSHOT1.id
+        assert get_stats(loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 1,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    def test_load_convert_processes_chunked_fetch(self, mocker):
+        """The worker processes are started once for all the fetch rounds"""
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            chunked_fetch=True,
+            pack_size_bytes=1700,
+            convert_processes=2,
+        )
+        process_pool = mocker.patch(
+            "swh.loader.git.loader.ProcessPoolExecutor", wraps=ProcessPoolExecutor
+        )
+        res = loader.load()
+        assert res == {"status": "eventful"}
+
+        assert loader.fetch_round > 1
+        process_pool.assert_called_once()
+        assert loader.convert_executor is None
+        assert loader.loaded_snapshot_id == SNAPSHOT1.id
+
+    def test_load_parallel_inflate(self):
+        """Delta chains of the packfile can be resolved across a process pool"""
+        loader = GitLoader(self.loader.storage, self.repo_url, inflate_processes=2)
+        res = loader.load()
+        assert res == {"status": "eventful"}
+
+        assert loader.loaded_snapshot_id == SNAPSHOT1.id
+        assert get_stats(loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 1,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    def test_load_skips_known_objects(self, mocker):
+        """Objects already in the archive are neither converted nor sent to it"""
+        known_revs = [
+            converters.dulwich_commit_to_revision(self.repo[sha1])
+            for sha1 in [
+                b"b6f40292c4e94a8f7e7b4aff50e6c7429ab98e2a",
+                b"1135e94ccf73b5f9bd6ef07b3fa2c5cc60bba69b",
+            ]
+        ]
+        self.loader.storage.revision_add(known_revs)
+        self.loader.storage.flush()
+
+        commit_to_revision = mocker.spy(converters, "dulwich_commit_to_revision")
+        revision_add = mocker.spy(self.loader.storage, "revision_add")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert commit_to_revision.call_count == 5
+        added_revs = [rev for c in revision_add.mock_calls for rev in c.args[0]]
+        assert len(added_revs) == 5
+        assert not set(added_revs) & set(known_revs)
+        assert get_stats(self.loader.storage)["revision"] == 7
+
+    def test_load_storage_batches(self, mocker):
+        """Objects are sent to the storage in batches of the configured size"""
+        assert self.loader.storage_batch_target_latency is None
+        self.loader.storage_batch_size["content"] = 3
+        self.loader.storage_batch_size["directory"] = 5
+        content_add = mocker.spy(self.loader.storage, "content_add")
+        directory_add = mocker.spy(self.loader.storage, "directory_add")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert [len(c.args[0]) for c in content_add.mock_calls] == [3, 1]
+        assert [len(c.args[0]) for c in directory_add.mock_calls] == [5, 2]
+
+    def test_load_storage_writer_threads(self, mocker):
+        """Storage writes happen in writer threads, one object type after the other"""
+        self.loader.storage_writer_threads = 2
+        for object_type in ("content", "directory", "revision"):
+            self.loader.storage_batch_size[object_type] = 2
+
+        calls = []
+        for object_type in ("content", "directory", "revision"):
+            add = getattr(self.loader.storage, f"{object_type}_add")
+
+            def add_objects(objects, add=add, object_type=object_type):
+                calls.append(object_type)
+                return add(objects)
+
+            mocker.patch.object(
+                self.loader.storage, f"{object_type}_add", side_effect=add_objects
+            )
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        assert calls == ["content"] * 2 + ["directory"] * 4 + ["revision"] * 4
+        assert get_stats(self.loader.storage) == {
+            "content": 4,
+            "directory": 7,
+            "origin": 1,
+            "origin_visit": 1,
+            "release": 0,
+            "revision": 7,
+            "skipped_content": 0,
+            "snapshot": 1,
+        }
+
+    def test_load_unchanged_refs(self, mocker):
+        """Revisiting an origin whose refs did not change only lists its refs"""
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+        snapshot_id = self.loader.loaded_snapshot_id
+
+        statsd_report = mocker.patch.object(self.loader.statsd, "_report")
+        store_data = mocker.spy(BaseGitLoader, "store_data")
+        snapshot_add = mocker.spy(self.loader.storage, "snapshot_add")
+
+        res = self.loader.load()
+        assert res == {"status": "uneventful"}
+        assert self.loader.loaded_snapshot_id == snapshot_id
+        store_data.assert_not_called()
+        snapshot_add.assert_not_called()
+        assert [
+            c
+            for c in statsd_report.mock_calls
+            if c[1][0] == "swh_loader_git_unchanged_refs_total"
+        ] == [call("swh_loader_git_unchanged_refs_total", "c", 1, {}, 1)]
+
+        assert_last_visit_matches(
+            self.loader.storage,
+            self.repo_url,
+            status="full",
+            type="git",
+            snapshot=snapshot_id,
+        )
+
+        # A new commit is loaded as usual
+        self.repo.get_worktree().commit(b"Hello world\n", sign=False)
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+        store_data.assert_called_once()
+
+    def test_load_filter_refs_on_server(self, mocker):
+        """Ignored refs can be excluded from the listing of the server"""
+        fetch_pack = mocker.spy(dulwich.client.LocalGitClient, "fetch_pack")
+
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+        assert fetch_pack.call_args.kwargs["ref_prefix"] is None
+        assert fetch_pack.call_args.kwargs["protocol_version"] is None
+
+        loader = GitLoader(
+            self.loader.storage, self.repo_url, filter_refs_on_server=True
+        )
+        assert loader.load() == {"status": "uneventful"}
+        assert fetch_pack.call_args.kwargs["ref_prefix"] == LS_REFS_PREFIXES
+        assert fetch_pack.call_args.kwargs["protocol_version"] == 2
+
+    @pytest.mark.parametrize("filter_refs_on_server", [False, True])
+    def test_load_ignored_ref_prefixes(self, filter_refs_on_server):
+        """Refs under the ignored prefixes are neither fetched nor archived, nor
+        are refs other than branches and tags when filtering refs on the server"""
+        head = self.repo.refs[b"HEAD"]
+        ignored_refs = [b"refs/changes/01/1/1", b"refs/pipelines/42"]
+        other_refs = [b"refs/pull/1/head", b"refs/notes/commits"]
+        for ref in ignored_refs + other_refs:
+            self.repo.refs[ref] = head
+
+        loader = GitLoader(
+            self.loader.storage,
+            self.repo_url,
+            filter_refs_on_server=filter_refs_on_server,
+        )
+        assert loader.load() == {"status": "eventful"}
+
+        snapshot = snapshot_get_latest(loader.storage, self.repo_url)
+        assert snapshot is not None
+        for refs in (loader.remote_refs, snapshot.branches):
+            assert b"refs/heads/master" in refs
+            assert not set(ignored_refs) & set(refs)
+            if filter_refs_on_server:
+                assert not set(other_refs) & set(refs)
+            else:
+                assert set(other_refs) <= set(refs)
+        assert b"HEAD" in snapshot.branches
+
+    def test_repo_representation_walks_archived_history(self, mocker):
+        """Negotiation advertises the ancestors of the heads known by the archive"""
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        revision_shortlog = mocker.spy(self.loader.storage, "revision_shortlog")
+        base_repo = RepoRepresentation(self.loader.storage, base_snapshots=[SNAPSHOT1])
+        graph_walker = base_repo.graph_walker()
+        haves = list(iter(graph_walker.next, None))
+
+        commits = {
+            obj.id
+            for obj in map(self.repo.__getitem__, self.repo.object_store)
+            if obj.type_name == dulwich.objects.Commit.type_name
+        }
+        assert len(haves) == len(set(haves))
+        assert set(haves) == commits
+        # all the history fits in a single batch
+        assert revision_shortlog.call_count == 1
+
+    def test_repo_representation_release_heads(self, mocker):
+        """Release heads are resolved once, with batched lookups, and are not
+        sent again as roots of the history walks"""
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        head = hashutil.hash_to_bytes(self.repo.head().decode())
+        releases = [
+            Release(
+                name=b"v%d" % i,
+                message=b"release %d\n" % i,
+                target=head,
+                target_type=ObjectType.REVISION,
+                synthetic=False,
+            )
+            for i in range(3)
+        ]
+        self.loader.storage.release_add(releases)
+        self.loader.storage.flush()
+        directory = b"\x01" * 20
+        snapshot = Snapshot(
+            branches={
+                **{
+                    b"refs/tags/v%d"
+                    % i: SnapshotBranch(
+                        target=release.id, target_type=SnapshotTargetType.RELEASE
+                    )
+                    for i, release in enumerate(releases)
+                },
+                b"refs/tags/unknown": SnapshotBranch(
+                    target=b"\x02" * 20, target_type=SnapshotTargetType.RELEASE
+                ),
+                b"refs/tags/tree": SnapshotBranch(
+                    target=directory, target_type=SnapshotTargetType.DIRECTORY
+                ),
+            }
+        )
+
+        release_get = mocker.spy(self.loader.storage, "release_get")
+        revision_shortlog = mocker.spy(self.loader.storage, "revision_shortlog")
+        base_repo = RepoRepresentation(
+            self.loader.storage, base_snapshots=[snapshot], parents_batch_size=2
+        )
+        graph_walker = base_repo.graph_walker()
+        haves = list(iter(graph_walker.next, None))
+
+        assert release_get.call_count == 2
+        assert sorted(
+            sha1 for call_ in release_get.call_args_list for sha1 in call_[0][0]
+        ) == sorted([release.id for release in releases] + [b"\x02" * 20])
+        release_ids = {sha_to_hex(release.id) for release in releases}
+        for call_ in revision_shortlog.call_args_list:
+            assert not {sha_to_hex(root) for root in call_[0][0]} & release_ids
+        assert base_repo.parents[sha_to_hex(releases[0].id)] == [sha_to_hex(head)]
+        assert base_repo.parents[sha_to_hex(directory)] == []
+        assert sha_to_hex(head) in haves
+
+    def test_repo_representation_many_revision_heads(self, mocker):
+        """Parents of the walked revisions are found when there are more revision
+        heads than parents_batch_size, whichever revisions the storage returns
+        first within the limit"""
+        res = self.loader.load()
+        assert res == {"status": "eventful"}
+
+        storage = self.loader.storage
+        revision_shortlog = storage.revision_shortlog
+
+        def roots_first_revision_shortlog(revisions, limit=None):
+            # Like the PostgreSQL backend: all the roots, in index order rather
+            # than in argument order, before their ancestors, then the limit
+            shortlog = dict(revision_shortlog(revisions))
+            ids = sorted(set(revisions) & shortlog.keys())
+            ids += [rev_id for rev_id in shortlog if rev_id not in ids]
+            return [(rev_id, shortlog[rev_id]) for rev_id in ids[:limit]]
+
+        mocker.patch.object(
+            storage, "revision_shortlog", side_effect=roots_first_revision_shortlog
+        )
+        commits = [
+            obj
+            for obj in map(self.repo.__getitem__, self.repo.object_store)
+            if obj.type_name == dulwich.objects.Commit.type_name
+        ]
+        snapshot = Snapshot(
+            branches={
+                b"refs/heads/%d"
+                % i: SnapshotBranch(
+                    target=hashutil.hash_to_bytes(commit.id.decode()),
+                    target_type=SnapshotTargetType.REVISION,
+                )
+                for i, commit in enumerate(commits)
+            }
+        )
+        base_repo = RepoRepresentation(
+            storage, base_snapshots=[snapshot], parents_batch_size=2
+        )
+        graph_walker = base_repo.graph_walker()
+        haves = list(iter(graph_walker.next, None))
+
+        assert sorted(haves) == sorted(commit.id for commit in commits)
+        for commit in commits:
+            assert base_repo.parents[commit.id] == commit.parents
+
 
 class TestGitLoader2(FullGitLoaderTests, CommonGitLoaderNotFound):
     """Mostly the same loading scenario but with a ``parent_origin`` different from the
@@ -0,0 +1,683 @@
+# Copyright (C) 2026  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import io
+import mmap
+from tempfile import SpooledTemporaryFile
+import threading
+from typing import Tuple
+
+from dulwich.object_format import SHA1
+from dulwich.object_store import MemoryObjectStore
+from dulwich.objects import Blob, Commit, ShaFile, Tree, hex_to_sha, sha_to_hex
+from dulwich.pack import OFS_DELTA, REF_DELTA, PackData, PackInflater
+from dulwich.tests.utils import build_pack
+import pytest
+
+from swh.loader.git import pack
+from swh.loader.git.pack import (
+    DeltaBaseCache,
+    FileContents,
+    ObjectSpool,
+    PackIndexer,
+    PackObjectDispatcher,
+    PackStream,
+    PackSummary,
+    ParallelPackInflater,
+    SkippedBlob,
+    StreamingPackInflater,
+    SwhPackInflater,
+    complete_entries,
+    delta_families,
+    file_contents,
+    iter_pack_entries,
+    write_pack,
+)
+from swh.model.hashutil import MultiHash
+
+
+def make_blob(data: bytes) -> Blob:
+    return Blob.from_string(data)
+
+
+def make_tree(blob: Blob) -> Tree:
+    tree = Tree()
+    tree.add(b"file", 0o100644, blob.id)
+    return tree
+
+
+def make_pack(objects_spec, store=None) -> Tuple[PackData, bytes]:
+    buffer = io.BytesIO()
+    build_pack(buffer, objects_spec, store)
+    data = buffer.getvalue()
+    return PackData.from_file(file=buffer, size=len(data), object_format=SHA1), data
+
+
+def make_pack_data(objects_spec, store=None) -> PackData:
+    return make_pack(objects_spec, store)[0]
+
+
+def test_object_spool_roundtrip():
+    objects = [make_blob(b"foo"), make_blob(b"bar" * 1000)]
+    objects.append(make_tree(objects[0]))
+    objects.append(SkippedBlob(MultiHash.from_data(b"baz").digest()))
+
+    spool = ObjectSpool(max_size=100)
+    for obj in objects:
+        spool.append(obj)
+
+    # spooled objects should have been written to disk
+    assert spool.buffer.name is not None
+    assert spool.count == 4
+
+    spooled = list(spool)
+    assert [obj.id for obj in spooled] == [obj.id for obj in objects]
+    assert [obj.as_raw_string() for obj in spooled[:3]] == [
+        obj.as_raw_string() for obj in objects[:3]
+    ]
+    assert [type(obj) for obj in spooled] == [Blob, Blob, Tree, SkippedBlob]
+    assert spooled[3] == objects[3]
+
+    spool.close()
+
+
+def test_file_contents(tmp_path):
+    spooled = SpooledTemporaryFile(max_size=10)
+    spooled.write(b"foo")
+    with file_contents(spooled) as contents:
+        # the spool was not rolled over to disk to be mapped
+        assert isinstance(contents, FileContents)
+        assert contents[1:3] == b"oo"
+        assert contents[0] == ord("f")
+    assert spooled.name is None
+
+    spooled.seek(0, io.SEEK_END)
+    spooled.write(b"bar" * 10)
+    with file_contents(spooled) as contents:
+        assert isinstance(contents, mmap.mmap)
+        assert contents[1:6] == b"oobar"
+        assert contents[-1] == ord("r")
+    assert contents.closed
+
+    with open(tmp_path / "empty", "w+b") as empty:
+        with file_contents(empty) as contents:
+            assert contents[0:10] == b""
+
+
+def test_pack_object_dispatcher_single_pass():
+    blobs = [make_blob(b"foo"), make_blob(b"bar")]
+    trees = [make_tree(blob) for blob in blobs]
+    # interleave objects of both types as a pack inflater would do
+    objects = [blobs[0], trees[0], blobs[1], trees[1]]
+
+    inflations = []
+
+    def inflate():
+        inflations.append(1)
+        return iter(objects)
+
+    dispatcher = PackObjectDispatcher(inflate, spool_max_size=1024)
+
+    assert [obj.id for obj in dispatcher.iter_objects(Blob.type_name)] == [
+        blob.id for blob in blobs
+    ]
+    assert [obj.id for obj in dispatcher.iter_objects(Tree.type_name)] == [
+        tree.id for tree in trees
+    ]
+    assert list(dispatcher.iter_objects(Commit.type_name)) == []
+    assert len(inflations) == 1
+
+    dispatcher.close()
+
+
+def test_pack_object_dispatcher_interrupted_consumer():
+    blobs = [make_blob(b"foo"), make_blob(b"bar"), make_blob(b"baz")]
+    trees = [make_tree(blob) for blob in blobs]
+    objects = [blobs[0], trees[0], blobs[1], trees[1], blobs[2], trees[2]]
+
+    dispatcher = PackObjectDispatcher(lambda: iter(objects), spool_max_size=1024)
+
+    blob_iter = dispatcher.iter_objects(Blob.type_name)
+    assert next(blob_iter).id == blobs[0].id
+    blob_iter.close()
+
+    # the remaining blobs are spooled while trees are read, not lost
+    assert [obj.id for obj in dispatcher.iter_objects(Tree.type_name)] == [
+        tree.id for tree in trees
+    ]
+    assert [obj.id for obj in dispatcher.iter_objects(Blob.type_name)] == [
+        blob.id for blob in blobs[1:]
+    ]
+
+    dispatcher.close()
+
+
+def test_pack_object_dispatcher_peek_objects():
+    blobs = [make_blob(b"foo"), make_blob(b"bar")]
+    trees = [make_tree(blob) for blob in blobs]
+    objects = [blobs[0], trees[0], blobs[1], trees[1]]
+
+    dispatcher = PackObjectDispatcher(lambda: iter(objects), spool_max_size=1024)
+
+    blob_iter = dispatcher.iter_objects(Blob.type_name)
+    assert next(blob_iter).id == blobs[0].id
+    blob_iter.close()
+
+    tree_ids = [tree.id for tree in trees]
+    assert [obj.id for obj in dispatcher.peek_objects(Tree.type_name)] == tree_ids
+    assert [obj.id for obj in dispatcher.peek_objects(Tree.type_name)] == tree_ids
+    assert [obj.id for obj in dispatcher.iter_objects(Tree.type_name)] == tree_ids
+    assert [obj.id for obj in dispatcher.iter_objects(Blob.type_name)] == [blobs[1].id]
+
+    dispatcher.close()
+
+
+def test_iter_pack_entries():
+    pack_data, data = make_pack(
+        [
+            (Blob.type_num, b"foo" * 100),
+            (OFS_DELTA, (0, b"foo" * 100 + b"bar")),
+            (REF_DELTA, (0, b"bar" + b"foo" * 100)),
+            (Tree.type_num, make_tree(make_blob(b"foo")).as_raw_string()),
+        ]
+    )
+
+    assert [
+        (entry.offset, entry.pack_type_num, entry.delta_base, entry.decomp_len)
+        for entry in iter_pack_entries(data)
+    ] == [
+        (entry.offset, entry.pack_type_num, entry.delta_base, entry.decomp_len)
+        for entry in pack_data.iter_unpacked()
+    ]
+
+
+def test_write_pack_from_complete_entries():
+    objects_spec = [
+        (Blob.type_num, b"foo" * 100),
+        (OFS_DELTA, (0, b"foo" * 100 + b"bar")),
+        (Blob.type_num, b"baz" * 100),
+    ]
+    buffer = io.BytesIO()
+    build_pack(buffer, objects_spec)
+    data = buffer.getvalue()
+    entries = list(make_pack_data(objects_spec).iter_unpacked())
+
+    # the download was interrupted in the middle of the last entry
+    truncated = io.BytesIO(data[: entries[2].offset + 5])
+    count, end = complete_entries(FileContents(truncated))
+    assert (count, end) == (2, entries[2].offset)
+    assert complete_entries(FileContents(io.BytesIO(data[:8]))) == (0, 0)
+
+    # entries of several packs are concatenated
+    output = io.BytesIO()
+    write_pack(output, count * 2, [(data, end), (FileContents(truncated), end)])
+    output.seek(0)
+    pack_data = PackData.from_file(
+        file=output, size=output.getbuffer().nbytes, object_format=SHA1
+    )
+    pack_data.check()
+    assert [obj.as_raw_string() for obj in PackInflater.for_pack_data(pack_data)] == [
+        b"foo" * 100,
+        b"foo" * 100 + b"bar",
+    ] * 2
+
+
+def test_pack_indexer():
+    objects_spec = [
+        (Blob.type_num, b"foo" * 100),
+        (OFS_DELTA, (0, b"foo" * 100 + b"bar")),
+        (REF_DELTA, (0, b"bar" + b"foo" * 100)),
+        (Tree.type_num, make_tree(make_blob(b"foo")).as_raw_string()),
+    ]
+    pack_data, data = make_pack(objects_spec)
+
+    indexer = PackIndexer()
+    for i in range(0, len(data), 7):
+        indexer.write(data[i : i + 7])
+
+    assert indexer.complete and indexer.error is None
+    assert [
+        (entry.offset, entry.pack_type_num, entry.delta_base, entry.decomp_len)
+        for entry in indexer.entries
+    ] == [
+        (entry.offset, entry.pack_type_num, entry.delta_base, entry.decomp_len)
+        for entry in pack_data.iter_unpacked()
+    ]
+    assert indexer.type_counts == {
+        Blob.type_num: 1,
+        OFS_DELTA: 1,
+        REF_DELTA: 1,
+        Tree.type_num: 1,
+    }
+    assert indexer.decompressed_size == sum(
+        entry.decomp_len for entry in pack_data.iter_unpacked()
+    )
+    # ids of whole objects are known
+    assert {sha_to_hex(sha): offset for sha, offset in indexer.offsets.items()} == {
+        make_blob(b"foo" * 100).id: indexer.entries[0].offset,
+        make_tree(make_blob(b"foo")).id: indexer.entries[3].offset,
+    }
+
+    inflater = SwhPackInflater(data, entries=indexer.entries, offsets=indexer.offsets)
+    assert sorted(obj.id for obj in inflater) == sorted(
+        obj.id for obj in PackInflater.for_pack_data(pack_data)
+    )
+
+
+def test_pack_indexer_truncated_and_corrupted():
+    buffer = io.BytesIO()
+    build_pack(buffer, [(Blob.type_num, b"foo" * 100), (Blob.type_num, b"bar")])
+    data = buffer.getvalue()
+
+    indexer = PackIndexer()
+    indexer.write(data[:-30])
+    assert not indexer.complete and indexer.error is None
+    assert len(indexer.entries) == 1
+
+    indexer = PackIndexer()
+    indexer.write(b"NOPE" + data[4:])
+    assert not indexer.complete and isinstance(indexer.error, AssertionError)
+
+
+def make_indexed_pack(tmp_path, objects_spec, store=None):
+    buffer = io.BytesIO()
+    build_pack(buffer, objects_spec, store)
+    path = tmp_path / "test.pack"
+    path.write_bytes(buffer.getvalue())
+    indexer = PackIndexer()
+    indexer.write(buffer.getvalue())
+    return str(path), indexer
+
+
+PARALLEL_OBJECTS_SPEC = [
+    (Blob.type_num, b"foo" * 100),
+    (OFS_DELTA, (0, b"foo" * 100 + b"bar")),
+    (Blob.type_num, b"baz" * 100),
+    (OFS_DELTA, (1, b"foo" * 100 + b"barbar")),
+    # based on a whole object, then on a delta object
+    (REF_DELTA, (2, b"qux" + b"baz" * 100)),
+    (REF_DELTA, (1, b"qux" + b"foo" * 100 + b"bar")),
+    (OFS_DELTA, (5, b"quux" + b"foo" * 100 + b"bar")),
+    (Blob.type_num, b"y" * 4096),
+]
+
+
+def test_delta_families(tmp_path):
+    _, indexer = make_indexed_pack(tmp_path, PARALLEL_OBJECTS_SPEC)
+    offsets = [entry.offset for entry in indexer.entries]
+
+    families, others = delta_families(indexer.entries, indexer.offsets)
+    assert {
+        root: [entry.offset for entry in family] for root, family in families.items()
+    } == {
+        offsets[0]: [offsets[0], offsets[1], offsets[3]],
+        offsets[2]: [offsets[2], offsets[4]],
+        offsets[7]: [offsets[7]],
+    }
+    assert [entry.offset for entry in others] == [offsets[5], offsets[6]]
+
+
+def test_pack_summary(tmp_path):
+    external = make_blob(b"ext" * 100)
+    store = MemoryObjectStore()
+    store.add_object(external)
+    tree = make_tree(external)
+    objects_spec = PARALLEL_OBJECTS_SPEC + [
+        (REF_DELTA, (external.id, b"ext" * 100 + b"!")),
+        (OFS_DELTA, (8, b"ext" * 100 + b"?")),
+        (Tree.type_num, tree.as_raw_string()),
+    ]
+    path, indexer = make_indexed_pack(tmp_path, objects_spec, store)
+
+    summary = PackSummary.from_index(indexer)
+    assert summary.object_counts == {Blob.type_num: 6, Tree.type_num: 1}
+    # deltas based on external objects, or on delta objects by their sha1
+    assert summary.unknown_type_count == 4
+    assert summary.object_count == 11
+    assert summary.delta_depths == {0: 4, 1: 2, 2: 1}
+    assert summary.decompressed_size == sum(
+        entry.decomp_len for entry in indexer.entries
+    )
+    assert summary.may_contain(Tree.type_num)
+    assert summary.may_contain(Commit.type_num)
+
+    # the types of deltas based on delta objects are resolved once these are
+    # inflated
+    def resolve_ext_ref(sha):
+        return Blob.type_num, [store[sha_to_hex(sha)].as_raw_string()]
+
+    with open(path, "rb") as f:
+        inflater = SwhPackInflater(
+            f.read(),
+            entries=indexer.entries,
+            offsets=indexer.offsets,
+            resolve_ext_ref=resolve_ext_ref,
+        )
+        objects = list(inflater)
+    indexer.add_object_offsets(inflater.offsets)
+    summary = PackSummary.from_index(indexer)
+    assert summary.object_counts == {Blob.type_num: 8, Tree.type_num: 1}
+    assert summary.unknown_type_count == 2
+    assert summary.delta_depths == {0: 4, 1: 2, 2: 2, 3: 1}
+    types = [(indexer.object_type(hex_to_sha(obj.id)), obj.type_num) for obj in objects]
+    # but those of the deltas based on the external object
+    assert sum(indexed is None for indexed, _ in types) == 2
+    assert all(indexed in (None, type_num) for indexed, type_num in types)
+
+    # otherwise, the types of all the objects are known
+    _, indexer = make_indexed_pack(tmp_path, PARALLEL_OBJECTS_SPEC[:5])
+    summary = PackSummary.from_index(indexer)
+    assert summary.object_counts == {Blob.type_num: 5}
+    assert summary.unknown_type_count == 0
+    assert not summary.may_contain(Commit.type_num)
+
+
+def test_pack_indexer_ref_delta_before_base(tmp_path):
+    blob = make_blob(b"foo" * 100)
+    objects_spec = [
+        (REF_DELTA, (2, b"foo" * 100 + b"bar")),
+        (OFS_DELTA, (0, b"foo" * 100 + b"barbaz")),
+        (Blob.type_num, blob.as_raw_string()),
+    ]
+    _, indexer = make_indexed_pack(tmp_path, objects_spec)
+    assert {
+        entry.offset: indexer.chains.get(entry.offset) for entry in indexer.entries
+    } == {
+        indexer.entries[0].offset: (Blob.type_num, 1),
+        indexer.entries[1].offset: (Blob.type_num, 2),
+        indexer.entries[2].offset: (Blob.type_num, 0),
+    }
+
+
+def test_parallel_inflater(tmp_path):
+    external = make_blob(b"ext" * 100)
+    store = MemoryObjectStore()
+    store.add_object(external)
+    objects_spec = PARALLEL_OBJECTS_SPEC + [
+        (REF_DELTA, (external.id, b"ext" * 100 + b"!"))
+    ]
+    path, indexer = make_indexed_pack(tmp_path, objects_spec, store)
+
+    def resolve_ext_ref(sha):
+        assert sha == external.sha().digest()
+        return (Blob.type_num, [external.as_raw_string()])
+
+    inflater = ParallelPackInflater(
+        path,
+        indexer.entries,
+        indexer.offsets,
+        processes=2,
+        resolve_ext_ref=resolve_ext_ref,
+        max_blob_size=1024,
+        batch_size=1,
+    )
+    objects = list(inflater)
+
+    expected = list(
+        SwhPackInflater(
+            make_pack(objects_spec, store)[1], resolve_ext_ref=resolve_ext_ref
+        )
+    )
+    assert sorted(obj.id for obj in objects) == sorted(obj.id for obj in expected)
+    assert [type(obj) for obj in objects].count(SkippedBlob) == 1
+    # offsets of the delta objects, inflated by the workers or not
+    assert sorted(inflater.delta_offsets.values()) == [
+        entry.offset
+        for entry in indexer.entries
+        if entry.pack_type_num in (OFS_DELTA, REF_DELTA)
+    ]
+
+
+def test_inflater_skips_large_blobs(monkeypatch):
+    # read pack entries by small chunks
+    monkeypatch.setattr("swh.loader.git.pack._STREAM_CHUNK_SIZE", 16)
+    large_data = bytes(range(256)) * 16
+    _, data = make_pack(
+        [
+            (Blob.type_num, b"small"),
+            (Blob.type_num, large_data),
+            # large blob used as a delta base
+            (Blob.type_num, b"y" * 4096),
+            (OFS_DELTA, (2, b"y" * 4096 + b"z")),
+        ]
+    )
+
+    objects = list(SwhPackInflater(data, max_blob_size=1024))
+
+    skipped = [obj for obj in objects if isinstance(obj, SkippedBlob)]
+    assert skipped == [
+        SkippedBlob({**MultiHash.from_data(blob_data).digest(), "length": 4096})
+        for blob_data in (large_data, b"y" * 4096)
+    ]
+    assert skipped[0].id == make_blob(large_data).id
+
+    inflated = {obj.as_raw_string() for obj in objects if isinstance(obj, ShaFile)}
+    assert inflated == {b"small", b"y" * 4096 + b"z"}
+
+
+def count_inflated_sizes(monkeypatch):
+    inflated_sizes = []
+    inflate_entry_data = pack.inflate_entry_data
+
+    def counting_inflate_entry_data(contents, pos, size, sink):
+        inflated_sizes.append(size)
+        return inflate_entry_data(contents, pos, size, sink)
+
+    monkeypatch.setattr(pack, "inflate_entry_data", counting_inflate_entry_data)
+    return inflated_sizes
+
+
+@pytest.mark.parametrize("indexed", [True, False], ids=["indexed", "not-indexed"])
+def test_inflater_inflates_large_ref_delta_base(monkeypatch, indexed):
+    base_data = b"y" * 4096
+    other_data = b"x" * 2048
+    _, data = make_pack(
+        [
+            (REF_DELTA, (2, base_data + b"z")),
+            (Blob.type_num, other_data),
+            (Blob.type_num, base_data),
+            (OFS_DELTA, (2, base_data + b"w")),
+        ]
+    )
+    indexer = PackIndexer()
+    indexer.write(data)
+    inflated_sizes = count_inflated_sizes(monkeypatch)
+
+    if indexed:
+        inflater = SwhPackInflater(
+            data,
+            entries=indexer.entries,
+            offsets=indexer.offsets,
+            max_blob_size=1024,
+            base_cache_size=0,
+        )
+    else:
+        inflater = SwhPackInflater(data, max_blob_size=1024, base_cache_size=0)
+    objects = list(inflater)
+
+    assert [obj.id for obj in objects] == [
+        make_blob(other_data).id,
+        make_blob(base_data).id,
+        make_blob(base_data + b"z").id,
+        make_blob(base_data + b"w").id,
+    ]
+    assert [type(obj) for obj in objects] == [SkippedBlob, SkippedBlob, Blob, Blob]
+    # the base is inflated once, and kept aside as it does not fit in the cache;
+    # entries are read once more when they were not indexed
+    assert inflated_sizes.count(len(base_data)) == (1 if indexed else 2)
+    assert inflated_sizes.count(len(other_data)) == 1
+    assert inflater.cache.misses == 0
+
+
+def test_inflater_reads_evicted_bases_back():
+    objects_spec = [
+        (Blob.type_num, b"foo" * 100),
+        (OFS_DELTA, (0, b"foo" * 100 + b"bar")),
+        (OFS_DELTA, (0, b"foo" * 100 + b"baz")),
+        (OFS_DELTA, (2, b"foo" * 100 + b"baz" + b"qux")),
+    ]
+    _, data = make_pack(objects_spec)
+    expected = [
+        b"foo" * 100,
+        b"foo" * 100 + b"baz",
+        b"foo" * 100 + b"baz" + b"qux",
+        b"foo" * 100 + b"bar",
+    ]
+
+    inflater = SwhPackInflater(data, base_cache_size=1000)
+    assert [obj.as_raw_string() for obj in inflater] == expected
+    assert inflater.cache.hits == 3 and inflater.cache.misses == 0
+
+    # the base of the third object evicts the first one, which is read back
+    inflater = SwhPackInflater(data, base_cache_size=500)
+    assert [obj.as_raw_string() for obj in inflater] == expected
+    assert inflater.cache.misses == 1
+
+
+def test_streaming_inflater():
+    objects_spec = [
+        (Blob.type_num, b"foo" * 100),
+        (OFS_DELTA, (0, b"foo" * 100 + b"bar")),
+        # base after the delta
+        (REF_DELTA, (3, b"bar" + b"foo" * 100)),
+        (Blob.type_num, b"baz" * 100),
+        # base before the delta
+        (REF_DELTA, (0, b"qux" + b"foo" * 100)),
+        # base waiting for its own base
+        (OFS_DELTA, (2, b"bar" + b"foo" * 101)),
+        (Blob.type_num, b"y" * 4096),
+    ]
+    buffer = io.BytesIO()
+    build_pack(buffer, objects_spec)
+    data = buffer.getvalue()
+
+    stream = PackStream(max_size=1024)
+
+    def download():
+        for i in range(0, len(data), 7):
+            stream.write(data[i : i + 7])
+        stream.finish()
+
+    thread = threading.Thread(target=download)
+    thread.start()
+    # without cache, delta bases are read back from the pack
+    inflater = StreamingPackInflater(stream, max_blob_size=1024, base_cache_size=0)
+    objects = list(inflater)
+    thread.join()
+
+    expected = list(PackInflater.for_pack_data(make_pack_data(objects_spec)))
+    assert sorted(obj.id for obj in objects) == sorted(obj.id for obj in expected)
+    assert [type(obj) for obj in objects].count(SkippedBlob) == 1
+
+    # objects are yielded as soon as their base is available
+    assert [obj.as_raw_string() for obj in objects[:3]] == [
+        b"foo" * 100,
+        b"foo" * 100 + b"bar",
+        b"baz" * 100,
+    ]
+
+
+def test_delta_base_cache():
+    cache = DeltaBaseCache(max_size=10)
+    cache.add(0, (Blob.type_num, b"foo"))
+    cache.add(b"sha", (Blob.type_num, b"barbaz"))
+    assert cache.get(0) == (Blob.type_num, b"foo")
+    # evicts the least recently used object
+    cache.add(1, (Blob.type_num, b"qux"))
+    assert cache.get(b"sha") is None
+    assert cache.get(0) == (Blob.type_num, b"foo")
+    assert (cache.hits, cache.misses) == (2, 1)
+
+
+def test_streaming_inflater_external_bases():
+    base = make_blob(b"foo" * 100)
+    store = MemoryObjectStore()
+    store.add_object(base)
+    buffer = io.BytesIO()
+    build_pack(
+        buffer,
+        [
+            (REF_DELTA, (base.id, b"foo" * 100 + b"bar")),
+            (REF_DELTA, (base.id, b"bar" + b"foo" * 100)),
+        ],
+        store,
+    )
+    stream = PackStream(max_size=1024)
+    stream.write(buffer.getvalue())
+    stream.finish()
+
+    resolved = []
+
+    def resolve_ext_ref(sha):
+        resolved.append(sha)
+        return (Blob.type_num, [base.as_raw_string()])
+
+    # evicted external bases are resolved again
+    inflater = StreamingPackInflater(
+        stream, resolve_ext_ref=resolve_ext_ref, base_cache_size=0
+    )
+    assert [obj.as_raw_string() for obj in inflater] == [
+        b"bar" + b"foo" * 100,
+        b"foo" * 100 + b"bar",
+    ]
+    assert len(resolved) > 1 and set(resolved) == {base.sha().digest()}
+
+    resolved.clear()
+    inflater = StreamingPackInflater(stream, resolve_ext_ref=resolve_ext_ref)
+    assert len(list(inflater)) == 2
+    assert resolved == [base.sha().digest()]
+    assert inflater.cache.hits > 0
+
+
+def test_streaming_inflater_ref_delta_base_in_pack(monkeypatch):
+    large_data = bytes(range(256)) * 16
+    objects_spec = [
+        (Blob.type_num, large_data),
+        (Blob.type_num, b"foo" * 100),
+        (Blob.type_num, b"bar" * 100),
+        # base before the delta, yielded while no delta was pending
+        (REF_DELTA, (1, b"foo" * 100 + b"baz")),
+    ]
+    buffer = io.BytesIO()
+    build_pack(buffer, objects_spec)
+    stream = PackStream(max_size=1024)
+    stream.write(buffer.getvalue())
+    stream.finish()
+
+    inflated_sizes = count_inflated_sizes(monkeypatch)
+
+    def resolve_ext_ref(sha):
+        raise AssertionError("external reference resolved")
+
+    def prefetch_ext_refs(shas):
+        raise AssertionError("external references prefetched")
+
+    inflater = StreamingPackInflater(
+        stream,
+        resolve_ext_ref=resolve_ext_ref,
+        prefetch_ext_refs=prefetch_ext_refs,
+        max_blob_size=1024,
+    )
+    objects = list(inflater)
+
+    # the delta is resolved as soon as it is read, from the cached base
+    assert [obj.as_raw_string() for obj in objects[1:]] == [
+        b"foo" * 100,
+        b"bar" * 100,
+        b"foo" * 100 + b"baz",
+    ]
+    assert isinstance(objects[0], SkippedBlob)
+    # each entry is inflated once, and the large blob is only hashed
+    assert len(inflated_sizes) == len(objects_spec)
+    assert inflated_sizes.count(len(large_data)) == 1
+
+
+def test_streaming_inflater_download_error():
+    stream = PackStream(max_size=1024)
+    stream.write(b"PACK")
+    stream.finish(error=IOError("connection reset"))
+
+    with pytest.raises(IOError, match="connection reset"):
+        list(StreamingPackInflater(stream))
@@ -3,6 +3,8 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+from concurrent.futures import ThreadPoolExecutor
+
 from dulwich.client import HTTPUnauthorized
 from dulwich.errors import GitProtocolError, NotGitRepository
 import pytest
@@ -90,3 +92,101 @@ def test_raise_not_found_repository_raised_back(exception):
     with pytest.raises(exception, match="raised back"):
         with utils.raise_not_found_repository():
             raise exc
+
+
+def test_map_in_batches():
+    consumed = []
+
+    def items():
+        for i in range(20):
+            consumed.append(i)
+            yield i
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = utils.map_in_batches(
+            executor,
+            lambda i: i * 2,
+            items(),
+            size=lambda i: 10,
+            batch_bytes=30,
+            max_pending_bytes=60,
+        )
+        assert next(results) == 0
+        # the first batch was yielded once the third one was ready to be submitted
+        assert len(consumed) == 9
+        assert list(results) == [i * 2 for i in range(1, 20)]
+
+        def fail(i):
+            raise ValueError(i)
+
+        with pytest.raises(ValueError):
+            list(utils.map_in_batches(executor, fail, range(5), lambda i: 1, 1, 1))
+
+
+def test_pool_manager_cache(mocker):
+    mock_time = mocker.patch("swh.loader.git.utils.time.monotonic", return_value=0)
+    cache = utils.PoolManagerCache(max_size=2, max_idle=10)
+
+    github = cache.get("https://github.com/foo/bar", cert_reqs="CERT_NONE")
+    assert cache.get("https://github.com/baz/qux", cert_reqs="CERT_NONE") is github
+    assert cache.get("https://github.com/foo/bar") is not github
+    gitlab = cache.get("https://gitlab.com/foo/bar")
+
+    # least recently used manager was evicted
+    assert len(cache.managers) == 2
+    assert cache.get("https://github.com/foo/bar", cert_reqs="CERT_NONE") is not github
+
+    # idle managers are evicted
+    mock_time.return_value = 11
+    assert cache.get("https://gitlab.com/foo/bar") is not gitlab
+    assert len(cache.managers) == 1
+
+    cache.clear()
+    assert not cache.managers
+
+
+def test_filter_ref_prefixes():
+    refs = {
+        b"HEAD": b"0" * 40,
+        b"refs/heads/master": b"1" * 40,
+        b"refs/tags/v1.0": b"2" * 40,
+        b"refs/pull/42/head": b"3" * 40,
+    }
+    assert utils.filter_ref_prefixes(refs, None) == refs
+    assert set(
+        utils.filter_ref_prefixes(refs, (b"HEAD", b"refs/heads/", b"refs/tags/"))
+    ) == {b"HEAD", b"refs/heads/master", b"refs/tags/v1.0"}
+
+
+def test_fetch_progress(mocker):
+    progress = utils.FetchProgress()
+    assert progress.feed(
+        b"Enumerating objects: 12, done.\nCounting objects:  50% (2/4)\rCounting obj"
+    ) == [b"Enumerating objects: 12, done.\n", b"Counting objects:  50% (2/4)\r"]
+    assert progress.feed(b"ects: 100% (4/4), done.\r\nTotal 12 (delta 3), reused") == [
+        b"Counting objects: 100% (4/4), done.\r\n"
+    ]
+    assert progress.flush() == b"Total 12 (delta 3), reused"
+    assert progress.flush() == b""
+    assert progress.objects == {
+        "enumerating": 12,
+        "counting": 4,
+        "total": 12,
+        "deltas": 3,
+    }
+
+    progress.start_time = 7.0
+    mocker.patch.object(utils.time, "monotonic", side_effect=[10.0, 11.0, 12.0])
+    for size in (100, 200, 100):
+        progress.pack_data_received(size)
+
+    statsd = mocker.MagicMock()
+    progress.report(statsd)
+    assert statsd.gauge.mock_calls == [
+        mocker.call("swh_loader_git_server_objects", 12, tags={"phase": "enumerating"}),
+        mocker.call("swh_loader_git_server_objects", 4, tags={"phase": "counting"}),
+        mocker.call("swh_loader_git_server_objects", 12, tags={"phase": "total"}),
+        mocker.call("swh_loader_git_server_objects", 3, tags={"phase": "deltas"}),
+        mocker.call("swh_loader_git_server_preparation_seconds", 3.0, tags={}),
+        mocker.call("swh_loader_git_transfer_bytes_per_second", 200.0, tags={}),
+    ]
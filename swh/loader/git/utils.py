@@ -5,24 +5,49 @@
 
 """Utilities helper functions"""
 
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, Future
 from contextlib import contextmanager
 import datetime
 import logging
 import os
+import re
 import shutil
 import tempfile
+import threading
 import time
-from typing import Dict, Mapping, Optional
-
-from dulwich.client import HTTPUnauthorized
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+import urllib.parse
+
+from dulwich.client import HTTPUnauthorized, default_urllib3_manager
 from dulwich.errors import GitProtocolError, NotGitRepository
 from dulwich.objects import ObjectID
 from dulwich.refs import Ref
 
 from swh.core import tarball
+from swh.core.statsd import Statsd
 from swh.loader.exception import NotFound
 from swh.model.model import SnapshotBranch
 
+from .pack import PackIndexer, PackStream
+
+T = TypeVar("T")
+R = TypeVar("R")
+
 
 def init_git_repo_from_archive(project_name, archive_path, root_temp_dir="/tmp"):
     """Given a path to an archive containing a git repository.
@@ -128,6 +153,15 @@ def filter_symbolic_refs(
     }
 
 
+def filter_ref_prefixes(
+    refs: Mapping[Ref, T], prefixes: Optional[Tuple[bytes, ...]]
+) -> Mapping[Ref, T]:
+    """Only keep the refs starting with one of `prefixes`, if set"""
+    if prefixes is None:
+        return refs
+    return {name: target for name, target in refs.items() if name.startswith(prefixes)}
+
+
 def warn_dangling_branches(
     branches: Dict[bytes, Optional[SnapshotBranch]],
     dangling_branches: Dict[Ref, Ref],
@@ -184,25 +218,157 @@ def raise_not_found_repository():
         raise
 
 
+def _map_batch(func: Callable[[T], R], batch: List[T]) -> List[R]:
+    return [func(item) for item in batch]
+
+
+def map_in_batches(
+    executor: Executor,
+    func: Callable[[T], R],
+    items: Iterable[T],
+    size: Callable[[T], int],
+    batch_bytes: int,
+    max_pending_bytes: int,
+) -> Iterator[R]:
+    """Apply `func` to `items` in `executor`, yielding the results in the order
+    of `items`.
+
+    Items are submitted by batches of about `batch_bytes`, according to their
+    `size`. The items of the batches submitted but whose results were not yielded
+    yet sum up to at most `max_pending_bytes`, or to a single batch. Unlike
+    :meth:`Executor.map`, `items` is therefore consumed lazily.
+
+    With a :class:`ProcessPoolExecutor`, `func` and `items` must be picklable.
+    """
+    pending: Deque[Tuple["Future[List[R]]", int]] = deque()
+    pending_bytes = 0
+
+    def submit(batch: List[T], batch_size: int) -> Iterator[R]:
+        nonlocal pending_bytes
+        while pending and pending_bytes + batch_size > max_pending_bytes:
+            future, future_size = pending.popleft()
+            pending_bytes -= future_size
+            yield from future.result()
+        pending.append((executor.submit(_map_batch, func, batch), batch_size))
+        pending_bytes += batch_size
+
+    try:
+        batch: List[T] = []
+        batch_size = 0
+        for item in items:
+            batch.append(item)
+            batch_size += size(item)
+            if batch_size >= batch_bytes:
+                yield from submit(batch, batch_size)
+                batch = []
+                batch_size = 0
+        if batch:
+            yield from submit(batch, batch_size)
+        while pending:
+            future, _ = pending.popleft()
+            yield from future.result()
+    finally:
+        for future, _ in pending:
+            future.cancel()
+
+
+class PoolManagerCache:
+    """Worker-level cache of the urllib3 pool managers used to fetch packs over
+    HTTP(S), so that consecutive loads of origins hosted on the same forge reuse
+    its keep-alive connections instead of opening new ones.
+
+    Pool managers are keyed by scheme, host and port of the origin URL, and by
+    the keyword arguments they are built with (timeouts, TLS settings...).
+    Managers unused for more than ``max_idle`` seconds are dropped, as well as
+    the least recently used ones once more than ``max_size`` are cached; their
+    connections are closed.
+    """
+
+    def __init__(self, max_size: int = 64, max_idle: float = 300.0):
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        # pool manager and last time it was used, by key
+        self.managers: OrderedDict[Hashable, Tuple[Any, float]] = OrderedDict()
+
+    @staticmethod
+    def key(url: str, kwargs: Mapping[str, Any]) -> Hashable:
+        parsed = urllib.parse.urlsplit(url)
+        # timeouts are not hashable, but have a stable representation
+        settings = tuple(sorted((name, repr(value)) for name, value in kwargs.items()))
+        return (parsed.scheme, parsed.hostname, parsed.port, settings)
+
+    def get(self, url: str, **kwargs: Any) -> Any:
+        """Return a pool manager suitable to fetch `url`, built by
+        :func:`dulwich.client.default_urllib3_manager` with `kwargs` unless a
+        cached one can be reused."""
+        key = self.key(url, kwargs)
+        now = time.monotonic()
+        with self.lock:
+            self._evict(now)
+            entry = self.managers.pop(key, None)
+            if entry is None:
+                manager = default_urllib3_manager(config=None, **kwargs)
+            else:
+                manager = entry[0]
+            self.managers[key] = (manager, now)
+            while len(self.managers) > self.max_size:
+                _, (evicted, _) = self.managers.popitem(last=False)
+                evicted.clear()
+        return manager
+
+    def _evict(self, now: float) -> None:
+        # entries are sorted by last use
+        while self.managers:
+            key, (manager, last_used) = next(iter(self.managers.items()))
+            if now - last_used <= self.max_idle:
+                break
+            del self.managers[key]
+            manager.clear()
+
+    def clear(self) -> None:
+        """Drop all the cached pool managers and close their connections"""
+        with self.lock:
+            for manager, _ in self.managers.values():
+                manager.clear()
+            self.managers.clear()
+
+
+POOL_MANAGERS = PoolManagerCache()
+"""Pool managers shared by all the loaders of the current process"""
+
+
 # How often to log messages for long-running operations, in seconds
 LOGGING_INTERVAL = 30
 
 
+class PackSizeLimitExceeded(IOError):
+    """The pack file of a repository is larger than the configured limit"""
+
+
 class PackWriter:
     """Helper class to abort git loading if pack file currently downloaded
-    has a size in bytes that exceeds a given threshold."""
+    has a size in bytes that exceeds a given threshold, or if its entries, as
+    parsed by the `indexer`, would be inflated to more than
+    `decompressed_size_limit` bytes."""
 
     def __init__(
         self,
-        pack_buffer: tempfile.SpooledTemporaryFile,
+        pack_buffer: Union[tempfile.SpooledTemporaryFile, PackStream],
         size_limit: int,
         origin_url: str,
         fetch_pack_logger: logging.Logger,
+        progress: Optional["FetchProgress"] = None,
+        indexer: Optional[PackIndexer] = None,
+        decompressed_size_limit: Optional[int] = None,
     ):
         self.pack_buffer = pack_buffer
         self.size_limit = size_limit
+        self.decompressed_size_limit = decompressed_size_limit
         self.origin_url = origin_url
         self.fetch_pack_logger = fetch_pack_logger
+        self.progress = progress
+        self.indexer = indexer
         self.last_time_logged = time.monotonic()
 
     def write(self, data: bytes):
@@ -210,7 +376,7 @@ class PackWriter:
         would_write = len(data)
         fetched = cur_size + would_write
         if fetched > self.size_limit:
-            raise IOError(
+            raise PackSizeLimitExceeded(
                 f"Pack file too big for repository {self.origin_url}, "
                 f"limit is {self.size_limit} bytes, current size is {cur_size}, "
                 f"would write {would_write}"
@@ -225,3 +391,120 @@ class PackWriter:
             self.last_time_logged = time.monotonic()
 
         self.pack_buffer.write(data)
+        if self.indexer is not None:
+            self.indexer.write(data)
+            if (
+                self.decompressed_size_limit is not None
+                and self.indexer.decompressed_size > self.decompressed_size_limit
+            ):
+                raise PackSizeLimitExceeded(
+                    f"Pack file too big for repository {self.origin_url}, "
+                    f"limit is {self.decompressed_size_limit} decompressed bytes, "
+                    f"current decompressed size is {self.indexer.decompressed_size}"
+                )
+        if self.progress is not None:
+            self.progress.pack_data_received(len(data))
+
+
+# End of a line of progress messages; git servers end lines updating the same
+# counter with a carriage return
+_LINE_END_RE = re.compile(rb"\r\n|\r|\n")
+
+# Progress of a phase of the server work, e.g. "Counting objects:  50% (2/4)" or
+# "Enumerating objects: 1234, done."
+_PROGRESS_RE = re.compile(
+    rb"(?P<phase>[A-Z][a-z]+) objects: +(?:\d+% \(\d+/(?P<total>\d+)\)|(?P<count>\d+))"
+)
+
+# Summary of the packfile sent by the server, e.g. "Total 12 (delta 3), reused..."
+_TOTAL_RE = re.compile(rb"Total (?P<total>\d+) \(delta (?P<deltas>\d+)\)")
+
+
+def consume_lines(buffer: bytearray) -> List[bytes]:
+    """Remove the complete lines at the start of `buffer`, and return them with
+    their line terminator (``b"\\r"``, ``b"\\n"`` or ``b"\\r\\n"``)."""
+    lines = []
+    start = 0
+    for match in _LINE_END_RE.finditer(buffer):
+        lines.append(bytes(buffer[start : match.end()]))
+        start = match.end()
+    del buffer[:start]
+    return lines
+
+
+class FetchProgress:
+    """Progress of a fetch, as reported by the progress messages of the server
+    and measured while receiving the packfile.
+
+    Messages are split in lines by :meth:`feed`, which keeps the beginning of the
+    last line in a buffer until it is terminated, and parses the object counters
+    of the server out of them. :meth:`report` sends them to statsd as gauges, along
+    with:
+
+    * ``swh_loader_git_server_preparation_seconds``: time between the start of
+      the fetch and the first bytes of the packfile, mostly spent by the server
+      enumerating and compressing objects
+    * ``swh_loader_git_transfer_bytes_per_second``: throughput of the packfile
+      transfer
+    * ``swh_loader_git_server_objects``: number of objects, tagged by ``phase``
+      (``enumerating``, ``counting`` and ``compressing``, as well as ``total`` and
+      ``deltas`` for the objects sent in the packfile)
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.start_time = time.monotonic()
+        self.first_data_time: Optional[float] = None
+        self.last_data_time: Optional[float] = None
+        self.pack_size = 0
+        self.objects: Dict[str, int] = {}
+
+    def feed(self, msg: bytes) -> List[bytes]:
+        """Add a progress message from the server, and return the lines it
+        terminates."""
+        self.buffer += msg
+        lines = consume_lines(self.buffer)
+        for line in lines:
+            self.parse(line)
+        return lines
+
+    def flush(self) -> bytes:
+        """Return the unterminated end of the progress messages"""
+        line = bytes(self.buffer)
+        self.buffer.clear()
+        self.parse(line)
+        return line
+
+    def parse(self, line: bytes) -> None:
+        if match := _PROGRESS_RE.search(line):
+            phase = match["phase"].decode().lower()
+            self.objects[phase] = int(match["total"] or match["count"])
+        elif match := _TOTAL_RE.search(line):
+            self.objects["total"] = int(match["total"])
+            self.objects["deltas"] = int(match["deltas"])
+
+    def pack_data_received(self, size: int) -> None:
+        now = time.monotonic()
+        if self.first_data_time is None:
+            self.first_data_time = now
+        self.last_data_time = now
+        self.pack_size += size
+
+    def report(self, statsd: Statsd) -> None:
+        """Send the progress of the fetch to `statsd`"""
+        for phase, count in self.objects.items():
+            statsd.gauge("swh_loader_git_server_objects", count, tags={"phase": phase})
+        if self.first_data_time is None or self.last_data_time is None:
+            return
+        statsd.gauge(
+            "swh_loader_git_server_preparation_seconds",
+            self.first_data_time - self.start_time,
+            tags={},
+        )
+        transfer_time = self.last_data_time - self.first_data_time
+        if transfer_time > 0:
+            statsd.gauge(
+                "swh_loader_git_transfer_bytes_per_second",
+                self.pack_size / transfer_time,
+                tags={},
+            )